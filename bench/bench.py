@@ -0,0 +1,322 @@
+__doc__ = '''python bench.py [ARGS]
+
+OVERVIEW
+
+    Benchmarks `frosty install` on a synthetic project, against a local
+    registry and a fake npm (see fixtures.py and fake_npm.py), so that runs
+    are reproducible and need neither network nor node. Scenarios, run in
+    this order:
+
+    cold     empty cache and node_modules, every module is downloaded
+    warm     cached modules, no node_modules
+    change   one top level dependency moved to a new patch version, with
+             the node_modules of the warm install and --incremental
+    offline  cached modules, no node_modules, --offline
+
+    For every scenario the wall time, the files and bytes written to the
+    project and the cache, the peak RSS of frosty and the npm runs are
+    reported. --json saves the results, --compare checks them against
+    saved ones and fails when a scenario got slower or bigger.
+
+'''
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCH_DIR), 'src')
+sys.path.insert(0, SRC_DIR)
+
+from fixtures import FixtureGenerator
+from log import Log
+from remote_server import RemoteCacheServer
+from util import make_dirs
+
+
+SCENARIOS = ['cold', 'warm', 'change', 'offline']
+
+# reported per scenario, in this order
+METRICS = ['wall', 'files', 'bytes', 'rss', 'npm']
+
+
+class Benchmark(object):
+    """Runs the scenarios in a work directory
+
+    Args:
+        work_dir (str): Directory for the fixtures, project and cache.
+        generator ([FixtureGenerator]): Synthetic project to install.
+        python (str): Interpreter running frosty.
+        frosty_args (list): Extra arguments of every `frosty install`.
+        npm_delay (float): Seconds of startup time of each npm run.
+
+    """
+
+    def __init__(self, work_dir, generator, python=sys.executable, frosty_args=None, npm_delay=0.0):
+        self.work_dir = os.path.abspath(work_dir)
+        self.generator = generator
+        self.python = python
+        self.frosty_args = frosty_args or []
+        self.npm_delay = npm_delay
+
+        self.fixtures_dir = os.path.join(self.work_dir, 'fixtures')
+        self.project_dir = os.path.join(self.work_dir, 'project')
+        self.cache_dir = os.path.join(self.work_dir, 'cache')
+        self.bin_dir = os.path.join(self.work_dir, 'bin')
+        self.npm_log = os.path.join(self.work_dir, 'npm.log')
+        self.registry = None
+
+
+    def setup(self):
+        """Generate the fixtures and put the fake npm first in PATH"""
+        Log.info('Generating fixtures in %s', self.fixtures_dir)
+        summary = self.generator.generate(self.fixtures_dir)
+        Log.info('%s modules in the shrinkwrap, %s tarballs of %.1f MB', summary['modules'], summary['tarballs'],
+                 summary['bytes'] / 1048576.0)
+
+        make_dirs(self.bin_dir)
+        npm_path = os.path.join(self.bin_dir, 'npm')
+        with open(npm_path, 'w') as file:
+            file.write('#!/bin/sh\nPYTHONPATH="%s" exec "%s" "%s" "$@"\n' %
+                       (SRC_DIR, self.python, os.path.join(BENCH_DIR, 'fake_npm.py')))
+        os.chmod(npm_path, 0o755)
+
+        return summary
+
+
+    def run(self):
+        """Run every scenario once
+
+        Returns:
+            dict: {scenario: {metric: value}}
+        """
+        # any static file server will do as registry, tarballs are stored
+        # at the paths found in the shrinkwrap
+        server = RemoteCacheServer(os.path.join(self.fixtures_dir, 'registry'))
+        server.start()
+        self.registry = server.url
+
+        try:
+            return dict((scenario, getattr(self, 'run_' + scenario)()) for scenario in SCENARIOS)
+        finally:
+            server.stop()
+
+
+    def run_cold(self):
+        for path in (self.project_dir, self.cache_dir):
+            if os.path.exists(path):
+                shutil.rmtree(path)
+
+        make_dirs(self.project_dir)
+        self.use_shrinkwrap('npm-shrinkwrap.json')
+        return self.measure('cold')
+
+
+    def run_warm(self):
+        shutil.rmtree(os.path.join(self.project_dir, 'node_modules'))
+        return self.measure('warm')
+
+
+    def run_change(self):
+        self.use_shrinkwrap('npm-shrinkwrap.changed.json')
+        return self.measure('change', ['--incremental'])
+
+
+    def run_offline(self):
+        shutil.rmtree(os.path.join(self.project_dir, 'node_modules'))
+        return self.measure('offline', ['--offline'])
+
+
+    def use_shrinkwrap(self, file_name):
+        shutil.copyfile(os.path.join(self.fixtures_dir, file_name), os.path.join(self.project_dir, 'npm-shrinkwrap.json'))
+
+
+    def measure(self, scenario, args=None):
+        """Run `frosty install` and return what it cost"""
+        before = Benchmark.snapshot(self.project_dir, self.cache_dir)
+        with open(self.npm_log, 'w'):
+            pass
+
+        cmd = [self.python, os.path.join(SRC_DIR, 'frosty.py'), 'install', '--cwd', self.project_dir,
+               '--cache-dir', self.cache_dir, '--registry', self.registry] + (args or []) + self.frosty_args
+        env = dict(os.environ)
+        env['PATH'] = self.bin_dir + os.pathsep + env.get('PATH', '')
+        env['FROSTY_BENCH_NPM_LOG'] = self.npm_log
+        env['FROSTY_BENCH_NPM_DELAY'] = str(self.npm_delay)
+
+        log_path = os.path.join(self.work_dir, '%s.log' % scenario)
+        with open(log_path, 'w') as log:
+            start = time.time()
+            process = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT, env=env)
+            # wait4 reports the resources of frosty and the npm runs it waited for,
+            # not of every child of this process like getrusage
+            (_, status, usage) = os.wait4(process.pid, 0)
+            wall = time.time() - start
+
+        if not os.WIFEXITED(status) or os.WEXITSTATUS(status) != 0:
+            raise RuntimeError('frosty install failed in scenario %s, see %s' % (scenario, log_path))
+
+        after = Benchmark.snapshot(self.project_dir, self.cache_dir)
+        written = [path for (path, stat) in after.items() if before.get(path) != stat]
+
+        with open(self.npm_log) as file:
+            npm_runs = len(file.readlines())
+
+        # ru_maxrss is in kilobytes, but in bytes on macOS
+        rss = usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+        return {
+            'wall': wall,
+            'files': len(written),
+            'bytes': sum(after[path][1] for path in written),
+            'rss': rss,
+            'npm': npm_runs,
+        }
+
+
+    @staticmethod
+    def snapshot(*paths):
+        """Return {path: (inode, size, mtime, ctime)} of the regular files below paths
+
+        Copies keep the mtime of the cache and may reuse the inode of a file
+        deleted just before, only the ctime tells a rewritten file apart.
+        """
+        files = {}
+
+        for path in paths:
+            for (root, dirs, names) in os.walk(path):
+                for name in names:
+                    file_path = os.path.join(root, name)
+                    stat = os.lstat(file_path)
+                    if not os.path.islink(file_path):
+                        files[file_path] = (stat.st_ino, stat.st_size, stat.st_mtime, stat.st_ctime)
+
+        return files
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2.0
+
+
+def summarize(runs):
+    """Return the median of every metric of every scenario over several runs"""
+    return dict((scenario, dict((metric, median([run[scenario][metric] for run in runs])) for metric in METRICS))
+                for scenario in SCENARIOS)
+
+
+def compare(results, baseline, threshold):
+    """Return the metrics which grew by more than threshold over the baseline"""
+    regressions = []
+
+    for scenario in SCENARIOS:
+        for metric in METRICS:
+            old = baseline[scenario][metric]
+            new = results[scenario][metric]
+            if new > old * (1 + threshold):
+                regressions.append('%s %s: %s -> %s (%+.0f%%)' % (
+                    scenario, metric, format_metric(metric, old), format_metric(metric, new),
+                    100.0 * (new - old) / old if old else 100.0))
+
+    return regressions
+
+
+def format_metric(metric, value):
+    if metric == 'wall':
+        return '%.2fs' % value
+    if metric in ('bytes', 'rss'):
+        return '%.1f MB' % (value / 1048576.0)
+    return '%d' % value
+
+
+def print_results(results):
+    print('%-10s %10s %10s %12s %12s %6s' % ('scenario', 'wall', 'files', 'written', 'peak RSS', 'npm'))
+    for scenario in SCENARIOS:
+        result = results[scenario]
+        print('%-10s %10s %10s %12s %12s %6s' % ((scenario,) + tuple(format_metric(metric, result[metric])
+                                                                      for metric in METRICS)))
+
+
+def parse_cli_args():
+    parser = argparse.ArgumentParser(usage=__doc__)
+
+    parser.add_argument('--size', type=int, default=300, help='modules in the shrinkwrap, counting nested copies')
+    parser.add_argument('--depth', type=int, default=5, help='deepest node_modules nesting')
+    parser.add_argument('--fanout', type=int, default=4, help='most dependencies of a package')
+    parser.add_argument('--roots', type=int, default=20, help='dependencies of the project itself')
+    parser.add_argument('--files', type=int, default=10, help='files per package')
+    parser.add_argument('--file-size', type=int, default=2048, help='average size of these files in bytes')
+    parser.add_argument('--scripts', type=float, default=0.05, help='share of packages with an install script')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the generated project')
+    parser.add_argument('--repeat', type=int, default=1, help='run the scenarios N times and report medians')
+    parser.add_argument('--npm-delay', type=float, default=0.0, help='seconds of startup time of each fake npm run')
+    parser.add_argument('--python', default=sys.executable, help='interpreter running frosty')
+    parser.add_argument('--work-dir', help='keep fixtures, project, cache and logs in this directory')
+    parser.add_argument('--json', metavar='FILE', help='save the results to FILE')
+    parser.add_argument('--compare', metavar='FILE', help='fail if a metric grew past --threshold over the results in FILE')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed growth of a metric, 0.25 is 25%%')
+
+    (args, frosty_args) = parser.parse_known_args()
+    args.frosty_args = frosty_args
+    if args.repeat < 1 or args.size < 1 or args.depth < 1 or args.roots < 1:
+        parser.error('--repeat, --size, --depth and --roots must be at least 1')
+
+    return args
+
+
+def main():
+    args = parse_cli_args()
+    generator = FixtureGenerator(args.size, args.depth, args.fanout, args.roots, args.files, args.file_size,
+                                 args.scripts, args.seed)
+    params = dict(generator.get_params(), frosty_args=args.frosty_args, npm_delay=args.npm_delay)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if baseline['params'] != params:
+            raise RuntimeError('%s was measured with other parameters: %s' % (args.compare, baseline['params']))
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='frosty-bench-')
+    benchmark = Benchmark(work_dir, generator, args.python, args.frosty_args, args.npm_delay)
+
+    try:
+        benchmark.setup()
+        runs = []
+        for index in range(args.repeat):
+            Log.info('Run %s of %s', index + 1, args.repeat)
+            runs.append(benchmark.run())
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir)
+
+    results = summarize(runs)
+    print_results(results)
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({'params': params, 'results': results}, file, indent=2, sort_keys=True)
+
+    if baseline is not None:
+        regressions = compare(results, baseline['results'], args.threshold)
+        for regression in regressions:
+            Log.error('Regression: %s', regression)
+        if regressions:
+            return 1
+        Log.info('No metric grew more than %.0f%% over %s', args.threshold * 100, args.compare)
+
+    return 0
+
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main())
+    except RuntimeError as e:
+        Log.error('%s', e)
+        sys.exit(1)
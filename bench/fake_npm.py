@@ -0,0 +1,113 @@
+__doc__ = '''python fake_npm.py [--prefix DIR] [--registry URL] COMMAND [ARGS]
+
+    Stands in for npm during benchmarks, so that installs do not depend
+    on node, npm or the network. Supports what frosty runs:
+
+    install URL...      extract each tarball to DIR/node_modules/<name>, and
+                        simulate the install script, if any, by writing a
+                        compiled addon to build/Release
+    info SPEC os        print nothing, no module is macOS only
+
+    FROSTY_BENCH_NPM_DELAY adds seconds of startup time to every run, and
+    each run is logged as one line to FROSTY_BENCH_NPM_LOG, if set.
+
+'''
+
+import json
+import os
+import shutil
+import sys
+import tarfile
+import time
+
+try:
+    from urllib2 import urlopen
+except ImportError:
+    from urllib.request import urlopen
+
+from fixtures import DEFAULT_REGISTRY
+
+
+# options of npm followed by a value
+VALUE_OPTIONS = ('--prefix', '--registry', '--proxy', '--https-proxy')
+
+
+def parse_args(argv):
+    options = {}
+    args = []
+    index = 0
+
+    while index < len(argv):
+        arg = argv[index]
+        if arg in VALUE_OPTIONS:
+            options[arg[2:]] = argv[index + 1]
+            index = index + 2
+            continue
+        if arg[0:2] != '--':
+            args.append(arg)
+        index = index + 1
+
+    return options, args
+
+
+def install(url, prefix_dir, registry):
+    if registry and url.startswith(DEFAULT_REGISTRY + '/'):
+        url = registry.rstrip('/') + url[len(DEFAULT_REGISTRY):]
+
+    extract_dir = os.path.join(prefix_dir, '.fake-npm')
+    if os.path.exists(extract_dir):
+        shutil.rmtree(extract_dir)
+
+    response = urlopen(url)
+    try:
+        with tarfile.open(fileobj=response, mode='r|gz') as tar:
+            tar.extractall(extract_dir)
+    finally:
+        response.close()
+
+    package_dir = os.path.join(extract_dir, 'package')
+    with open(os.path.join(package_dir, 'package.json')) as file:
+        package = json.load(file)
+
+    if 'install' in (package.get('scripts', None) or {}):
+        os.makedirs(os.path.join(package_dir, 'build', 'Release'))
+        with open(os.path.join(package_dir, 'build', 'Release', 'addon.node'), 'wb') as file:
+            file.write(b'\0' * 4096)
+
+    module_dir = os.path.join(prefix_dir, 'node_modules', package['name'])
+    if os.path.exists(module_dir):
+        shutil.rmtree(module_dir)
+    if not os.path.isdir(os.path.dirname(module_dir)):
+        os.makedirs(os.path.dirname(module_dir))
+
+    os.rename(package_dir, module_dir)
+    shutil.rmtree(extract_dir)
+
+
+def main(argv):
+    if os.environ.get('FROSTY_BENCH_NPM_LOG'):
+        with open(os.environ['FROSTY_BENCH_NPM_LOG'], 'a') as file:
+            file.write(' '.join(argv) + '\n')
+
+    time.sleep(float(os.environ.get('FROSTY_BENCH_NPM_DELAY') or 0))
+    (options, args) = parse_args(argv)
+
+    if args[0:1] == ['info']:
+        return 0
+
+    if args[0:1] == ['install'] and len(args) > 1:
+        prefix_dir = options.get('prefix', os.getcwd())
+        for url in args[1:]:
+            try:
+                install(url, prefix_dir, options.get('registry'))
+            except (IOError, OSError, tarfile.TarError) as e:
+                sys.stderr.write('npm ERR! cannot install %s: %s\n' % (url, e))
+                return 1
+        return 0
+
+    sys.stderr.write('npm ERR! unsupported command: %s\n' % ' '.join(args))
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,214 @@
+import copy
+import gzip
+import io
+import json
+import os
+import random
+import tarfile
+
+from util import make_dirs
+
+
+# versions every synthetic package is published in, a random subset each
+VERSIONS = ['1.0.0', '1.1.0', '2.0.0']
+
+# modification time of every file in the generated tarballs
+FIXTURE_MTIME = 1500000000
+
+# registry frosty rewrites to --registry, like real shrinkwraps
+DEFAULT_REGISTRY = 'https://registry.npmjs.org'
+
+
+class FixtureGenerator(object):
+    """Writes a synthetic npm project and the registry tarballs it installs
+
+    The same arguments always generate the same files, so benchmark runs
+    of different commits install identical trees. Packages form a DAG (a
+    package only depends on packages with a higher index), which is
+    expanded breadth first into a fully nested npm-shrinkwrap.json until
+    it holds `size` modules. Two shrinkwraps are written: the project's,
+    and one where a single top level dependency moved to a new patch
+    version with the same dependencies.
+
+    Args:
+        size (int): Modules in the shrinkwrap, counting every nested copy.
+        depth (int): Deepest node_modules nesting.
+        fanout (int): Most dependencies of a package.
+        roots (int): Dependencies of the project itself.
+        files (int): Files per package, besides package.json.
+        file_size (int): Average size of these files in bytes.
+        scripts (float): Share of packages with an install script, which
+            frosty leaves to npm.
+        seed (int): Seed of everything random.
+
+    """
+
+    def __init__(self, size=300, depth=5, fanout=4, roots=20, files=10, file_size=2048, scripts=0.05, seed=1):
+        self.size = size
+        self.depth = depth
+        self.fanout = fanout
+        self.roots = roots
+        self.files = files
+        self.file_size = file_size
+        self.scripts = scripts
+        self.seed = seed
+        self.rng = random.Random(seed)
+        # {name: {version: [(name, version)]}}
+        self.packages = {}
+        self.with_scripts = set()
+
+
+    def get_params(self):
+        return dict((key, getattr(self, key))
+                    for key in ('size', 'depth', 'fanout', 'roots', 'files', 'file_size', 'scripts', 'seed'))
+
+
+    def generate(self, output_dir):
+        """Write the shrinkwraps and registry below output_dir
+
+        Returns:
+            dict: `modules` in the shrinkwrap, `tarballs` written and their
+                `bytes`.
+        """
+        names = self.generate_packages()
+        shrinkwrap = self.generate_shrinkwrap(names)
+        changed = self.change_dependency(shrinkwrap)
+
+        make_dirs(output_dir)
+        for (file_name, data) in (('npm-shrinkwrap.json', shrinkwrap), ('npm-shrinkwrap.changed.json', changed)):
+            with open(os.path.join(output_dir, file_name), 'w') as file:
+                json.dump(data, file, indent=2, sort_keys=True)
+
+        registry_dir = os.path.join(output_dir, 'registry')
+        tarballs = 0
+        size = 0
+
+        for name in sorted(self.packages):
+            for version in sorted(self.packages[name]):
+                size = size + self.write_tarball(registry_dir, name, version)
+                tarballs = tarballs + 1
+
+        return {'modules': FixtureGenerator.count_modules(shrinkwrap), 'tarballs': tarballs, 'bytes': size}
+
+
+    def generate_packages(self):
+        count = max(self.roots, self.size // 4)
+        names = ['bench-%04d' % index for index in range(count)]
+
+        for (index, name) in enumerate(names):
+            versions = sorted(self.rng.sample(VERSIONS, self.rng.randint(1, len(VERSIONS))))
+            self.packages[name] = {}
+            if self.rng.random() < self.scripts:
+                self.with_scripts.add(name)
+
+            for version in versions:
+                later = names[index + 1:]
+                deps = self.rng.sample(later, min(len(later), self.rng.randint(0, self.fanout)))
+                self.packages[name][version] = [(dep, None) for dep in sorted(deps)]
+
+        # versions are picked once every package exists
+        for name in names:
+            for version in self.packages[name]:
+                self.packages[name][version] = [(dep, self.rng.choice(sorted(self.packages[dep])))
+                                                for (dep, _) in self.packages[name][version]]
+
+        return names
+
+
+    def generate_shrinkwrap(self, names):
+        root = {'name': 'bench', 'version': '1.0.0', 'lockfileVersion': 1}
+        roots = sorted(self.rng.sample(names, min(len(names), self.roots)))
+        queue = [(root, [(name, self.rng.choice(sorted(self.packages[name]))) for name in roots], 1)]
+        count = 0
+
+        while queue and count < self.size:
+            (parent, deps, depth) = queue.pop(0)
+
+            for (name, version) in deps:
+                if count == self.size:
+                    break
+
+                node = {'version': version, 'resolved': self.get_url(name, version)}
+                parent.setdefault('dependencies', {})[name] = node
+                if parent is not root:
+                    parent.setdefault('requires', {})[name] = version
+                count = count + 1
+
+                if depth < self.depth and self.packages[name][version]:
+                    queue.append((node, self.packages[name][version], depth + 1))
+
+        return root
+
+
+    def change_dependency(self, shrinkwrap):
+        """Return a copy of shrinkwrap where one top level module has a new patch version"""
+        changed = copy.deepcopy(shrinkwrap)
+        name = sorted(changed['dependencies'])[0]
+        node = changed['dependencies'][name]
+
+        parts = node['version'].split('.')
+        version = '.'.join(parts[0:2] + [str(int(parts[2]) + 1)])
+        self.packages[name][version] = self.packages[name][node['version']]
+
+        node['version'] = version
+        node['resolved'] = self.get_url(name, version)
+        return changed
+
+
+    def write_tarball(self, registry_dir, name, version):
+        """Write `<name>/-/<name>-<version>.tgz` like a registry, return its size"""
+        rng = random.Random('%s-%s@%s' % (self.seed, name, version))
+        package = {
+            'name': name,
+            'version': version,
+            'main': 'index.js',
+            'dependencies': dict(self.packages[name][version]),
+        }
+        if name in self.with_scripts:
+            package['scripts'] = {'install': 'node build.js'}
+
+        files = [('package.json', json.dumps(package, indent=2, sort_keys=True).encode('utf-8'))]
+        for index in range(self.files):
+            path = 'index.js' if index == 0 else 'lib/module%d.js' % index
+            files.append((path, FixtureGenerator.get_source(rng, rng.randint(0, 2 * self.file_size))))
+
+        path = os.path.join(registry_dir, name, '-', '%s-%s.tgz' % (name, version))
+        make_dirs(os.path.dirname(path))
+
+        with open(path, 'wb') as file:
+            # a fixed gzip timestamp keeps the tarballs byte for byte identical
+            with gzip.GzipFile(fileobj=file, mode='wb', mtime=FIXTURE_MTIME) as gzip_file:
+                with tarfile.open(fileobj=gzip_file, mode='w') as tar:
+                    for (file_path, data) in files:
+                        info = tarfile.TarInfo('package/' + file_path)
+                        info.size = len(data)
+                        info.mode = 0o644
+                        info.mtime = FIXTURE_MTIME
+                        tar.addfile(info, io.BytesIO(data))
+
+        return os.path.getsize(path)
+
+
+    @staticmethod
+    def get_source(rng, size):
+        """Return about size bytes of JavaScript"""
+        lines = []
+        length = 0
+
+        while length < size:
+            line = 'exports.f%d = function (a, b) { return a * %d + b; };\n' % (len(lines), rng.randint(0, 1000000))
+            lines.append(line)
+            length = length + len(line)
+
+        return ''.join(lines).encode('utf-8')
+
+
+    @staticmethod
+    def get_url(name, version):
+        return '%s/%s/-/%s-%s.tgz' % (DEFAULT_REGISTRY, name, name, version)
+
+
+    @staticmethod
+    def count_modules(node):
+        children = node.get('dependencies', {}).values()
+        return len(children) + sum(FixtureGenerator.count_modules(child) for child in children)
@@ -0,0 +1,298 @@
+import hashlib
+import io
+import json
+import os
+import posixpath
+import shutil
+import sys
+import tarfile
+import tempfile
+import zlib
+
+from contextlib import contextmanager
+
+from log import Log
+from store import BlobStore
+from util import make_dirs
+
+
+BUNDLE_VERSION = 1
+
+HEADER_NAME = 'frosty-bundle.json'
+
+
+class CacheBundle(object):
+    """Moves cache entries between machines as one streamed tar archive
+
+    The archive starts with a header, followed by one section per entry:
+    the cas blobs it uses which are not in the bundle yet, the files of its
+    entry directory (data, files.json, bin.json, deps.json), and finally
+    `index.json`, its index record.
+
+    Archives are written and read sequentially, so they can be piped. An
+    import only stages one entry at a time, and publishes it into the cache
+    when its index record arrives; a truncated bundle therefore leaves every
+    entry it completed usable.
+
+    Args:
+        cache ([Cache]): Cache to export from or import into.
+
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.blob_store = cache.stores[BlobStore.name]
+
+
+    def export_modules(self, modules, fileobj, compress=False):
+        """Write cached modules to a bundle
+
+        Args:
+            modules (list): (name, version) tuples. All must be cached.
+            fileobj (file): Binary stream to write to.
+            compress (bool): gzip the archive.
+        """
+        blobs = set()
+
+        with tarfile.open(fileobj=fileobj, mode='w|gz' if compress else 'w|') as archive:
+            add_json(archive, HEADER_NAME, {'version': BUNDLE_VERSION})
+
+            for (module_name, module_version) in modules:
+                self.export_entry(archive, module_name, module_version, blobs)
+
+        Log.info('Exported %s modules (%s blobs)', len(modules), len(blobs))
+
+
+    def export_entry(self, archive, module_name, module_version, blobs):
+        # native entries travel with their host fingerprint
+        module_version = self.cache.get_entry_version(module_name, module_version)
+        cache_module_dir = self.cache.get_module_path(module_name, module_version)
+        record = self.cache.index.get(module_name, module_version) or self.cache.index_module(module_name, module_version)
+
+        if record is None:
+            raise RuntimeError('%s@%s is not cached' % (module_name, module_version))
+
+        Log.verbose('exporting %s@%s', module_name, module_version)
+        store = self.cache.get_store(module_name, module_version)
+        entry_name = 'entries/%s/%s' % (module_name, module_version)
+
+        # blobs go first, so that an imported entry never refers to a missing blob
+        if store is self.blob_store:
+            for (_, digest, mode) in store.load_files(cache_module_dir)['files']:
+                blob_path = store.get_blob_path(digest, mode)
+                if blob_path not in blobs:
+                    blobs.add(blob_path)
+                    archive.add(blob_path, 'blobs/%s' % os.path.relpath(blob_path, store.blobs_dir).replace(os.sep, '/'))
+
+        def store_links_as_files(info):
+            # files with several links are exported whole, imports reject link members
+            if info.islnk():
+                info.type = tarfile.REGTYPE
+                info.linkname = ''
+                info.size = os.path.getsize(os.path.join(cache_module_dir, os.path.relpath(info.name, entry_name)))
+            return info
+
+        archive.add(cache_module_dir, entry_name, filter=store_links_as_files)
+        add_json(archive, '%s/index.json' % entry_name, record)
+
+
+    def import_modules(self, fileobj, modules=None):
+        """Add the modules of a bundle to the cache, skipping those already cached
+
+        Args:
+            fileobj (file): Binary stream to read from.
+            modules (list): (name, entry version) tuples of the only entries
+                the bundle may hold, None for any.
+
+        Returns:
+            tuple: (number of modules imported, number skipped)
+
+        Raises:
+            RuntimeError: If the bundle is invalid, truncated or holds an
+                entry not in modules. Entries completed before the error
+                stay in the cache.
+        """
+        counts = {'imported': 0, 'skipped': 0}
+        entry = [None]
+
+        try:
+            archive = tarfile.open(fileobj=fileobj, mode='r|*')
+            for member in archive:
+                self.import_member(archive, member, entry, counts, modules)
+            archive.close()
+        except (tarfile.TarError, EOFError, IOError, zlib.error) as e:
+            raise RuntimeError('Bundle is truncated or corrupt (%s), imported %s modules before the error' % (e, counts['imported']))
+        finally:
+            if entry[0]:
+                shutil.rmtree(entry[0][1], ignore_errors=True)
+
+        if entry[0]:
+            Log.error('Bundle entry %s@%s is incomplete, skipping it', *entry[0][0])
+
+        Log.info('Imported %s modules, %s were already cached', counts['imported'], counts['skipped'])
+        return (counts['imported'], counts['skipped'])
+
+
+    def import_member(self, archive, member, entry, counts, modules=None):
+        """Import one archive member
+
+        Args:
+            entry (list): Holds the ((name, version), staging dir) of the
+                entry being staged, or None.
+            counts (dict): Numbers of modules imported and skipped so far.
+            modules (list): Entries the bundle may hold, see `import_modules`.
+        """
+        parts = member.name.split('/')
+
+        if member.name == HEADER_NAME:
+            header = json.loads(archive.extractfile(member).read().decode('utf-8'))
+            if header.get('version') != BUNDLE_VERSION:
+                raise RuntimeError('Unsupported bundle version %s' % header.get('version'))
+            return
+
+        if '..' in parts or '' in parts:
+            raise RuntimeError('Invalid bundle member %s' % member.name)
+
+        if parts[0] == 'blobs' and member.isfile():
+            self.import_blob(archive, member, parts[1:])
+            return
+
+        if parts[0] != 'entries' or len(parts) < 3:
+            Log.verbose('skipping bundle member %s', member.name)
+            return
+
+        # scoped names span two path components
+        name_length = 2 if parts[1][0] == '@' else 1
+        module = ('/'.join(parts[1:1 + name_length]), parts[1 + name_length])
+        path = parts[2 + name_length:]
+
+        if entry[0] is None or entry[0][0] != module:
+            if modules is not None and module not in modules:
+                raise RuntimeError('Unexpected bundle entry %s@%s' % module)
+            if entry[0]:
+                Log.error('Bundle entry %s@%s is incomplete, skipping it', *entry[0][0])
+                shutil.rmtree(entry[0][1], ignore_errors=True)
+            entry[0] = (module, self.new_staging_dir())
+
+        staging_dir = entry[0][1]
+
+        if path == ['index.json']:
+            record = json.loads(archive.extractfile(member).read().decode('utf-8'))
+            key = 'imported' if self.publish(module[0], module[1], staging_dir, record) else 'skipped'
+            counts[key] = counts[key] + 1
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            entry[0] = None
+        elif path:
+            check_member(staging_dir, path, member)
+            extract_member(archive, member, os.path.join(staging_dir, *path))
+
+
+    def new_staging_dir(self):
+        staging_dir = tempfile.mkdtemp(dir=self.cache.temp_dir, prefix='import-')
+        os.chmod(staging_dir, 0o755)
+        return staging_dir
+
+
+    def import_blob(self, archive, member, parts):
+        blob_path = os.path.join(self.blob_store.blobs_dir, *parts)
+        digest = parts[-1].split('-')[0]
+
+        if os.path.isfile(blob_path):
+            return
+
+        make_dirs(os.path.dirname(blob_path))
+        temp_path = '%s.%s.tmp' % (blob_path, os.getpid())
+        content_hash = hashlib.sha256()
+        source = archive.extractfile(member)
+
+        with open(temp_path, 'wb') as file:
+            chunk = source.read(1024 * 1024)
+            while chunk:
+                content_hash.update(chunk)
+                file.write(chunk)
+                chunk = source.read(1024 * 1024)
+
+        if content_hash.hexdigest() != digest:
+            os.remove(temp_path)
+            raise RuntimeError('Bundle blob %s does not match its digest' % member.name)
+
+        os.chmod(temp_path, 0o755 if blob_path.endswith('-x') else 0o644)
+        os.rename(temp_path, blob_path)
+
+
+    def publish(self, module_name, module_version, staging_dir, record):
+        """Rename a staged entry into the cache, unless it is cached already
+
+        Returns:
+            bool: Whether the entry was published.
+        """
+        if record.get('format') not in self.cache.stores:
+            Log.error('%s@%s uses unknown cache format %s, skipping it', module_name, module_version, record.get('format'))
+            return False
+
+        with self.cache.module_lock('copy', module_name, module_version):
+            if self.cache.query(module_name, module_version):
+                return False
+
+            Log.verbose('importing %s@%s', module_name, module_version)
+            self.cache.publish_entry(staging_dir, self.cache.get_module_path(module_name, module_version))
+            self.cache.index.add(dict(record, name=module_name, version=module_version))
+
+        return True
+
+
+def add_json(archive, name, data):
+    content = json.dumps(data, sort_keys=True).encode('utf-8')
+    info = tarfile.TarInfo(name)
+    info.size = len(content)
+    info.mode = 0o644
+    archive.addfile(info, io.BytesIO(content))
+
+
+def check_member(staging_dir, path, member):
+    """Reject a member which would be written outside its staging directory
+
+    That is a member below a symlink extracted before it, or a symlink
+    which is absolute or leads out of the entry.
+
+    Args:
+        path (list): Components of the member's path in the entry.
+
+    Raises:
+        RuntimeError
+    """
+    for index in range(1, len(path) + 1):
+        if os.path.islink(os.path.join(staging_dir, *path[0:index])):
+            raise RuntimeError('Invalid bundle member %s, its path goes through a symlink' % member.name)
+
+    if member.issym():
+        target = posixpath.normpath(posixpath.join(posixpath.dirname('/'.join(path)), member.linkname))
+        if posixpath.isabs(member.linkname) or target == '..' or target.startswith('../'):
+            raise RuntimeError('Invalid bundle member %s, its link %s leads out of the entry' % (member.name, member.linkname))
+
+
+def extract_member(archive, member, target):
+    """Extract a file, directory or symlink of an entry, hardlinks are rejected"""
+    if member.isdir():
+        make_dirs(target)
+    elif member.isfile():
+        make_dirs(os.path.dirname(target))
+        with open(target, 'wb') as file:
+            shutil.copyfileobj(archive.extractfile(member), file)
+        os.chmod(target, member.mode & 0o7777)
+    elif member.issym():
+        make_dirs(os.path.dirname(target))
+        os.symlink(member.linkname, target)
+    else:
+        raise RuntimeError('Unsupported bundle member %s' % member.name)
+
+
+@contextmanager
+def open_bundle(path, mode):
+    """Open a bundle file, or stdin/stdout for `-`"""
+    if path == '-':
+        stream = sys.stdout if 'w' in mode else sys.stdin
+        yield getattr(stream, 'buffer', stream)
+    else:
+        with open(path, mode) as file:
+            yield file
@@ -1,10 +1,28 @@
+import errno
+import hashlib
 import json
 import os
 import subprocess
 import shutil
+import tempfile
+import threading
 
+from contextlib import contextmanager
+
+from index import CacheIndex
+from link import Linker, replace_symlink
+from lock import FileLock
 from log import Log
-from npm import Npm
+from npm import ModuleScanner, Npm
+from profiler import Profiler, count_tree
+from remote import RemoteCache
+from scheduler import Scheduler, Task
+from store import STORES
+from util import make_dirs
+
+
+# upper bound on modules passed to a single `npm install`
+BATCH_SIZE = 100
 
 
 class Cache(object):
@@ -25,7 +43,12 @@ class Cache(object):
         self.config = config
         self.cache_dir = config.cache_dir
         self.temp_dir = os.path.join(self.cache_dir, '.temp')
-
+        self.linker = Linker(config.link_mode)
+        self.stores = dict((store.name, store(self.cache_dir, self.linker)) for store in STORES)
+        self.store = self.stores[config.cache_format]
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+        self.touched = set()
 
         if not os.path.exists(self.cache_dir):
             os.makedirs(self.cache_dir)
@@ -33,14 +56,21 @@ class Cache(object):
         if not os.path.exists(self.temp_dir):
             os.makedirs(self.temp_dir)
 
-        if 'NPM_TOKEN' in os.environ:
-            self.write_npm_rc(os.environ['NPM_TOKEN'])
+        # installs share this lock, garbage collection takes it exclusively
+        self.gc_lock = FileLock(os.path.join(self.cache_dir, '.gc.lock'))
+        self.gc_lock.acquire(shared=True)
+
+        self.index = CacheIndex(self.cache_dir)
+        self.index.load()
+
+        # optional second tier, see --remote-cache
+        self.remote = RemoteCache(config, self) if getattr(config, 'remote_cache', None) else None
 
         Log.verbose('Using cache directory %s', self.cache_dir)
 
 
-    def write_npm_rc(self, token):
-        rcfile = os.path.join(self.temp_dir, '.npmrc')
+    def write_npm_rc(self, token, prefix_dir):
+        rcfile = os.path.join(prefix_dir, '.npmrc')
         # rcfile = os.path.expandvars('$HOME/.npmrc')
         data = '//registry.npmjs.org/:_authToken=%s\n' % token
         Log.verbose('writing token %s to %s', token, rcfile)
@@ -49,110 +79,516 @@ class Cache(object):
 
 
     def query(self, module_name, module_version):
-        cache_dir = self.get_module_path(module_name, module_version)
-        Log.verbose('cache query for %s@%s (%s)', module_name, module_version, cache_dir)
+        with Profiler.span('query', 'module', module='%s@%s' % (module_name, module_version)) as span:
+            module_version = self.get_entry_version(module_name, module_version)
+            cache_dir = self.get_module_path(module_name, module_version)
+            Log.verbose('cache query for %s@%s (%s)', module_name, module_version, cache_dir)
+            hit = bool(self.index.get(module_name, module_version) or self.index_module(module_name, module_version))
 
-        if os.path.isdir(cache_dir):
+            if span is not None:
+                span['hit'] = hit
+
+        if hit:
             Log.verbose('cache HIT for %s@%s (%s)', module_name, module_version, cache_dir)
-            return True
         else:
             Log.verbose('cache MISS for %s@%s (%s)', module_name, module_version, cache_dir)
-            return False
+        return hit
+
+
+    def index_module(self, module_name, module_version):
+        """Add a complete entry missing from the index, e.g. one written by an older frosty
+
+        Returns:
+            dict: The new index record, or None if the module is not cached.
+        """
+        module_version = self.get_entry_version(module_name, module_version)
+
+        # deps.json is written last, without it the entry is incomplete
+        if not os.path.isfile(self.get_module_deps_path(module_name, module_version)):
+            return None
+
+        # most likely another process published it since the index was loaded
+        self.index.refresh()
+        record = self.index.get(module_name, module_version)
+        if record:
+            return record
+
+        try:
+            store = self.get_store(module_name, module_version)
+            bin = self.load_module_bin(module_name, module_version)
+            record = self.build_index_record(module_name, module_version, store, bin)
+        except (IOError, ValueError, RuntimeError) as e:
+            Log.verbose('Cannot index %s@%s (%s)', module_name, module_version, e)
+            return None
+
+        self.index.add(record)
+        return record
+
+
+    def build_index_record(self, module_name, module_version, store, bin, deps=None):
+        cache_dir = self.get_module_path(module_name, module_version)
+
+        if deps is None:
+            with open(self.get_module_deps_path(module_name, module_version)) as file:
+                deps = json.load(file)
+
+        return {
+            'name': module_name,
+            'version': module_version,
+            'format': store.name,
+            'deps': deps,
+            'bin': bin,
+            'size': store.get_size(cache_dir),
+        }
+
+
+    def lock(self, *nargs):
+        """Return the in-process lock guarding the given cache key"""
+        key = '@'.join(nargs)
+        with self.locks_lock:
+            if key not in self.locks:
+                self.locks[key] = threading.Lock()
+            return self.locks[key]
+
+
+    @contextmanager
+    def module_lock(self, kind, module_name, module_version):
+        """Hold the lock of a module against other threads and other processes
+
+        Threads of this process queue on an in-process lock first, so that
+        only one of them waits on the lock file at a time.
+        """
+        with self.lock(kind, module_name, module_version):
+            with FileLock(self.get_module_lock_path(kind, module_name, module_version)):
+                yield
 
 
     def add(self, module_name, module_version, module_url):
-        # remove temporary node_modules directory between npm installs to avoid peer dependency issues
-        temp_node_modules = os.path.join(self.temp_dir, 'node_modules')
+        # only one thread or process fetches a given module; the others wait and then find it cached
+        with self.module_lock('add', module_name, module_version):
+            if self.query(module_name, module_version):
+                return
+
+            if self.remote and self.remote.download(module_name, module_version):
+                return
+
+            # every npm install gets its own prefix directory, so that concurrent
+            # installs don't share node_modules (and peer dependency issues)
+            prefix_dir = tempfile.mkdtemp(dir=self.temp_dir)
+
+            try:
+                self.install_to_cache(module_name, module_version, module_url, prefix_dir)
+            finally:
+                shutil.rmtree(prefix_dir, ignore_errors=True)
+
+
+    def add_many(self, modules):
+        """Fill several cache misses using as few npm installs as possible
 
-        if os.path.isdir(temp_node_modules):
-            shutil.rmtree(temp_node_modules)
+        Plain registry tarballs are downloaded on a pool of --jobs threads
+        first. The remaining misses, which need npm, are partitioned into
+        batches which never contain two versions of the same module. Every
+        module found in a batch's node_modules is harvested into the cache,
+        so shared transitive dependencies are only fetched once. A failed
+        download or batch is not fatal: whatever is still missing afterwards
+        gets installed one module at a time by `add`. Modules the remote
+        cache holds are downloaded from it instead.
 
-        temp_module_dir = None
+        Args:
+            modules (list): (name, version, url) tuples of cache misses.
+        """
+        # git modules are always installed on their own
+        modules = [module for module in modules if not self.npm.is_git_module(module[2]) and module[2][0:4] != 'git+']
+        modules = self.fetch_many(modules)
+
+        for batch in partition_modules(modules, BATCH_SIZE):
+            # another process may have fetched some of them meanwhile
+            batch = [module for module in batch if not self.query(module[0], module[1])]
+            if not batch:
+                continue
+
+            prefix_dir = tempfile.mkdtemp(dir=self.temp_dir)
+
+            try:
+                with Profiler.span('npm install batch', 'phase', modules=len(batch)):
+                    self.install_many_to_cache(batch, prefix_dir)
+            except (RuntimeError, subprocess.CalledProcessError) as e:
+                Log.info('Batch install of %s modules failed (%s), installing them one at a time', len(batch), e)
+            finally:
+                shutil.rmtree(prefix_dir, ignore_errors=True)
+
+
+    def fetch_many(self, modules):
+        """Download the plain registry tarballs among modules in parallel
+
+        Each worker asks the remote cache, if any, before the registry.
+
+        Returns:
+            list: (name, version, url) of the modules npm has to install,
+                because of install scripts or a URL npm alone can fetch.
+        """
+        needs_npm = []
+
+        def fetch_task(task):
+            with self.module_lock('add', task.module, task.version):
+                if self.query(task.module, task.version):
+                    return
+
+                if self.remote and self.remote.download(task.module, task.version):
+                    return
+
+                prefix_dir = tempfile.mkdtemp(dir=self.temp_dir)
+
+                try:
+                    if self.npm.fetch(task.module, task.version, task.url, prefix_dir):
+                        self.harvest(prefix_dir)
+                    else:
+                        needs_npm.append((task.module, task.version, task.url))
+                except RuntimeError as e:
+                    # left to `add`, which retries transient failures
+                    Log.verbose('Skipping %s@%s in batch (%s)', task.module, task.version, e)
+                finally:
+                    shutil.rmtree(prefix_dir, ignore_errors=True)
+
+        tasks = [Task(order, name, version, url, None) for (order, (name, version, url)) in enumerate(modules)]
+
+        with Profiler.span('fetch tarballs', 'phase', modules=len(tasks)):
+            Scheduler(getattr(self.config, 'jobs', 1), force=True).run(tasks, fetch_task)
+
+        return sorted(needs_npm)
+
+
+    def install_many_to_cache(self, modules, prefix_dir):
+        if 'NPM_TOKEN' in os.environ:
+            self.write_npm_rc(os.environ['NPM_TOKEN'], prefix_dir)
+
+        self.npm.install_many(modules, prefix_dir)
+        self.harvest(prefix_dir)
+
+
+    def install_to_cache(self, module_name, module_version, module_url, prefix_dir):
+        if 'NPM_TOKEN' in os.environ:
+            self.write_npm_rc(os.environ['NPM_TOKEN'], prefix_dir)
 
         try:
-            temp_module_dir = self.npm.install(module_name,
-                                               module_version,
-                                               module_url,
-                                               prefix_dir=self.temp_dir)
+            self.npm.install(module_name,
+                             module_version,
+                             module_url,
+                             prefix_dir=prefix_dir)
         except RuntimeError as e:
             Log.error(e.message)
             raise e
 
-        module_paths = [temp_module_dir] + Npm.get_module_paths(temp_module_dir)
-        for module in module_paths:
-            self.copy_module_to_cache(module)
+        self.harvest(prefix_dir)
+
+
+    def harvest(self, prefix_dir):
+        """Copy every module installed under prefix_dir to the cache
+
+        The tree is scanned once; each module's dependency tree comes from
+        the same scan instead of walking its subtree again.
+        """
+        scanner = ModuleScanner()
 
+        for (module_dir, stat, package) in scanner.scan(prefix_dir):
+            self.copy_module_to_cache(module_dir, stat + (package,), scanner.deps[module_dir])
 
-    def copy_module_to_cache(self, temp_module_dir):
+
+    def copy_module_to_cache(self, temp_module_dir, module=None, deps=None):
         # given a path, read the package.json to determine module name and version
         # copy to correct location in cache directory
         # remove child node_modules dir
-        stat = Npm.stat_module(temp_module_dir)
+        if module is None:
+            module = Npm.read_module(temp_module_dir)
+
+        (module_name, module_version, package) = module
+
+        with self.module_lock('copy', module_name, module_version):
+            if not self.query(module_name, module_version):
+                self.write_module_to_cache(module_name, module_version, temp_module_dir, package, deps)
+
 
-        if not stat:
-            return
+    def write_module_to_cache(self, module_name, module_version, temp_module_dir, package, deps=None):
+        """Build a cache entry in a staging directory, then rename it into place
 
-        module_name = stat[0]
-        module_version = stat[1]
+        Readers therefore see either no entry or a complete one, never a
+        partially copied module. Must be called holding the module's 'copy' lock.
+        """
+        entry_version = module_version
 
-        if self.query(module_name, module_version):
-            return
+        # compiled addons only work on hosts like this one, see `get_entry_version`
+        if Npm.has_native_code(temp_module_dir):
+            entry_version = Npm.get_native_version(module_version)
+
+        cache_module_dir = self.get_module_path(module_name, entry_version)
+        Log.verbose('copy %s@%s to cache (%s)...', module_name, entry_version, self.store.name)
+
+        module = '%s@%s' % (module_name, module_version)
+        staging_dir = tempfile.mkdtemp(dir=self.temp_dir, prefix='entry-')
+        try:
+            os.chmod(staging_dir, 0o755)
+            with Profiler.span('cache insert', 'module', module=module, format=self.store.name) as span:
+                self.store.put(temp_module_dir, staging_dir)
 
-        cache_module_dir = self.get_module_data_path(module_name, module_version)
-        Log.verbose('copy %s@%s to cache...', module_name, module_version)
-        shutil.copytree(temp_module_dir, cache_module_dir)
+            # counted once the span is closed, so it does not time the profiler's own walk
+            if span is not None:
+                span.update(count_tree(temp_module_dir, skip_node_modules=True))
 
-        # create frozen list of module deps
-        self.write_module_deps_to_json(module_name, module_version)
+            # executables to link at install time, so package.json is never parsed again
+            bin = Npm.get_bin_map(package)
+            self.write_module_bin_to_json(staging_dir, bin)
 
-        child_node_modules = os.path.join(cache_module_dir, 'node_modules')
-        if os.path.isdir(child_node_modules):
-            shutil.rmtree(child_node_modules)
+            # create frozen list of module deps
+            with Profiler.span('deps.json', 'module', module=module):
+                deps = self.write_module_deps_to_json(staging_dir, temp_module_dir, deps)
+            self.publish_entry(staging_dir, cache_module_dir)
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
 
+        self.index.add(self.build_index_record(module_name, entry_version, self.store, bin, deps))
 
-    def write_module_deps_to_json(self, module_name, module_version):
-        deps = Npm.build_dependency_tree(self.get_module_data_path(module_name, module_version))
+        if self.remote:
+            self.remote.queue_upload(module_name, module_version)
+
+
+    def publish_entry(self, staging_dir, cache_module_dir):
+        make_dirs(os.path.dirname(cache_module_dir))
+
+        # an incomplete entry left by a crashed frosty, or by one predating staging
+        if os.path.isdir(cache_module_dir):
+            Log.verbose('replacing incomplete cache entry %s', cache_module_dir)
+            stale_dir = tempfile.mkdtemp(dir=self.temp_dir, prefix='stale-')
+            os.rename(cache_module_dir, os.path.join(stale_dir, 'entry'))
+            shutil.rmtree(stale_dir, ignore_errors=True)
+
+        try:
+            os.rename(staging_dir, cache_module_dir)
+        except OSError as e:
+            # published meanwhile by a frosty which does not lock
+            if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                raise
+
+
+    def write_module_bin_to_json(self, entry_dir, bin):
+        with open(os.path.join(entry_dir, 'bin.json'), 'w') as file:
+            json.dump(bin, file, sort_keys=True, indent=4, separators=(',', ': '))
+
+
+    def write_module_deps_to_json(self, entry_dir, module_dir, deps=None):
+        if deps is None:
+            deps = Npm.build_dependency_tree(module_dir)
         json_str = json.dumps(deps, sort_keys=True, indent=4, separators=(',', ': '))
-        deps_file = self.get_module_deps_path(module_name, module_version)
+        deps_file = os.path.join(entry_dir, 'deps.json')
         with open(deps_file, 'w') as file:
             file.write(json_str)
+        return deps
 
 
     def get_module_path(self, module_name, module_version):
         return os.path.join(self.cache_dir, module_name, module_version)
 
 
+    def get_entry_version(self, module_name, module_version):
+        """Return the version directory of the entry serving this host
+
+        Modules with native code are cached per host, as
+        <version>@<host fingerprint> (see `Npm.get_host_fingerprint`), so a
+        cache shared between hosts never hands out an addon built for
+        another one. All other modules are cached as <version> and shared.
+        Versions which already name a directory are returned unchanged.
+        """
+        if '@' in module_version or self.index.get(module_name, module_version):
+            return module_version
+
+        native_version = Npm.get_native_version(module_version)
+        if self.index.get(module_name, native_version) or os.path.isdir(self.get_module_path(module_name, native_version)):
+            return native_version
+
+        return module_version
+
+
+    def get_versions(self):
+        """Return {name: [versions]} of the indexed modules this host can use"""
+        versions = {}
+
+        for (module_name, entry_versions) in self.index.names().items():
+            for entry_version in entry_versions:
+                if '@' in entry_version:
+                    (entry_version, host) = entry_version.split('@', 1)
+                    if host != Npm.get_host_fingerprint():
+                        continue
+                versions.setdefault(module_name, []).append(entry_version)
+
+        return versions
+
+
+    def get_module_lock_path(self, kind, module_name, module_version):
+        # scoped names are flattened like npm does in registry URLs
+        name = '%s-%s@%s.lock' % (kind, module_name.replace('/', '%2f'), module_version)
+        return os.path.join(self.get_locks_path(), name)
+
+
+    def get_locks_path(self):
+        return os.path.join(self.cache_dir, '.locks')
+
+
+    def get_manifests_path(self):
+        return os.path.join(self.cache_dir, '.manifests')
+
+
+    def list_modules(self):
+        """Return (name, version) of every entry directory in the cache"""
+        modules = []
+
+        for name in sorted(os.listdir(self.cache_dir)):
+            if name[0] == '.' or not os.path.isdir(os.path.join(self.cache_dir, name)):
+                continue
+
+            names = [name]
+            if name[0] == '@':
+                names = ['%s/%s' % (name, scoped) for scoped in sorted(os.listdir(os.path.join(self.cache_dir, name)))]
+
+            for module_name in names:
+                module_dir = os.path.join(self.cache_dir, module_name)
+                modules.extend((module_name, version) for version in sorted(os.listdir(module_dir))
+                               if version[0] != '.' and os.path.isdir(os.path.join(module_dir, version)))
+
+        return modules
+
+
+    def record_manifest(self, root_path, modules):
+        """Remember which modules a project uses, so gc keeps them
+
+        Args:
+            root_path (str): Project directory. One record is kept per project.
+            modules (list): (name, version) tuples.
+        """
+        manifests_dir = self.get_manifests_path()
+        make_dirs(manifests_dir)
+
+        path = os.path.join(manifests_dir, '%s.json' % hashlib.sha1(root_path.encode('utf-8')).hexdigest())
+        temp_path = '%s.%s.tmp' % (path, os.getpid())
+        keys = sorted(set('%s@%s' % (name, self.get_entry_version(name, version)) for (name, version) in modules))
+
+        with open(temp_path, 'w') as file:
+            json.dump({'path': root_path, 'modules': keys}, file)
+        os.rename(temp_path, path)
+
+
+    def touch(self, module_name, module_version):
+        """Mark a module as used now, at most once per process"""
+        key = (module_name, module_version)
+
+        if key not in self.touched:
+            self.touched.add(key)
+            try:
+                os.utime(self.get_module_path(module_name, self.get_entry_version(module_name, module_version)), None)
+            except OSError as e:
+                Log.verbose('Cannot update last use of %s@%s (%s)', module_name, module_version, e)
+
+
     def get_module_deps_path(self, module_name, module_version):
         return os.path.join(self.get_module_path(module_name, module_version), 'deps.json')
 
 
-    def get_module_data_path(self, module_name, module_version):
-        return os.path.join(self.get_module_path(module_name, module_version), 'data')
+    def get_module_bin_path(self, module_name, module_version):
+        return os.path.join(self.get_module_path(module_name, module_version), 'bin.json')
+
+
+    def get_store(self, module_name, module_version):
+        """Return the store holding a cached module, whichever format it was written in"""
+        module_version = self.get_entry_version(module_name, module_version)
+        cache_module_dir = self.get_module_path(module_name, module_version)
+        record = self.index.get(module_name, module_version)
+
+        if record and record['format'] in self.stores:
+            return self.stores[record['format']]
+
+        if self.store.is_stored(cache_module_dir):
+            return self.store
+
+        for store in self.stores.values():
+            if store.is_stored(cache_module_dir):
+                return store
+
+        raise RuntimeError('%s@%s is not stored in cache %s' % (module_name, module_version, self.cache_dir))
 
 
     def load_module_deps_from_json(self, module_name, module_version):
+        module_version = self.get_entry_version(module_name, module_version)
+        record = self.index.get(module_name, module_version)
+        if record:
+            return record['deps']
+
         deps_file = self.get_module_deps_path(module_name, module_version)
         with open(deps_file) as file:
             return json.load(file)
 
 
+    def load_module_bin(self, module_name, module_version):
+        """Return the {name: path} executables of a cached module"""
+        module_version = self.get_entry_version(module_name, module_version)
+        record = self.index.get(module_name, module_version)
+        if record:
+            return record['bin']
+
+        try:
+            with open(self.get_module_bin_path(module_name, module_version)) as file:
+                return json.load(file)
+        except IOError:
+            # entries written before bin.json existed
+            return Npm.get_bin_map(self.load_module_package(module_name, module_version))
+
+
+    def load_module_package(self, module_name, module_version):
+        """Return the package.json of a cached module"""
+        module_version = self.get_entry_version(module_name, module_version)
+        cache_module_dir = self.get_module_path(module_name, module_version)
+        package = self.get_store(module_name, module_version).read_file(cache_module_dir, 'package.json')
+        return json.loads(package.decode('utf-8'))
+
+
     def materialize_module(self, module_name, module_version, project_dir):
-        cache_module_dir = self.get_module_data_path(module_name, module_version)
+        cache_module_dir = self.get_module_path(module_name, self.get_entry_version(module_name, module_version))
         project_module_dir = os.path.join(project_dir, 'node_modules', module_name)
 
-        if os.path.isdir(project_module_dir):
-            shutil.rmtree(project_module_dir)
-        shutil.copytree(cache_module_dir, project_module_dir)
-
-        # set up symlink for .bin target
-        bin = {}
-        nm_dir = os.path.dirname(project_module_dir)
-        bin_dir = os.path.join(nm_dir, '.bin')
-        with open(os.path.join(project_module_dir, 'package.json')) as file:
-            bin = json.load(file).get('bin', {})
-        for (name, path) in bin.items():
-            bin_path = os.path.relpath(os.path.realpath(os.path.join(project_module_dir, path)), bin_dir)
-            bin_ln = os.path.join(bin_dir, name)
-            if not os.path.isdir(bin_dir):
-                os.makedirs(bin_dir)
-            subprocess.check_output(['ln', '-sf', bin_path, bin_ln])
+        module = '%s@%s' % (module_name, module_version)
+
+        with Profiler.span('materialize', 'module', module=module, link_mode=self.linker.mode) as span:
+            if os.path.isdir(project_module_dir):
+                shutil.rmtree(project_module_dir)
+            self.get_store(module_name, module_version).materialize(cache_module_dir, project_module_dir)
+            self.touch(module_name, module_version)
+
+        # counted once the span is closed, so it does not time the profiler's own walk
+        if span is not None:
+            span.update(count_tree(project_module_dir))
+
+        # set up symlink for .bin target, next to scoped modules too
+        with Profiler.span('bin links', 'module', module=module) as span:
+            bin_dir = os.path.join(project_dir, 'node_modules', '.bin')
+            bin = self.load_module_bin(module_name, module_version)
+
+            for (name, path) in bin.items():
+                bin_path = os.path.relpath(os.path.normpath(os.path.join(project_module_dir, path)), bin_dir)
+                bin_ln = os.path.join(bin_dir, name)
+                make_dirs(bin_dir)
+                replace_symlink(bin_path, bin_ln)
+
+            if span is not None:
+                span['files'] = len(bin)
+
+
+def partition_modules(modules, size):
+    """Split (name, version, url) tuples into batches with unique names"""
+    batches = []
+
+    for module in sorted(set(modules)):
+        for batch in batches:
+            if len(batch) < size and module[0] not in [name for (name, _, _) in batch]:
+                batch.append(module)
+                break
+        else:
+            batches.append([module])
+
+    return batches
@@ -1,6 +1,13 @@
 import argparse
 import os
 
+from link import LINK_MODES
+from store import STORE_FORMATS
+from util import parse_size
+
+
+COMMANDS = ['install', 'prefetch', 'bundle', 'gc']
+
 
 class Config(object):
     """Represents the context for an invocation of the frosty command.
@@ -15,16 +22,40 @@ class Config(object):
 
         parser = argparse.ArgumentParser(usage=__doc__)
 
-        parser.add_argument('install', help='perform install action')
+        parser.add_argument('command', choices=COMMANDS, help='install: install modules, prefetch: only add modules to the cache, bundle: export or import cached modules, gc: evict modules from the cache')
+        parser.add_argument('paths', nargs='*', help='prefetch: npm-shrinkwrap.json files or project directories (default: --cwd), bundle: export FILE [PATH...] or import FILE')
         parser.add_argument('-C', '--cwd', required=False, type=str, help='run in this directory', default=os.getcwd())
         parser.add_argument('-d', '--cache-dir', required=False, type=str, help='Cache directory', default=Config.get_default_cache_dir())
+        parser.add_argument('--cache-max-size', type=parse_size, help='evict least recently used modules once the cache is larger than this (e.g. 20G)')
+        parser.add_argument('--cache-format', choices=STORE_FORMATS, default='tree', help='how new modules are stored in the cache (cas deduplicates identical files, tar/tgz keep one archive per module)')
+        parser.add_argument('--dedupe', action='store_true', help='install each module at the shallowest node_modules where node still resolves it, dropping duplicate copies')
         parser.add_argument('-f', '--force', required=False, action='store_true', help='Force install to continue, even if an individual module fails to install')
+        parser.add_argument('--gc-max-age', type=int, default=30, help='days after which unused modules and manifests count as stale for gc')
+        parser.add_argument('-i', '--incremental', action='store_true', help='only reinstall modules which changed since the last install')
+        parser.add_argument('-j', '--jobs', required=False, type=int, default=1, help='number of modules to install in parallel')
+        parser.add_argument('-l', '--link-mode', choices=LINK_MODES, default='copy', help='how to place cached files in node_modules (auto tries reflink, then hardlink, then copy)')
+        parser.add_argument('--no-batch', dest='batch', action='store_false', help='fetch each missing module with its own npm install')
+        parser.add_argument('--no-native-fetch', dest='native_fetch', action='store_false', help='always use npm to fetch modules, even plain registry tarballs')
         parser.add_argument('-o', '--offline', action='store_true', help='do not connect to remote npm registry')
+        parser.add_argument('--profile', metavar='FILE', help='write timings of every phase and module to FILE as Chrome trace events, and print the slowest modules')
         parser.add_argument('-p', '--http-proxy', help='url of proxy to use for reaching npm')
+        parser.add_argument('--remote-cache', metavar='URL', help='shared cache to download modules from before installing them with npm, and to upload newly cached modules to')
         parser.add_argument('-r', '--registry', default='https://registry.npmjs.org', help='url of npm registry')
+        parser.add_argument('--retries', type=int, default=4, help='times a module failing with a network error is retried')
+        parser.add_argument('--retry-delay', type=float, default=1.0, help='seconds before the first retry, doubled for every further one')
+        parser.add_argument('--retry-max-time', type=float, default=120.0, help='seconds after its first failure within which a module is retried')
         parser.add_argument('-v', '--verbose', action='store_true', help='print verbose output')
 
-        return parser.parse_args()
+        # argparse does not match positionals given after options to `paths`
+        (args, extra) = parser.parse_known_args()
+        unknown = [arg for arg in extra if arg[0:1] == '-']
+        if unknown:
+            parser.error('unrecognized arguments: %s' % ' '.join(unknown))
+        args.paths = args.paths + extra
+        if args.paths and args.command not in ('prefetch', 'bundle'):
+            parser.error('unrecognized arguments: %s' % ' '.join(args.paths))
+
+        return args
 
 
     @staticmethod
@@ -0,0 +1,272 @@
+import os
+import time
+
+from log import Log
+from manifest import InstallRecord
+
+
+class HoistNode(object):
+    """A module placed in the tree being deduplicated"""
+
+    __slots__ = ('name', 'version', 'url', 'requires', 'parent', 'children')
+
+    def __init__(self, name, version, url, requires, parent):
+        self.name = name
+        self.version = version
+        self.url = url
+        self.requires = requires
+        self.parent = parent
+        self.children = {}
+
+
+class HoistPlanner(object):
+    """Hoists and deduplicates the modules of an install plan
+
+    Modules are visited breadth first and each is moved to the shallowest
+    node_modules above it where it can go: if an ancestor's node_modules
+    already holds the same name@version, the copy (and everything nested in
+    it) is dropped; if it holds no module of that name, the module moves
+    there with its subtree. A change is only kept if every `require` node
+    would evaluate still finds the same module as before, for the modules
+    requiring the hoisted name and for the modules inside the moved subtree,
+    so the installed tree behaves like the original one.
+
+    What a module requires comes from the shrinkwrap (`requires`), or else
+    from the package.json of the cached module. Without it no module can be
+    moved safely, and the plan is left as it is.
+
+    Args:
+        cache ([Cache]): Cache holding the modules of the plan.
+
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+
+
+    def plan(self, records, root_path):
+        """Return the install records of the deduplicated tree
+
+        Args:
+            records (list): InstallRecords, parents before their children.
+            root_path (str): Project root the records are installed into.
+
+        Returns:
+            list: InstallRecords, parents before their children.
+        """
+        start = time.time()
+        records = list(records)
+        root = HoistNode(None, None, None, (), None)
+        nodes = []
+
+        for record in records:
+            requires = self.get_requires(record)
+            if requires is None:
+                Log.info('Not deduplicating, cannot tell what %s@%s requires', record.name, record.version)
+                return records
+
+            parent = root if record.parent is None else nodes[record.parent]
+            node = HoistNode(record.name, record.version, record.url, requires, parent)
+            parent.children[record.name] = node
+            nodes.append(node)
+
+        root.requires = tuple(root.children.keys())
+        requirers = {}
+        for node in [root] + nodes:
+            for name in node.requires:
+                requirers.setdefault(name, []).append(node)
+
+        removed = []
+        for node in sorted(nodes, key=HoistPlanner.get_depth):
+            if HoistPlanner.is_attached(node, root):
+                self.hoist(node, requirers, removed)
+
+        deduped = HoistPlanner.to_records(root, root_path)
+        bytes_avoided = sum(self.get_size(node) for node in removed)
+
+        Log.info('Deduplicated %s modules to %s in %.2fs, %s copies and %s bytes avoided',
+                 len(records), len(deduped), time.time() - start, len(records) - len(deduped), bytes_avoided)
+        return deduped
+
+
+    def get_requires(self, record):
+        """Return the names a module requires, or None if unknown"""
+        if record.requires is not None:
+            return record.requires
+
+        if not self.cache.query(record.name, record.version):
+            return None
+
+        package = self.cache.load_module_package(record.name, record.version)
+        names = set((package.get('dependencies') or {}).keys())
+        names.update((package.get('optionalDependencies') or {}).keys())
+        return tuple(sorted(names))
+
+
+    def get_size(self, node):
+        record = self.cache.index.get(node.name, self.cache.get_entry_version(node.name, node.version))
+        return (record or {}).get('size', 0)
+
+
+    def hoist(self, node, requirers, removed):
+        """Move node to the shallowest ancestor it can go to, if any"""
+        parent = node.parent
+        ancestors = []
+        ancestor = parent.parent
+
+        while ancestor is not None:
+            ancestors.append(ancestor)
+            ancestor = ancestor.parent
+
+        for target in reversed(ancestors):
+            existing = target.children.get(node.name, None)
+
+            if existing is None:
+                if HoistPlanner.try_move(node, target, requirers):
+                    return
+            elif existing.version == node.version and existing.url == node.url:
+                if HoistPlanner.try_dedupe(node, existing, target, requirers):
+                    removed.extend(HoistPlanner.iter_subtree(node))
+                    return
+
+
+    @staticmethod
+    def try_move(node, target, requirers):
+        parent = node.parent
+        before = HoistPlanner.snapshot(node, target, requirers)
+
+        del parent.children[node.name]
+        target.children[node.name] = node
+        node.parent = target
+
+        if HoistPlanner.snapshot(node, target, requirers) == before:
+            return True
+
+        del target.children[node.name]
+        parent.children[node.name] = node
+        node.parent = parent
+        return False
+
+
+    @staticmethod
+    def try_dedupe(node, existing, target, requirers):
+        if not HoistPlanner.is_equivalent(node, existing):
+            return False
+
+        parent = node.parent
+        watched = [requirer for requirer in requirers.get(node.name, ())
+                   if HoistPlanner.is_under(requirer, target) and not HoistPlanner.is_under(requirer, node)]
+        before = [HoistPlanner.resolve(requirer, node.name) for requirer in watched]
+        before = [existing if found is node else found for found in before]
+
+        del parent.children[node.name]
+
+        if [HoistPlanner.resolve(requirer, node.name) for requirer in watched] == before:
+            node.parent = None
+            return True
+
+        parent.children[node.name] = node
+        return False
+
+
+    @staticmethod
+    def snapshot(node, target, requirers):
+        """Return what the modules affected by moving node to target resolve"""
+        found = [HoistPlanner.resolve(requirer, node.name) for requirer in requirers.get(node.name, ())
+                 if HoistPlanner.is_under(requirer, target)]
+
+        for inner in HoistPlanner.iter_subtree(node):
+            found.extend(HoistPlanner.resolve(inner, name) for name in inner.requires)
+
+        return [id(module) for module in found]
+
+
+    @staticmethod
+    def is_equivalent(a, b):
+        """Return whether two copies of a module resolve the same module graph
+
+        The walk is iterative, so deep trees cannot exceed the recursion limit.
+        """
+        seen = set()
+        stack = [(a, b)]
+
+        while stack:
+            (a, b) = stack.pop()
+
+            for name in a.requires:
+                found_a = HoistPlanner.resolve(a, name)
+                found_b = HoistPlanner.resolve(b, name)
+
+                if found_a is found_b:
+                    continue
+                if found_a is None or found_b is None or found_a.version != found_b.version:
+                    return False
+                if (found_a, found_b) not in seen:
+                    seen.add((found_a, found_b))
+                    stack.append((found_a, found_b))
+
+        return True
+
+
+    @staticmethod
+    def resolve(node, name):
+        """Return the module `require(name)` finds from node, like node does"""
+        while node is not None:
+            found = node.children.get(name, None)
+            if found is not None:
+                return found
+            if node.name == name:
+                return node
+            node = node.parent
+
+        return None
+
+
+    @staticmethod
+    def is_under(node, ancestor):
+        while node is not None:
+            if node is ancestor:
+                return True
+            node = node.parent
+        return False
+
+
+    @staticmethod
+    def is_attached(node, root):
+        return HoistPlanner.is_under(node, root)
+
+
+    @staticmethod
+    def get_depth(node):
+        depth = 0
+        while node.parent is not None:
+            depth = depth + 1
+            node = node.parent
+        return depth
+
+
+    @staticmethod
+    def iter_subtree(node):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(node.children.values())
+
+
+    @staticmethod
+    def to_records(root, root_path):
+        """Return the records of the tree in pre-order, siblings sorted by name"""
+        records = []
+        stack = [(child, None, root_path) for child in sorted(root.children.values(), key=lambda node: node.name, reverse=True)]
+
+        while stack:
+            (node, parent, path) = stack.pop()
+            order = len(records)
+            records.append(InstallRecord(path, node.name, node.version, node.url, parent, node.requires))
+
+            child_path = os.path.join(path, 'node_modules', node.name)
+            for child in sorted(node.children.values(), key=lambda node: node.name, reverse=True):
+                stack.append((child, order, child_path))
+
+        return records
@@ -1,2 +1,13 @@
 class MissingNpmShrinkwrap(Exception):
     pass
+
+
+class UnresolvedDependencies(RuntimeError):
+    pass
+
+
+class FetchError(RuntimeError):
+
+    def __init__(self, message, status=None):
+        RuntimeError.__init__(self, message)
+        self.status = status
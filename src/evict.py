@@ -0,0 +1,217 @@
+import json
+import os
+import shutil
+import time
+import uuid
+
+from log import Log
+from plan import PlanCache
+from store import BlobStore
+
+
+# entries without deps.json older than this were abandoned by a crashed install
+INCOMPLETE_ENTRY_AGE = 60 * 60
+
+
+class CacheCollector(object):
+    """Evicts modules from the cache
+
+    Modules are ranked for eviction by whether a recently installed
+    manifest still references them, then by last use (the mtime of the
+    entry directory, which `Cache.materialize_module` touches). Sizes count
+    blobs shared through the cas store in full, so the estimate errs on the
+    side of evicting more.
+
+    Without a size limit, only modules which are unreferenced and unused
+    for `max_age` are evicted. With a limit, modules are evicted in rank
+    order until the cache fits, referenced ones last.
+
+    Must be run while holding the cache's exclusive gc lock, so that no
+    install is reading the entries being removed.
+
+    Args:
+        cache ([Cache]): Cache to collect.
+        max_size (int): Target size in bytes, or None.
+        max_age (int): Seconds after which manifests and unused modules
+            count as stale.
+
+    """
+
+    def __init__(self, cache, max_size=None, max_age=30 * 24 * 60 * 60):
+        self.cache = cache
+        self.max_size = max_size
+        self.max_age = max_age
+        self.trash_dir = os.path.join(cache.cache_dir, '.trash')
+
+
+    def collect(self):
+        """Evict modules, then unreferenced blobs
+
+        Returns:
+            tuple: (number of modules evicted, bytes freed)
+        """
+        now = time.time()
+        referenced = self.load_referenced(now)
+        entries = self.list_entries()
+        total_size = sum(entry['size'] for entry in entries)
+        evicted = 0
+        freed = 0
+
+        entries.sort(key=lambda entry: (entry['key'] in referenced, entry['last_used']))
+
+        for entry in entries:
+            if not entry['complete']:
+                if now - entry['last_used'] < INCOMPLETE_ENTRY_AGE:
+                    continue
+            elif self.max_size is not None:
+                if total_size <= self.max_size:
+                    break
+            elif entry['key'] in referenced or now - entry['last_used'] < self.max_age:
+                continue
+
+            Log.verbose('evicting %s (%s bytes)', entry['key'], entry['size'])
+            self.evict(entry)
+            total_size = total_size - entry['size']
+            evicted = evicted + 1
+            freed = freed + entry['size']
+
+        freed = freed + self.sweep_blobs()
+        self.sweep_stale(self.cache.temp_dir, now)
+        self.sweep_stale(self.trash_dir, now)
+        self.sweep_plans(now)
+        self.clear_locks()
+        Log.info('Evicted %s modules from cache, freed %s bytes', evicted, freed)
+        return (evicted, freed)
+
+
+    def load_referenced(self, now):
+        """Return keys used by manifests installed within max_age, dropping older manifests"""
+        manifests_dir = self.cache.get_manifests_path()
+        referenced = set()
+
+        if not os.path.isdir(manifests_dir):
+            return referenced
+
+        for name in os.listdir(manifests_dir):
+            path = os.path.join(manifests_dir, name)
+
+            if now - os.path.getmtime(path) > self.max_age:
+                os.remove(path)
+                continue
+
+            try:
+                with open(path) as file:
+                    referenced.update(json.load(file)['modules'])
+            except (IOError, ValueError, KeyError):
+                Log.verbose('Ignoring unreadable manifest record %s', path)
+
+        return referenced
+
+
+    def list_entries(self):
+        entries = []
+
+        for (module_name, module_version) in self.cache.list_modules():
+            cache_module_dir = self.cache.get_module_path(module_name, module_version)
+            record = self.cache.index.get(module_name, module_version)
+            complete = os.path.isfile(self.cache.get_module_deps_path(module_name, module_version))
+
+            if record:
+                size = record['size']
+            elif complete:
+                size = self.cache.get_store(module_name, module_version).get_size(cache_module_dir)
+            else:
+                size = 0
+
+            entries.append({
+                'name': module_name,
+                'version': module_version,
+                'key': '%s@%s' % (module_name, module_version),
+                'path': cache_module_dir,
+                'complete': complete,
+                'size': size,
+                'last_used': os.path.getmtime(cache_module_dir),
+            })
+
+        return entries
+
+
+    def evict(self, entry):
+        # move the entry out of sight first, so it disappears in one step
+        trash_path = os.path.join(self.trash_dir, uuid.uuid4().hex)
+
+        if not os.path.isdir(self.trash_dir):
+            os.makedirs(self.trash_dir)
+
+        self.cache.index.remove(entry['name'], entry['version'])
+        os.rename(entry['path'], trash_path)
+        shutil.rmtree(trash_path, ignore_errors=True)
+
+        module_dir = os.path.dirname(entry['path'])
+        if not os.listdir(module_dir):
+            os.rmdir(module_dir)
+
+
+    def sweep_stale(self, path, now):
+        """Delete leftovers of crashed runs (staging directories, trash)"""
+        if not os.path.isdir(path):
+            return
+
+        for name in os.listdir(path):
+            child = os.path.join(path, name)
+            if os.path.isdir(child) and now - os.path.getmtime(child) > INCOMPLETE_ENTRY_AGE:
+                shutil.rmtree(child, ignore_errors=True)
+
+
+    def sweep_plans(self, now):
+        """Delete install plans not used within max_age"""
+        plans_dir = PlanCache(self.cache.cache_dir).plans_dir
+        if not os.path.isdir(plans_dir):
+            return
+
+        for name in os.listdir(plans_dir):
+            path = os.path.join(plans_dir, name)
+            if now - os.path.getmtime(path) > self.max_age:
+                os.remove(path)
+
+
+    def clear_locks(self):
+        """Delete the per-module lock files
+
+        They are only deleted here: no install holds or waits on one while
+        gc holds the cache's exclusive lock.
+        """
+        locks_dir = self.cache.get_locks_path()
+        if not os.path.isdir(locks_dir):
+            return
+
+        for name in os.listdir(locks_dir):
+            os.remove(os.path.join(locks_dir, name))
+
+
+    def sweep_blobs(self):
+        """Delete blobs which no cached module refers to
+
+        Returns:
+            int: Bytes freed.
+        """
+        store = self.cache.stores[BlobStore.name]
+        if not os.path.isdir(store.blobs_dir):
+            return 0
+
+        live = set()
+        for (module_name, module_version) in self.cache.list_modules():
+            cache_module_dir = self.cache.get_module_path(module_name, module_version)
+            if store.is_stored(cache_module_dir):
+                for (_, digest, mode) in store.load_files(cache_module_dir)['files']:
+                    live.add(store.get_blob_path(digest, mode))
+
+        freed = 0
+        for root, _, files in os.walk(store.blobs_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                if path not in live:
+                    freed = freed + os.path.getsize(path)
+                    os.remove(path)
+
+        return freed
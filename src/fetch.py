@@ -0,0 +1,207 @@
+import os
+import shutil
+import socket
+import stat
+import tarfile
+import threading
+import zlib
+
+try:
+    import httplib
+    from urlparse import urljoin, urlsplit
+except ImportError:
+    import http.client as httplib
+    from urllib.parse import urljoin, urlsplit
+
+from errors import FetchError
+from log import Log
+from util import make_dirs
+
+
+DEFAULT_REGISTRY = 'https://registry.npmjs.org'
+
+MAX_REDIRECTS = 5
+
+TIMEOUT = 60
+
+
+class Fetcher(object):
+    """Downloads and extracts registry tarballs without spawning npm
+
+    Connections are kept alive and pooled per thread and per host, so a run
+    fetching hundreds of tarballs from one registry only opens a handful of
+    connections.
+
+    Args:
+        config ([Config]): Runtime configuration. Honors `registry` and
+            `http_proxy`; NPM_TOKEN is sent to the registry host.
+
+    """
+
+    def __init__(self, config):
+        self.registry = (config.registry or DEFAULT_REGISTRY).rstrip('/')
+        self.proxy = urlsplit(config.http_proxy) if config.http_proxy else None
+        self.token = os.environ.get('NPM_TOKEN', None)
+        self.local = threading.local()
+
+
+    def is_fetchable(self, url):
+        """Only plain http(s) tarball URLs are fetched natively"""
+        return url[0:4] == 'http' and url.endswith('.tgz') and 'github.com' not in url
+
+
+    def resolve_url(self, url):
+        """Point URLs of the default registry at the configured registry"""
+        if url.startswith(DEFAULT_REGISTRY + '/'):
+            return self.registry + url[len(DEFAULT_REGISTRY):]
+        return url
+
+
+    def fetch(self, url, dest_dir):
+        """Download a tarball and extract it, stripping its top directory
+
+        Args:
+            url (str): Tarball URL.
+            dest_dir (str): Directory to extract to. Must not exist yet.
+
+        Returns:
+            int: Number of bytes downloaded.
+        """
+        response = self.request(self.resolve_url(url))
+        reader = CountingReader(response)
+
+        try:
+            with tarfile.open(fileobj=reader, mode='r|*') as archive:
+                extract_package(archive, dest_dir)
+            # drain the rest of the body so the connection can be reused
+            while reader.read(64 * 1024):
+                pass
+        except (tarfile.TarError, IOError, EOFError, zlib.error) as e:
+            self.close_connection(urlsplit(self.resolve_url(url)))
+            raise FetchError('Invalid tarball %s (%s)' % (url, e))
+
+        return reader.bytes_read
+
+
+    def request(self, url, method='GET', body=None, headers=None):
+        """Send a request over a pooled connection, following redirects
+
+        Returns:
+            HTTPResponse: Response with status 2xx, body not yet read.
+
+        Raises:
+            FetchError: For other statuses or network errors.
+        """
+        for _ in range(MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            response = self.send(parts, method, body, headers or {})
+
+            if response.status in (301, 302, 303, 307, 308) and response.getheader('location'):
+                response.read()
+                url = urljoin(url, response.getheader('location'))
+                continue
+
+            if response.status >= 300:
+                response.read()
+                raise FetchError('%s %s returned HTTP %s' % (method, url, response.status), response.status)
+
+            return response
+
+        raise FetchError('Too many redirects for %s' % url)
+
+
+    def send(self, parts, method, body, headers):
+        headers = dict(headers)
+        headers.setdefault('User-Agent', 'frosty')
+
+        if self.token and parts.netloc == urlsplit(self.registry).netloc:
+            headers['Authorization'] = 'Bearer %s' % self.token
+
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        if self.proxy and parts.scheme == 'http':
+            path = '%s://%s%s' % (parts.scheme, parts.netloc, path)
+
+        # a pooled connection may have been closed by the server, retry once on a new one
+        for attempt in range(2):
+            connection = self.get_connection(parts)
+
+            try:
+                connection.request(method, path, body, headers)
+                return connection.getresponse()
+            except (httplib.HTTPException, socket.error) as e:
+                self.close_connection(parts)
+                if attempt == 1:
+                    raise FetchError('%s %s failed (%s)' % (method, parts.geturl(), e))
+
+
+    def get_connection(self, parts):
+        connections = self.local.__dict__.setdefault('connections', {})
+        key = (parts.scheme, parts.netloc)
+
+        if key not in connections:
+            Log.verbose('opening connection to %s://%s', parts.scheme, parts.netloc)
+            connections[key] = self.new_connection(parts)
+
+        return connections[key]
+
+
+    def new_connection(self, parts):
+        if parts.scheme == 'https':
+            if self.proxy:
+                connection = httplib.HTTPSConnection(self.proxy.hostname, self.proxy.port, timeout=TIMEOUT)
+                connection.set_tunnel(parts.hostname, parts.port or 443)
+                return connection
+            return httplib.HTTPSConnection(parts.hostname, parts.port, timeout=TIMEOUT)
+
+        if self.proxy:
+            return httplib.HTTPConnection(self.proxy.hostname, self.proxy.port, timeout=TIMEOUT)
+        return httplib.HTTPConnection(parts.hostname, parts.port, timeout=TIMEOUT)
+
+
+    def close_connection(self, parts):
+        connections = self.local.__dict__.get('connections', {})
+        connection = connections.pop((parts.scheme, parts.netloc), None)
+        if connection:
+            connection.close()
+
+
+class CountingReader(object):
+    """File-like wrapper counting the bytes read from a response"""
+
+    def __init__(self, response):
+        self.response = response
+        self.bytes_read = 0
+
+
+    def read(self, size=-1):
+        data = self.response.read(size) if size >= 0 else self.response.read()
+        self.bytes_read = self.bytes_read + len(data)
+        return data
+
+
+def extract_package(archive, dest_dir):
+    """Extract a streamed npm tarball into dest_dir
+
+    Like npm, the first path component (usually `package/`) is stripped,
+    only regular files and directories are extracted, and modes are
+    normalized to 0644/0755.
+    """
+    make_dirs(dest_dir)
+    dest_dir = os.path.abspath(dest_dir)
+
+    for member in archive:
+        parts = member.name.replace('\\', '/').split('/')[1:]
+        target = os.path.abspath(os.path.join(dest_dir, *parts)) if parts else dest_dir
+
+        if not target.startswith(dest_dir + os.sep):
+            Log.verbose('skipping tarball entry %s', member.name)
+            continue
+
+        if member.isdir():
+            make_dirs(target)
+        elif member.isfile():
+            make_dirs(os.path.dirname(target))
+            source = archive.extractfile(member)
+            with open(target, 'wb') as file:
+                shutil.copyfileobj(source, file)
+            os.chmod(target, 0o755 if member.mode & stat.S_IXUSR else 0o644)
@@ -23,58 +23,309 @@ import subprocess
 import sys
 import traceback
 
+from bundle import CacheBundle, open_bundle
 from cache import Cache
 from config import Config
-from errors import MissingNpmShrinkwrap
+from dedupe import HoistPlanner
+from errors import MissingNpmShrinkwrap, UnresolvedDependencies
+from evict import CacheCollector
 from log import Log
 from manifest import Manifest
 from npm import Npm
+from plan import PlanCache
+from profiler import Profiler
+from resolver import Resolver
+from retry import RetryPolicy
+from scheduler import Scheduler, Task
+from state import InstallState, prune_bin_links
 
 
 class Frosty(object):
 
-    def __init__(self):
-        self.config = Config()
+    def __init__(self, config=None):
+        self.config = config or Config()
 
         if self.config.verbose:
             Log.show_verbose = True
 
+        # keep stdout clean for the bundle
+        if self.config.command == 'bundle' and self.config.paths[0:2] == ['export', '-']:
+            Log.stream = sys.stderr
+
         if self.config.offline:
             Log.verbose('[OFFLINE MODE]')
 
+        if self.config.profile:
+            Profiler.enable()
+
         self.npm = Npm(self.config)
-        self.cache = Cache(self.config, self.npm)
+        with Profiler.span('open cache', 'phase'):
+            self.cache = Cache(self.config, self.npm)
+        self.plans = PlanCache(self.config.cache_dir)
 
 
     def run(self):
         try:
-            manifest = Manifest(Manifest.locate_file(self.config.cwd))
-            self.install(manifest)
+            with Profiler.span(self.config.command, 'phase'):
+                self.run_command()
+        finally:
+            if self.cache.remote:
+                self.cache.remote.wait()
+            if self.config.profile:
+                Profiler.write(self.config.profile)
+                Profiler.summarize()
+
+
+    def run_command(self):
+        if self.config.command == 'gc':
+            self.gc(blocking=True)
+            return
+
+        try:
+            if self.config.command == 'prefetch':
+                self.prefetch(self.config.paths or [os.curdir])
+            elif self.config.command == 'bundle':
+                self.bundle(self.config.paths)
+            else:
+                self.install(Manifest(Manifest.locate_file(self.config.cwd)))
         except MissingNpmShrinkwrap as e:
             Log.error(e.message)
             sys.exit(1)
 
+        if self.config.cache_max_size is not None:
+            self.gc(blocking=False)
+
+
+    def gc(self, blocking):
+        """Evict modules from the cache, once no other frosty process is using it"""
+        # entries still queued for upload must not be evicted under the upload thread
+        if self.cache.remote:
+            self.cache.remote.wait()
+
+        lock = self.cache.gc_lock
+        lock.release()
+
+        if not lock.acquire(blocking=blocking):
+            Log.info('Cache is in use by another frosty process, skipping garbage collection')
+            return
+
+        try:
+            collector = CacheCollector(self.cache, self.config.cache_max_size, self.config.gc_max_age * 24 * 60 * 60)
+            with Profiler.span('gc', 'phase'):
+                collector.collect()
+        finally:
+            lock.release()
+
+
+    def resolve(self, manifest):
+        """Fill in the dependency tree of a package.json project from the cache"""
+        if not manifest.is_package_json or manifest.deps is not None:
+            return
+
+        try:
+            with Profiler.span('resolve', 'phase'):
+                manifest.deps = Resolver(self.cache).resolve(manifest.json)
+        except UnresolvedDependencies as e:
+            Log.error(str(e))
+            sys.exit(1)
+
+
+    def load_install_records(self, manifest):
+        """Return the install records of a manifest, reusing the stored plan of an unchanged shrinkwrap"""
+        self.resolve(manifest)
+
+        # package.json resolves against the cache, which changes between runs
+        if manifest.is_package_json:
+            return manifest.iter_install_tasks()
+
+        with Profiler.span('plan', 'phase') as span:
+            key = PlanCache.get_key(manifest.path)
+            records = self.plans.load(key, manifest.root_path)
+
+            if span is not None:
+                span['cached'] = records is not None
+
+            if records is None:
+                records = list(manifest.iter_install_tasks())
+                self.plans.save(key, records)
+
+        return records
+
 
     def install(self, manifest):
-        if os.path.isdir(manifest.node_modules_path):
-            shutil.rmtree(manifest.node_modules_path)
-        os.mkdir(manifest.node_modules_path)
-        self.install_deps_tree(manifest.deps, manifest.root_path)
+        records = self.load_install_records(manifest)
+
+        if self.config.dedupe:
+            records = list(records)
+            # deduplication reads package.json of modules the shrinkwrap says nothing about
+            if self.config.batch and not self.config.offline:
+                self.fetch_misses([(record.name, record.version, record.url) for record in records])
+            with Profiler.span('dedupe', 'phase'):
+                records = HoistPlanner(self.cache).plan(records, manifest.root_path)
+
+        tasks = Scheduler.build_tasks_from_records(records)
+        previous = None
+
+        if self.config.incremental:
+            previous = InstallState.load(manifest.root_path)
+
+        if previous:
+            InstallState.discard(manifest.root_path)
+            (unchanged, removed) = previous.plan(tasks)
+            Log.info('Incremental install: %s modules unchanged, %s removed', len(unchanged), len(removed))
+            previous.remove(removed)
+        else:
+            unchanged = set()
+            if os.path.isdir(manifest.node_modules_path):
+                shutil.rmtree(manifest.node_modules_path)
+            os.mkdir(manifest.node_modules_path)
+
+        if self.config.batch and not self.config.offline:
+            self.fetch_misses([(task.module, task.version, task.url) for task in Scheduler.iter_tasks(tasks) if task.order not in unchanged])
+
+        state = InstallState(manifest.root_path)
+        with Profiler.span('install modules', 'phase'):
+            self.install_tasks(tasks, state, unchanged)
+
+        with Profiler.span('save state', 'phase'):
+            state.save()
+            self.cache.record_manifest(manifest.root_path, [(task.module, task.version) for task in Scheduler.iter_tasks(tasks)])
+
+        if previous:
+            with Profiler.span('prune bin links', 'phase'):
+                for task in Scheduler.iter_tasks(tasks):
+                    if task.order not in unchanged:
+                        prune_bin_links(os.path.join(task.path, 'node_modules'))
+
 
+    def prefetch(self, paths):
+        """Add the modules of several projects to the cache, without installing them
 
-    def install_deps_tree(self, deps, path):
-        for key in deps.keys():
-            (module, version, url) = key.split('===')
+        Modules are collected from every manifest first, so a module shared
+        by several projects is only looked up and fetched once.
 
+        Args:
+            paths (list): npm-shrinkwrap.json files or project directories,
+                relative to --cwd.
+        """
+        tasks = self.collect_tasks(paths)
+        Log.info('Prefetching %s modules used by %s projects', len(tasks), len(paths))
+
+        if self.config.offline:
+            misses = [task for task in tasks if not self.cache.query(task.module, task.version)]
+            if misses:
+                Log.error('%s modules are not cached, cannot prefetch them offline', len(misses))
+                sys.exit(1)
+            return
+
+        if self.config.batch:
+            self.fetch_misses([(task.module, task.version, task.url) for task in tasks])
+
+        def add_task(task):
+            if not self.cache.query(task.module, task.version):
+                self.cache.add(task.module, task.version, task.url)
+
+        # no task has children, so all of them are fetched in parallel
+        with Profiler.span('fetch modules', 'phase'):
+            self.run_tasks(tasks, add_task)
+
+
+    def collect_tasks(self, paths):
+        """Return one task per distinct module used by several projects
+
+        Args:
+            paths (list): npm-shrinkwrap.json files or project directories,
+                relative to --cwd.
+
+        Returns:
+            list: Tasks without children or install path.
+        """
+        keys = set()
+        tasks = []
+
+        for path in paths:
+            path = os.path.join(self.config.cwd, path)
+            manifest = Manifest(os.path.abspath(path) if os.path.isfile(path) else Manifest.locate_file(path))
+
+            for record in self.load_install_records(manifest):
+                key = (record.name, record.version, record.url)
+                if key not in keys:
+                    keys.add(key)
+                    tasks.append(Task(len(tasks), record.name, record.version, record.url, None))
+
+        return tasks
+
+
+    def bundle(self, args):
+        """Export the cached modules of projects to a bundle, or import one
+
+        Args:
+            args (list): `export FILE [PATH...]` or `import FILE`, FILE may be `-`.
+        """
+        if len(args) < 2 or args[0] not in ('export', 'import') or (args[0] == 'import' and len(args) > 2):
+            Log.error('usage: frosty bundle export FILE [PATH...] | frosty bundle import FILE')
+            sys.exit(1)
+
+        (action, path) = args[0:2]
+        bundle = CacheBundle(self.cache)
+
+        if action == 'import':
             try:
-                self.install_module(module, version, url, path)
-            except BaseException as e:
-                Log.error('Failed to install %s@%s from %s', module, version, url)
-                Log.info('self.config.force = %s', self.config.force)
-                if self.config.force is False:
-                    raise e
-
-            self.install_deps_tree(deps[key], os.path.join(path, 'node_modules', module))
+                with open_bundle(path, 'rb') as file:
+                    bundle.import_modules(file)
+            except RuntimeError as e:
+                Log.error(str(e))
+                sys.exit(1)
+            return
+
+        tasks = self.collect_tasks(args[2:] or [os.curdir])
+        modules = sorted(set((task.module, task.version) for task in tasks))
+        missing = [module for module in modules if not self.cache.query(*module)]
+
+        if missing:
+            for module in missing:
+                Log.error('%s@%s is not cached', *module)
+            Log.error('Cannot export %s modules, run frosty prefetch first', len(missing))
+            sys.exit(1)
+
+        with open_bundle(path, 'wb') as file:
+            bundle.export_modules(modules, file, compress=path.endswith('gz'))
+
+
+    def install_tasks(self, tasks, state, unchanged):
+        def install_task(task):
+            if task.order not in unchanged:
+                self.install_module(task.module, task.version, task.url, task.path)
+            state.record(task)
+
+        self.run_tasks(tasks, install_task)
+
+
+    def run_tasks(self, tasks, function):
+        """Run function on the scheduler, retrying transient failures, and report the outcome"""
+        scheduler = Scheduler(self.config.jobs, self.config.force, RetryPolicy.from_config(self.config))
+
+        try:
+            failures = scheduler.run(tasks, function)
+        finally:
+            if scheduler.retried:
+                retries = sum(attempts - 1 for (_, attempts, _) in scheduler.retried.values())
+                recovered = len([installed for (_, _, installed) in scheduler.retried.values() if installed])
+                Log.info('Retried %s modules %s times, %s of them succeeded', len(scheduler.retried), retries, recovered)
+
+        for (task, error) in failures:
+            Log.info('Skipped %s@%s (%s)', task.module, task.version, error)
+
+
+    def fetch_misses(self, modules):
+        """Add every (name, version, url) missing from the cache up front, in batches"""
+        modules = set(modules)
+        misses = [module for module in modules if not self.cache.query(module[0], module[1])]
+
+        if misses:
+            Log.info('%s of %s modules are not cached', len(misses), len(modules))
+            with Profiler.span('fetch misses', 'phase', modules=len(misses)):
+                self.cache.add_many(misses)
 
 
     def install_module(self, module, version, url, path):
@@ -0,0 +1,208 @@
+import fcntl
+import json
+import os
+import threading
+
+from log import Log
+
+
+class CacheIndex(object):
+    """Append-only log of the modules present in the cache
+
+    Every complete cache entry has an `add` record holding what installs
+    need to know about it (store format, deps.json contents, bin map and
+    size), so a whole manifest can be checked against the cache after
+    reading a single file, without probing the cache directory per module.
+    Removals are recorded with `remove` records. Appends are serialized
+    across processes with flock, and the log is compacted once most of its
+    records are stale.
+
+    Args:
+        cache_dir (str): Root of the cache.
+
+    """
+
+    FILENAME = 'index.log'
+
+    def __init__(self, cache_dir):
+        self.path = os.path.join(cache_dir, CacheIndex.FILENAME)
+        self.entries = {}
+        self.records = 0
+        # position up to which the log has been replayed, see `refresh`
+        self.inode = None
+        self.offset = 0
+        self.lock = threading.Lock()
+
+
+    @staticmethod
+    def get_key(module_name, module_version):
+        return '%s@%s' % (module_name, module_version)
+
+
+    def load(self):
+        """Replay the log into memory, compacting it if worthwhile"""
+        entries = {}
+        records = 0
+        inode = None
+        offset = 0
+
+        if os.path.isfile(self.path):
+            with open(self.path, 'rb') as file:
+                fcntl.flock(file, fcntl.LOCK_SH)
+                inode = os.fstat(file.fileno()).st_ino
+                (records, offset) = CacheIndex.replay(file, entries)
+
+        with self.lock:
+            self.entries = entries
+            self.records = records
+            self.inode = inode
+            self.offset = offset
+
+        if records > 1000 and records > 2 * len(entries):
+            self.compact()
+
+        Log.verbose('Loaded cache index %s (%s modules)', self.path, len(entries))
+
+
+    def refresh(self):
+        """Replay the records other processes appended since the last load
+
+        Only the tail of the log is read, unless it was compacted meanwhile.
+        """
+        if not os.path.isfile(self.path):
+            return
+
+        with open(self.path, 'rb') as file:
+            fcntl.flock(file, fcntl.LOCK_SH)
+
+            with self.lock:
+                compacted = os.fstat(file.fileno()).st_ino != self.inode
+                if not compacted:
+                    file.seek(self.offset)
+                    (records, self.offset) = CacheIndex.replay(file, self.entries, self.offset)
+                    self.records = self.records + records
+
+        if compacted:
+            self.load()
+
+
+    @staticmethod
+    def replay(file, entries, offset=0):
+        """Apply the complete lines of a log file to entries
+
+        Returns:
+            tuple: (number of lines applied, offset after the last complete line)
+        """
+        records = 0
+
+        for line in file:
+            # a line still missing its newline was torn, it will be skipped once terminated
+            if not line.endswith(b'\n'):
+                break
+            records = records + 1
+            offset = offset + len(line)
+            CacheIndex.apply(entries, line)
+
+        return (records, offset)
+
+
+    @staticmethod
+    def apply(entries, line):
+        try:
+            record = json.loads(line.decode('utf-8'))
+            key = CacheIndex.get_key(record['name'], record['version'])
+        except (ValueError, KeyError, TypeError):
+            # a torn write from a crashed process, ignore it
+            return
+
+        if record.get('op') == 'remove':
+            entries.pop(key, None)
+        else:
+            entries[key] = record
+
+
+    def get(self, module_name, module_version):
+        with self.lock:
+            return self.entries.get(CacheIndex.get_key(module_name, module_version), None)
+
+
+    def names(self):
+        """Return {name: [versions]} for every indexed module"""
+        with self.lock:
+            records = list(self.entries.values())
+
+        versions = {}
+        for record in records:
+            versions.setdefault(record['name'], []).append(record['version'])
+        return versions
+
+
+    def add(self, record):
+        record = dict(record, op='add')
+        self.append([record])
+
+        with self.lock:
+            self.entries[CacheIndex.get_key(record['name'], record['version'])] = record
+
+
+    def remove(self, module_name, module_version):
+        self.append([{'op': 'remove', 'name': module_name, 'version': module_version}])
+
+        with self.lock:
+            self.entries.pop(CacheIndex.get_key(module_name, module_version), None)
+
+
+    def append(self, records):
+        data = ''.join(json.dumps(record, sort_keys=True, separators=(',', ':')) + '\n' for record in records)
+
+        with self.open_locked() as file:
+            # never glue a record to a line torn by a crashed writer
+            file.seek(0, os.SEEK_END)
+            if file.tell() > 0:
+                file.seek(-1, os.SEEK_END)
+                if file.read(1) != '\n':
+                    data = '\n' + data
+            file.write(data)
+            file.flush()
+
+        with self.lock:
+            self.records = self.records + len(records)
+
+
+    def compact(self):
+        """Rewrite the log with one record per live entry"""
+        with self.open_locked():
+            # other processes may have appended since load, replay under the lock
+            entries = {}
+            with open(self.path, 'rb') as file:
+                CacheIndex.replay(file, entries)
+
+            temp_path = '%s.%s.tmp' % (self.path, os.getpid())
+            with open(temp_path, 'w') as file:
+                for key in sorted(entries.keys()):
+                    file.write(json.dumps(entries[key], sort_keys=True, separators=(',', ':')) + '\n')
+            os.rename(temp_path, self.path)
+
+        with self.lock:
+            self.entries = entries
+            self.records = len(entries)
+            self.inode = os.stat(self.path).st_ino
+            self.offset = os.path.getsize(self.path)
+
+        Log.verbose('Compacted cache index %s (%s modules)', self.path, len(entries))
+
+
+    def open_locked(self):
+        """Open the log for appending, holding an exclusive lock
+
+        The file is reopened if another process compacted (replaced) it
+        while we were waiting for the lock.
+        """
+        while True:
+            file = open(self.path, 'a+')
+            fcntl.flock(file, fcntl.LOCK_EX)
+
+            if os.path.exists(self.path) and os.fstat(file.fileno()).st_ino == os.stat(self.path).st_ino:
+                return file
+
+            file.close()
@@ -0,0 +1,187 @@
+import errno
+import fcntl
+import os
+import shutil
+import sys
+import threading
+
+from log import Log
+from util import make_dirs
+
+
+# ioctl request used to clone a file on Linux (btrfs, xfs, overlayfs, ...)
+FICLONE = 0x40049409
+
+# errors which mean a link method is not available between two directories
+UNSUPPORTED_ERRORS = set([
+    errno.EXDEV,
+    errno.EINVAL,
+    errno.ENOTTY,
+    errno.EPERM,
+    errno.EOPNOTSUPP,
+    getattr(errno, 'ENOTSUP', errno.EOPNOTSUPP),
+    getattr(errno, 'ENOSYS', errno.EOPNOTSUPP),
+])
+
+LINK_MODES = ['copy', 'hardlink', 'reflink', 'symlink', 'auto']
+
+
+class Linker(object):
+    """Materializes files from the cache into a project
+
+    Args:
+        mode (str): One of LINK_MODES.
+
+            copy      Copy every file (the historic behaviour).
+            hardlink  Hard link files. Files are shared with the cache, so
+                      they must not be modified in the project.
+            reflink   Copy-on-write clone files. Needs filesystem support.
+            symlink   Symlink files. Node must be run with
+                      --preserve-symlinks for nested modules to resolve.
+            auto      Try reflink, then hardlink, then copy, remembering
+                      what works for each (cache device, project device).
+
+    """
+
+    def __init__(self, mode='copy'):
+        if mode not in LINK_MODES:
+            raise RuntimeError('Invalid link mode %s, expected one of %s' % (mode, ', '.join(LINK_MODES)))
+
+        self.mode = mode
+        self.methods = {}
+        self.methods_lock = threading.Lock()
+
+
+    def copy_tree(self, src, dst):
+        """Recreate directory `src` at `dst` using the configured link mode"""
+        methods = self.get_methods(src, os.path.dirname(dst))
+
+        for root, dirs, files in os.walk(src):
+            target_root = os.path.join(dst, os.path.relpath(root, src))
+            make_dirs(target_root)
+            shutil.copymode(root, target_root)
+
+            for name in dirs + files:
+                source = os.path.join(root, name)
+                target = os.path.join(target_root, name)
+
+                if os.path.islink(source):
+                    os.symlink(os.readlink(source), target)
+                elif name in files:
+                    methods = self.link_file(methods, source, target)
+
+
+    def link_files(self, pairs):
+        """Link each (source, target) file pair. Target directories must exist."""
+        methods = None
+
+        for (source, target) in pairs:
+            if methods is None:
+                methods = self.get_methods(source, os.path.dirname(target))
+            methods = self.link_file(methods, source, target)
+
+
+    def link_file(self, methods, source, target):
+        """Link a single file with the first method that works
+
+        Returns:
+            list: Methods still worth trying for the remaining files.
+        """
+        while True:
+            method = methods[0]
+
+            try:
+                method(source, target)
+                return methods
+            except (IOError, OSError) as e:
+                if e.errno == errno.EMLINK and method is link_hardlink:
+                    # this file has too many links already, copy just this one
+                    link_copy(source, target)
+                    return methods
+
+                if e.errno not in UNSUPPORTED_ERRORS or len(methods) == 1:
+                    raise
+
+                if os.path.lexists(target):
+                    os.remove(target)
+
+                Log.verbose('%s unavailable for %s, falling back', method.__name__, target)
+                methods = methods[1:]
+                self.remember_methods(source, os.path.dirname(target), methods)
+
+
+    def get_methods(self, src, dst):
+        if self.mode != 'auto':
+            return [MODE_METHODS[self.mode]]
+
+        with self.methods_lock:
+            return self.methods.get(device_pair(src, dst), AUTO_METHODS)
+
+
+    def remember_methods(self, src, dst, methods):
+        if self.mode == 'auto':
+            with self.methods_lock:
+                self.methods[device_pair(src, dst)] = methods
+
+
+def replace_symlink(target, link_path):
+    """Atomically point link_path at target, replacing whatever is there"""
+    temp_path = '%s.%s.%s.tmp' % (link_path, os.getpid(), threading.current_thread().ident)
+    os.symlink(target, temp_path)
+
+    try:
+        os.rename(temp_path, link_path)
+    except OSError:
+        os.remove(temp_path)
+        raise
+
+
+def device_pair(src, dst):
+    while not os.path.exists(dst):
+        dst = os.path.dirname(dst)
+    return (os.stat(src).st_dev, os.stat(dst).st_dev)
+
+
+def link_copy(source, target):
+    shutil.copy2(source, target)
+
+
+def link_hardlink(source, target):
+    os.link(source, target)
+
+
+def link_symlink(source, target):
+    os.symlink(os.path.abspath(source), target)
+
+
+def link_reflink(source, target):
+    if sys.platform == 'darwin':
+        return clonefile(source, target)
+
+    with open(source, 'rb') as src_file:
+        with open(target, 'wb') as dst_file:
+            try:
+                fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+            except IOError as e:
+                raise OSError(e.errno, e.strerror, target)
+    shutil.copystat(source, target)
+
+
+def clonefile(source, target):
+    import ctypes
+    import ctypes.util
+
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    if libc.clonefile(source.encode('utf-8'), target.encode('utf-8'), 0) != 0:
+        code = ctypes.get_errno()
+        raise OSError(code, os.strerror(code), target)
+
+
+MODE_METHODS = {
+    'copy': link_copy,
+    'hardlink': link_hardlink,
+    'reflink': link_reflink,
+    'symlink': link_symlink,
+}
+
+AUTO_METHODS = [link_reflink, link_hardlink, link_copy]
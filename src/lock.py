@@ -0,0 +1,60 @@
+import errno
+import fcntl
+import os
+
+from util import make_dirs
+
+
+class FileLock(object):
+    """Advisory lock on a file, shared between processes
+
+    Uses flock, so every FileLock instance (even two in the same process)
+    holds its own lock.
+
+    Args:
+        path (str): Lock file. Created if missing.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+
+    def acquire(self, shared=False, blocking=True):
+        """Take the lock
+
+        Returns:
+            bool: False if `blocking` is off and the lock is held elsewhere.
+        """
+        if self.file is None:
+            make_dirs(os.path.dirname(self.path))
+            self.file = open(self.path, 'a')
+
+        flags = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        if not blocking:
+            flags = flags | fcntl.LOCK_NB
+
+        try:
+            fcntl.flock(self.file, flags)
+            return True
+        except IOError as e:
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                return False
+            raise
+
+
+    def release(self):
+        if self.file is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
+
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+
+    def __exit__(self, *nargs):
+        self.release()
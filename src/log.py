@@ -1,5 +1,10 @@
+import sys
+
+
 class Log(object):
     show_verbose = False
+    # messages go to stdout, unless stdout carries data (see `frosty bundle export -`)
+    stream = None
 
     @staticmethod
     def verbose(*nargs):
@@ -17,8 +22,12 @@ class Log(object):
     @staticmethod
     def println(nargs):
         try:
-            print(nargs[0] % tuple(nargs[1:]))
+            Log.write(nargs[0] % tuple(nargs[1:]))
         except TypeError as e:
             import pdb;pdb.set_trace()
-            print(e)
+            Log.write(str(e))
+
+    @staticmethod
+    def write(message):
+        (Log.stream or sys.stdout).write(message + '\n')
 
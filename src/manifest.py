@@ -5,6 +5,40 @@ from errors import MissingNpmShrinkwrap
 from util import tree
 
 
+class InstallRecord(object):
+    """A module to install into <path>/node_modules/<name>
+
+    Attributes:
+        parent (int): Position of the parent record in the walk, or None for
+            top level modules.
+        requires (tuple): Names of the modules it depends on, from the
+            shrinkwrap, or None if the shrinkwrap does not say.
+
+    """
+
+    __slots__ = ('path', 'name', 'version', 'url', 'parent', 'requires')
+
+    def __init__(self, path, name, version, url, parent, requires=None):
+        self.path = path
+        self.name = name
+        self.version = version
+        self.url = url
+        self.parent = parent
+        self.requires = requires
+
+
+class ShrinkwrapEntry(object):
+    """The fields of a npm-shrinkwrap.json dependency which frosty uses"""
+
+    __slots__ = ('version', 'resolved', 'dependencies', 'requires')
+
+    def __init__(self, version, resolved, dependencies, requires):
+        self.version = version
+        self.resolved = resolved
+        self.dependencies = dependencies
+        self.requires = requires
+
+
 class Manifest(object):
     """Represents node project manifest file
 
@@ -20,11 +54,121 @@ class Manifest(object):
     """
 
     def __init__(self, manifest_path):
-        self.json = Manifest.read(manifest_path)
-        self.deps = Manifest.build_dependency_tree(self.json)
+        self.path = manifest_path
         self.root_path = os.path.dirname(manifest_path)
         self.node_modules_path = os.path.join(self.root_path, 'node_modules')
 
+        # package.json only holds ranges, which are resolved against the cache (see Resolver)
+        self.is_package_json = os.path.basename(manifest_path) == 'package.json'
+        self._json = None
+        self._deps = None
+
+
+    @property
+    def json(self):
+        """Contents of the manifest, read on first use"""
+        if self._json is None:
+            if self.is_package_json:
+                self._json = Manifest.read(self.path)
+            else:
+                self._json = Manifest.read_shrinkwrap(self.path)
+        return self._json
+
+
+    @property
+    def deps(self):
+        """Nested dependency tree keyed by `name===version===url`
+
+        Built on first use from a shrinkwrap; installs walk `iter_install_tasks`
+        instead. For package.json, None until set from the resolved tree.
+        """
+        if self._deps is None and not self.is_package_json:
+            self._deps = Manifest.build_tree(self.iter_install_tasks())
+        return self._deps
+
+
+    @deps.setter
+    def deps(self, deps):
+        self._deps = deps
+
+
+    def iter_install_tasks(self):
+        """Yield an InstallRecord per module to install, parents first
+
+        The walk is iterative, so deep trees cannot exceed the recursion
+        limit, and siblings are visited in sorted order.
+        """
+        if self.is_package_json:
+            return Manifest.iter_tree_records(self.deps or {}, self.root_path)
+
+        dependencies = dict(self.json.get('devDependencies') or {})
+        dependencies.update(self.json.get('dependencies') or {})
+        return Manifest.iter_shrinkwrap_records(dependencies, self.root_path)
+
+
+    @staticmethod
+    def iter_shrinkwrap_records(dependencies, root_path):
+        order = 0
+        stack = [(name, dependencies[name], root_path, None) for name in sorted(dependencies.keys(), reverse=True)]
+
+        while stack:
+            (name, entry, path, parent) = stack.pop()
+            if not isinstance(entry, ShrinkwrapEntry):
+                raise RuntimeError('Invalid value %s for %s, expected an object with a version' % (entry, name))
+
+            version = entry.version
+            url = entry.resolved
+            sub_dependencies = entry.dependencies if entry.dependencies is not None else {}
+
+            if not url:
+                url = Manifest.calculate_resolved_url(name, version)
+            if type(version) not in [str, unicode]:
+                raise RuntimeError('Invalid value %s for %s.version, expected str' % (version, name))
+            if type(sub_dependencies) is not dict:
+                raise RuntimeError('Invalid value %s for %s.dependencies, expected dict' % (sub_dependencies, name))
+
+            if url[0:4] == 'git+':
+                # Get commit sha from URL string
+                version = url.split('#')[-1]
+
+            requires = tuple(sorted(entry.requires.keys())) if isinstance(entry.requires, dict) else None
+            yield InstallRecord(path, name, version, url, parent, requires)
+
+            child_path = os.path.join(path, 'node_modules', name)
+            for child in sorted(sub_dependencies.keys(), reverse=True):
+                stack.append((child, sub_dependencies[child], child_path, order))
+            order = order + 1
+
+
+    @staticmethod
+    def iter_tree_records(deps, root_path):
+        """Like iter_shrinkwrap_records, for a tree keyed by `name===version===url`"""
+        order = 0
+        stack = [(key, deps[key], root_path, None) for key in sorted(deps.keys(), reverse=True)]
+
+        while stack:
+            (key, sub_deps, path, parent) = stack.pop()
+            (name, version, url) = key.split('===')
+            yield InstallRecord(path, name, version, url, parent)
+
+            child_path = os.path.join(path, 'node_modules', name)
+            for child_key in sorted(sub_deps.keys(), reverse=True):
+                stack.append((child_key, sub_deps[child_key], child_path, order))
+            order = order + 1
+
+
+    @staticmethod
+    def build_tree(records):
+        """Nest InstallRecords into a tree keyed by `name===version===url`"""
+        deps = tree()
+        nodes = []
+
+        for record in records:
+            parent = deps if record.parent is None else nodes[record.parent]
+            nodes.append(parent['%s===%s===%s' % (record.name, record.version, record.url)])
+
+        return deps
+
 
     def get_deps(self):
         full_dep_list = tree()
@@ -47,27 +191,9 @@ class Manifest(object):
 
     @staticmethod
     def append_dependencies_to_tree(deps, dep_json):
-       for key in dep_json.keys():
-           value = dep_json.get(key, None);
-
-           sub_deps = tree()
-           version = value.get('version', None)
-           resolved_url = value.get('resolved', None)
-           sub_dep_json = value.get('dependencies', {})
-
-           if not resolved_url:
-               resolved_url = Manifest.calculate_resolved_url(key, version)
-           if type(version) not in [str, unicode]:
-               raise RuntimeError('Invalid value %s for %s.version, expected str' % (version, key))
-           if type(sub_dep_json) is not dict:
-               raise RuntimeError('Invalid value %s for %s.dependencies, expected dict' % (sub_dep_json, key))
-
-           if resolved_url[0:4] == 'git+':
-               # Get commit sha from URL string
-               version = resolved_url.split('#')[-1]
-
-           deps['%s===%s===%s' % (key, version, resolved_url)] = sub_deps
-           Manifest.append_dependencies_to_tree(sub_deps, sub_dep_json)
+        """Add a shrinkwrap `dependencies` map to a tree keyed by `name===version===url`"""
+        records = Manifest.iter_shrinkwrap_records(compact_dependencies(dep_json), '')
+        deps.update(Manifest.build_tree(records))
 
 
     @staticmethod
@@ -84,6 +210,29 @@ class Manifest(object):
             return json.load(file)
 
 
+    @staticmethod
+    def read_shrinkwrap(manifest_path):
+        '''Read npm-shrinkwrap.json, keeping only what installs need
+
+        Dependency objects are replaced by ShrinkwrapEntries while the file
+        is parsed, as soon as the object holding them is complete (see
+        `compact_object`), so the fields frosty ignores (from, integrity,
+        ...) are never held for the whole tree at once.
+        '''
+
+        with open(manifest_path) as file:
+            data = json.load(file, object_pairs_hook=compact_object)
+
+        if not isinstance(data, dict):
+            raise RuntimeError('Invalid %s, expected an object' % manifest_path)
+
+        for key in ('dependencies', 'devDependencies'):
+            if isinstance(data.get(key), dict):
+                # what parsing left, e.g. the top level of devDependencies
+                data[key] = compact_dependencies(data[key])
+        return data
+
+
     @staticmethod
     def locate_file(cwd):
         if cwd is None:
@@ -97,9 +246,62 @@ class Manifest(object):
         if os.path.isfile(shrinkwrap_path):
             return shrinkwrap_path
 
-        # TODO: Handling package.json is not implemented yet
-        # package_path = os.path.abspath(os.path.join(cwd, 'package.json'))
-        # if os.path.isfile(package_path):
-        #     return package_path
+        package_path = os.path.abspath(os.path.join(cwd, 'package.json'))
+
+        if os.path.isfile(package_path):
+            return package_path
+
+        raise MissingNpmShrinkwrap('Cannot find npm-shrinkwrap.json or package.json %s' % cwd)
+
+
+def compact_object(pairs):
+    """Parse a JSON object, compacting the dependencies it holds
+
+    JSON objects are parsed innermost first, so an object cannot know where
+    it is. Its parent can: the values of a `dependencies` member are
+    dependency objects, unless the member is itself a dependency object, of
+    a module named `dependencies`, which has a string version. Only a
+    member whose values are all objects is therefore compacted; anything
+    else is left for `compact_dependencies` and the walk to report.
+    """
+    data = dict(pairs)
+    dependencies = data.get('dependencies')
+
+    if isinstance(dependencies, dict) and all(isinstance(value, (dict, ShrinkwrapEntry))
+                                              for value in dependencies.values()):
+        for (name, value) in dependencies.items():
+            if isinstance(value, dict):
+                dependencies[name] = ShrinkwrapEntry(value.get('version'), value.get('resolved'),
+                                                     value.get('dependencies'), value.get('requires'))
+
+    return data
+
+
+def compact_dependencies(dependencies):
+    """Return a copy of a shrinkwrap `dependencies` map holding ShrinkwrapEntries
+
+    Objects are dependencies because of where they are, the values of a
+    `dependencies` map, whatever keys they have: a root without a name, or
+    a module named `version` in a `requires` map, stay as they are. The
+    walk is iterative, like `Manifest.iter_shrinkwrap_records`. Values
+    which are not objects are kept, for the walk to report.
+    """
+    compacted = {}
+    stack = [(dependencies, compacted)]
+
+    while stack:
+        (source, target) = stack.pop()
+
+        for (name, value) in source.items():
+            if not isinstance(value, dict):
+                target[name] = value
+                continue
+
+            sub_dependencies = value.get('dependencies')
+            if isinstance(sub_dependencies, dict):
+                stack.append((sub_dependencies, {}))
+                sub_dependencies = stack[-1][1]
+
+            target[name] = ShrinkwrapEntry(value.get('version'), value.get('resolved'), sub_dependencies, value.get('requires'))
 
-        raise MissingNpmShrinkwrap('Cannot find npm-shrinkwrap.json %s' % cwd)
+    return compacted
@@ -1,11 +1,18 @@
 import json
 import os
+import platform
 import shutil
 import subprocess
-import time
+import threading
 
+from fetch import Fetcher
 from log import Log
-from util import tree
+from profiler import Profiler
+from util import make_dirs, tree
+
+
+# npm runs these on install, such modules can only be installed by npm itself
+INSTALL_SCRIPTS = ['preinstall', 'install', 'postinstall']
 
 
 class Npm(object):
@@ -16,8 +23,14 @@ class Npm(object):
 
     """
 
+    # host properties, probed once per process, even by concurrent workers
+    platform = None
+    host_fingerprint = None
+    host_lock = threading.Lock()
+
     def __init__(self, config):
         self.config = config
+        self.fetcher = Fetcher(config)
 
 
     def is_module_osx_only(self, module_name, module_version, prefix_dir):
@@ -34,43 +47,186 @@ class Npm(object):
 
     def get_platform(self):
         """Return platform name (`uname -s`)"""
-        return subprocess.check_output(['uname', '-s']).strip()
+        if Npm.platform is None:
+            with Npm.host_lock:
+                if Npm.platform is None:
+                    Npm.platform = subprocess.check_output(['uname', '-s']).decode('utf-8').strip()
+        return Npm.platform
+
+
+    @staticmethod
+    def get_host_fingerprint():
+        """Return <os>-<arch>-node<ABI> of this host, e.g. linux-x86_64-node57
+
+        Compiled addons only load on the OS, architecture and node ABI
+        (`process.versions.modules`) they were built for.
+        """
+        if Npm.host_fingerprint is None:
+            with Npm.host_lock:
+                if Npm.host_fingerprint is None:
+                    try:
+                        abi = subprocess.check_output(['node', '-p', 'process.versions.modules']).decode('utf-8').strip()
+                    except (OSError, subprocess.CalledProcessError):
+                        abi = 'unknown'
+
+                    Npm.host_fingerprint = '%s-%s-node%s' % (platform.system().lower(), platform.machine().lower(),
+                                                             abi)
+                    Log.verbose('Host fingerprint is %s', Npm.host_fingerprint)
+
+        return Npm.host_fingerprint
+
+
+    @staticmethod
+    def get_native_version(module_version):
+        """Version directory of a module with native code built on this host"""
+        return '%s@%s' % (module_version, Npm.get_host_fingerprint())
 
 
     def is_osx(self):
         return self.get_platform() == 'Darwin'
 
 
+    def is_installable(self, module_name, module_version, module_url, prefix_dir):
+        return self.is_osx() or self.is_git_module(module_url) or not self.is_module_osx_only(module_name, module_version, prefix_dir)
+
+
     def install(self, module_name, module_version, module_url, prefix_dir=None):
-        if not self.is_osx() and not self.is_git_module(module_url) and self.is_module_osx_only(module_name, module_version, prefix_dir):
+        module_dir = self.fetch(module_name, module_version, module_url, prefix_dir)
+        if module_dir:
+            return module_dir
+
+        if not self.is_installable(module_name, module_version, module_url, prefix_dir):
             raise RuntimeError('Cannot install %s on platform %s' % (module_url, self.get_platform()))
 
         cmd = self.build_npm_cmd(prefix_dir=prefix_dir)
         cmd.extend(['install', module_url])
 
-        attempts = 0
-        attempt_delay = 5
-        max_attempts = 10
-        try_again = True
-
-        while try_again:
-            attempts = attempts + 1
-            Log.info('Attempting to install node module %s (attempt #%s)', module_name, attempts)
+        # a single attempt, failures are retried by the scheduler (see RetryPolicy)
+        Log.info('Attempting to install node module %s', module_name)
+        with Profiler.span('npm install', 'module', module='%s@%s' % (module_name, module_version)):
             result, error = self.try_install(cmd, prefix_dir)
 
-            if result is True and error is None:
-                try_again = False
-            elif attempts < max_attempts:
-                time.sleep(attempt_delay)
-            else:
-                raise error
+        if error is not None:
+            raise error
 
         return os.path.join(prefix_dir, 'node_modules', module_name)
 
 
+    def fetch(self, module_name, module_version, module_url, prefix_dir):
+        """Install a plain registry tarball without running npm
+
+        Returns:
+            str: Path of the installed module, or None if npm has to install
+                 it (git modules and modules with install scripts).
+        """
+        if not self.config.native_fetch or not self.fetcher.is_fetchable(module_url):
+            return None
+
+        module_dir = os.path.join(prefix_dir, 'node_modules', module_name)
+        fetch_dir = os.path.join(prefix_dir, '.fetch', module_name)
+
+        Log.info('Fetching node module %s@%s', module_name, module_version)
+        with Profiler.span('download', 'module', module='%s@%s' % (module_name, module_version)) as span:
+            size = self.fetcher.fetch(module_url, fetch_dir)
+            if span is not None:
+                span['bytes'] = size
+
+        try:
+            with open(os.path.join(fetch_dir, 'package.json')) as file:
+                package = json.load(file)
+        except (IOError, ValueError):
+            raise RuntimeError('Invalid package.json in %s' % module_url)
+
+        if package.get('os', None) in [['darwin'], 'darwin'] and not self.is_osx():
+            shutil.rmtree(fetch_dir)
+            raise RuntimeError('Cannot install %s on platform %s' % (module_url, self.get_platform()))
+
+        if Npm.needs_npm(fetch_dir, package):
+            Log.verbose('%s@%s has install scripts, using npm', module_name, module_version)
+            shutil.rmtree(fetch_dir)
+            return None
+
+        for path in Npm.get_bin_map(package).values():
+            bin_path = os.path.join(fetch_dir, path)
+            if os.path.isfile(bin_path):
+                os.chmod(bin_path, 0o755)
+
+        make_dirs(os.path.dirname(module_dir))
+        os.rename(fetch_dir, module_dir)
+        return module_dir
+
+
+    @staticmethod
+    def needs_npm(module_dir, package):
+        scripts = package.get('scripts', None) or {}
+        return (any(name in scripts for name in INSTALL_SCRIPTS) or
+                os.path.isfile(os.path.join(module_dir, 'binding.gyp')))
+
+
+    @staticmethod
+    def has_native_code(module_dir):
+        """Return whether a module contains compiled addons (*.node) or builds them
+
+        Nested node_modules are not looked at, they are cached on their own.
+        """
+        if os.path.isfile(os.path.join(module_dir, 'binding.gyp')):
+            return True
+
+        for (root, dirs, files) in os.walk(module_dir):
+            if root == module_dir and 'node_modules' in dirs:
+                dirs.remove('node_modules')
+            if any(name.endswith('.node') for name in files):
+                return True
+
+        return False
+
+
+    @staticmethod
+    def get_bin_map(package):
+        """Return the {name: path} map of executables declared in package.json"""
+        bin = package.get('bin', None) or {}
+
+        if not isinstance(bin, dict):
+            return {package['name'].split('/')[-1]: bin}
+        return bin
+
+
+    def install_many(self, modules, prefix_dir):
+        """Install several modules with a single npm invocation
+
+        Plain registry tarballs are expected to be fetched already (see
+        `Cache.fetch_many`), everything passed here goes to one `npm install`.
+        Modules which cannot be installed on this platform are left out.
+        There are no retries: callers fall back to `install` for each module.
+
+        Args:
+            modules (list): (name, version, url) tuples, with distinct names.
+            prefix_dir (str): Value passed to `npm install --prefix`.
+
+        Returns:
+            list: Paths of the installed modules.
+        """
+        modules = [module for module in modules if self.is_installable(module[0], module[1], module[2], prefix_dir)]
+
+        if not modules:
+            return []
+
+        cmd = self.build_npm_cmd(prefix_dir=prefix_dir)
+        cmd.extend(['install'] + [url for (_, _, url) in modules])
+
+        Log.info('Installing %s node modules with a single npm install', len(modules))
+        result, error = self.try_install(cmd, prefix_dir)
+
+        if error is not None:
+            raise error
+
+        return [os.path.join(prefix_dir, 'node_modules', name) for (name, _, _) in modules]
+
+
     def try_install(self, cmd, prefix_dir):
         try:
-            subprocess.check_output(cmd, cwd=prefix_dir)
+            # npm reports errors on stderr, keep them for RetryPolicy
+            subprocess.check_output(cmd, cwd=prefix_dir, stderr=subprocess.STDOUT)
             return True, None
         except subprocess.CalledProcessError as e:
             return False, e
@@ -110,15 +266,7 @@ class Npm(object):
         given the path of a node module, calculate list of all dependent modules
         by recursively searching node_modules child directories
         """
-        module_paths = []
-        for root, _, _ in os.walk(module_path):
-            try:
-                Npm.stat_module(root)
-                module_paths.append(root)
-            except IOError:
-                Log.verbose('%s is not a valid Node module. Skipping' % root)
-
-        return module_paths
+        return [path for (path, _, _) in ModuleScanner().scan(module_path)]
 
 
     @staticmethod
@@ -127,6 +275,15 @@ class Npm(object):
         check if given path is a node module, defined by the presence of a
         valid package.json file
         """
+        return Npm.read_module(path)[0:2]
+
+
+    @staticmethod
+    def read_module(path):
+        """
+        like stat_module, but also return the parsed package.json as the third
+        item of the tuple
+        """
         package_file = os.path.join(path, 'package.json')
 
         if not os.path.exists(package_file):
@@ -143,7 +300,7 @@ class Npm(object):
                 if _resolved[0:4] == 'git+' and gitHead:
                     version = gitHead
 
-                return (name, version)
+                return (name, version, data)
         except:
             raise IOError('Invalid file %s' % package_file)
 
@@ -159,24 +316,92 @@ class Npm(object):
         a path containing an npm module which has been "installed" and contains its
         dependencies on disk in descendent node_modules dirs
         """
-        dep_map = {}
-        dep_map[module_path] = tree()
+        scanner = ModuleScanner()
+        scanner.scan(module_path)
+        return scanner.deps[module_path]
+
+
+class ModuleScanner(object):
+    """Walks an installed module tree once
+
+    Only node_modules directories are descended into, and only entries with
+    a valid package.json are treated as modules, so the files of a module
+    (lib, test, fixtures, ...) are never walked. Parsed package.json files
+    are memoized per path.
 
-        def get_deps_tree(check_path):
-            if check_path == '/':
-                raise RuntimeError('Unable to locate dep tree')
-            if dep_map.get(check_path, None) != None:
-                return dep_map[check_path]
-            return get_deps_tree(os.path.dirname(check_path))
+    Attributes:
+        deps (dict): Module path => dependency tree of that module, in the
+            format of `Npm.build_dependency_tree`. Nested modules share the
+            nodes of their ancestors' trees.
+
+    """
+
+    def __init__(self):
+        self.modules = {}
+        self.deps = {}
 
-        for root, _, _ in os.walk(module_path):
-            deps = get_deps_tree(root)
 
+    def read_module(self, path):
+        """Memoized Npm.read_module, returning None for non-modules"""
+        if path not in self.modules:
             try:
-                stat = Npm.stat_module(root)
-                new_deps = deps['%s@%s' % stat]
-                dep_map[root] = new_deps
+                self.modules[path] = Npm.read_module(path)
             except IOError:
-                Log.verbose('%s is not a valid Node module. Skipping' % root)
+                Log.verbose('%s is not a valid Node module. Skipping' % path)
+                self.modules[path] = None
+
+        return self.modules[path]
+
+
+    def scan(self, root_path):
+        """Find root_path (if it is a module) and every module nested in it
+
+        Returns:
+            list: (path, (name, version), package.json) tuples, in pre-order.
+        """
+        found = []
+        stack = [(root_path, None)]
+
+        while stack:
+            (path, parent_deps) = stack.pop()
+            module = self.read_module(path)
+
+            if path == root_path:
+                deps = tree()
+            elif module:
+                deps = parent_deps['%s@%s' % module[0:2]]
+            else:
+                continue
+
+            self.deps[path] = deps
+
+            if module:
+                found.append((path, module[0:2], module[2]))
+
+            stack.extend((child, deps) for child in reversed(ModuleScanner.list_children(path)))
+
+        return found
+
+
+    @staticmethod
+    def list_children(path):
+        """List candidate module directories in path/node_modules"""
+        node_modules = os.path.join(path, 'node_modules')
+        children = []
+
+        if not os.path.isdir(node_modules):
+            return children
+
+        for name in sorted(os.listdir(node_modules)):
+            child = os.path.join(node_modules, name)
+
+            if name[0] == '.' or os.path.islink(child) or not os.path.isdir(child):
+                continue
+
+            if name[0] == '@':
+                children.extend(os.path.join(child, scoped) for scoped in sorted(os.listdir(child))
+                                if os.path.isdir(os.path.join(child, scoped)))
+            else:
+                children.append(child)
 
-        return dep_map[module_path]
+        return children
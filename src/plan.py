@@ -0,0 +1,92 @@
+import hashlib
+import marshal
+import os
+import sys
+
+from log import Log
+from manifest import InstallRecord
+from util import make_dirs
+
+
+# bump when the layout of stored plans changes
+PLAN_FORMAT = 2
+
+
+class PlanCache(object):
+    """Install plans of shrinkwraps, stored in <cache>/.plans
+
+    A plan is the flattened list of install records of a shrinkwrap,
+    serialized with marshal. Plans are keyed by the sha256 of the
+    shrinkwrap's bytes, the frosty version and the Python version (marshal
+    is not portable between them), so an unchanged shrinkwrap is installed
+    without decoding its JSON again. Records are stored without their paths,
+    which follow from the parent links; a plan therefore serves copies of
+    a project in any directory.
+
+    Args:
+        cache_dir (str): Root of the cache.
+
+    """
+
+    def __init__(self, cache_dir):
+        self.plans_dir = os.path.join(cache_dir, '.plans')
+
+
+    @staticmethod
+    def get_key(manifest_path):
+        digest = hashlib.sha256()
+
+        with open(manifest_path, 'rb') as file:
+            digest.update(file.read())
+
+        digest.update(('\0%s\0%s\0%s' % (PLAN_FORMAT, get_frosty_version(), sys.version_info[0:3])).encode('utf-8'))
+        return digest.hexdigest()
+
+
+    def get_plan_path(self, key):
+        return os.path.join(self.plans_dir, key)
+
+
+    def load(self, key, root_path):
+        """Return the install records of a stored plan, or None
+
+        Args:
+            key (str): See `get_key`.
+            root_path (str): Project root the records are installed into.
+        """
+        path = self.get_plan_path(key)
+
+        try:
+            with open(path, 'rb') as file:
+                rows = marshal.load(file)
+            # keeps the plan from being collected as stale
+            os.utime(path, None)
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return None
+
+        records = []
+        module_dirs = []
+
+        for (name, version, url, parent, requires) in rows:
+            path = root_path if parent is None else module_dirs[parent]
+            records.append(InstallRecord(path, name, version, url, parent, requires))
+            module_dirs.append(os.path.join(path, 'node_modules', name))
+
+        Log.verbose('Loaded install plan %s (%s modules)', key, len(records))
+        return records
+
+
+    def save(self, key, records):
+        rows = [(record.name, record.version, record.url, record.parent, record.requires) for record in records]
+        path = self.get_plan_path(key)
+        temp_path = '%s.%s.tmp' % (path, os.getpid())
+
+        make_dirs(self.plans_dir)
+        with open(temp_path, 'wb') as file:
+            marshal.dump(rows, file)
+        os.rename(temp_path, path)
+
+
+def get_frosty_version():
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'version')) as file:
+        return file.read().strip()
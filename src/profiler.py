@@ -0,0 +1,131 @@
+import json
+import os
+import threading
+import time
+
+from contextlib import contextmanager
+
+from log import Log
+
+
+# number of modules listed by `Profiler.summarize`
+SUMMARY_SIZE = 10
+
+
+class Profiler(object):
+    """Records timed spans of a run, see --profile
+
+    Spans are recorded from any thread and written as Chrome trace events
+    (chrome://tracing, https://ui.perfetto.dev). Spans of category `phase`
+    cover the steps of a run, spans of category `module` the work done for
+    one module, named by their `module` argument. Disabled (the default),
+    `span` records nothing.
+    """
+
+    enabled = False
+    events = []
+    threads = {}
+    start = None
+    lock = threading.Lock()
+
+    @staticmethod
+    def enable():
+        Profiler.enabled = True
+        Profiler.events = []
+        Profiler.threads = {}
+        Profiler.start = time.time()
+
+
+    @staticmethod
+    @contextmanager
+    def span(name, category, **args):
+        """Time the enclosed block
+
+        Yields:
+            dict: The span's arguments, which the block may add counts to
+                (e.g. `bytes`, `files`), or None when profiling is disabled.
+                Counts added after the block are recorded too, without
+                being timed.
+        """
+        if not Profiler.enabled:
+            yield None
+            return
+
+        begin = time.time()
+        try:
+            yield args
+        finally:
+            end = time.time()
+            thread = threading.current_thread()
+            event = {
+                'name': name,
+                'cat': category,
+                'ph': 'X',
+                'ts': int((begin - Profiler.start) * 1000000),
+                'dur': int((end - begin) * 1000000),
+                'pid': os.getpid(),
+                'tid': thread.ident,
+                'args': args,
+            }
+
+            with Profiler.lock:
+                Profiler.events.append(event)
+                Profiler.threads[thread.ident] = thread.name
+
+
+    @staticmethod
+    def write(path):
+        """Write the recorded spans as a Chrome trace file"""
+        with Profiler.lock:
+            events = list(Profiler.events)
+            threads = dict(Profiler.threads)
+
+        metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid, 'args': {'name': name}}
+                    for (tid, name) in sorted(threads.items())]
+
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}, file)
+
+        Log.info('Wrote %s profile spans to %s', len(events), path)
+
+
+    @staticmethod
+    def summarize(size=SUMMARY_SIZE):
+        """Log the time of every phase and the slowest modules"""
+        with Profiler.lock:
+            events = list(Profiler.events)
+
+        phases = sorted((event for event in events if event['cat'] == 'phase'), key=lambda event: event['ts'])
+        modules = {}
+
+        for event in events:
+            if event['cat'] == 'module':
+                steps = modules.setdefault(event['args'].get('module'), {})
+                steps[event['name']] = steps.get(event['name'], 0) + event['dur']
+
+        Log.info('Phases: %s', ', '.join('%s %.2fs' % (event['name'], event['dur'] / 1000000.0) for event in phases))
+
+        slowest = sorted(modules.items(), key=lambda item: sum(item[1].values()), reverse=True)[0:size]
+        if slowest:
+            Log.info('Slowest modules:')
+        for (module, steps) in slowest:
+            breakdown = ', '.join('%s %.2fs' % (name, duration / 1000000.0)
+                                  for (name, duration) in sorted(steps.items(), key=lambda step: step[1], reverse=True))
+            Log.info('  %7.2fs  %s (%s)', sum(steps.values()) / 1000000.0, module, breakdown)
+
+
+def count_tree(path, skip_node_modules=False):
+    """Return {'files': n, 'bytes': n} of the regular files below path"""
+    files = 0
+    size = 0
+
+    for (root, dirs, names) in os.walk(path):
+        if skip_node_modules and root == path and 'node_modules' in dirs:
+            dirs.remove('node_modules')
+        for name in names:
+            file_path = os.path.join(root, name)
+            if not os.path.islink(file_path):
+                files = files + 1
+                size = size + os.path.getsize(file_path)
+
+    return {'files': files, 'bytes': size}
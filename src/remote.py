@@ -0,0 +1,182 @@
+import io
+import socket
+import threading
+
+try:
+    import Queue as queue
+    from urllib import quote
+    from urlparse import urlsplit
+except ImportError:
+    import queue
+    from urllib.parse import quote, urlsplit
+
+from bundle import CacheBundle
+from errors import FetchError
+from fetch import Fetcher
+from log import Log
+from npm import Npm
+from profiler import Profiler
+
+
+class RemoteCache(object):
+    """Second cache tier shared by several machines over plain HTTP
+
+    Every cache entry is stored remotely as a gzipped bundle of that one
+    entry (see `CacheBundle`), at `<url>/<host>/<name>/<version>.tgz`, where
+    host is `any` for plain JavaScript modules and the host fingerprint for
+    modules with native code (see `Cache.get_entry_version`), which leave
+    an empty marker under `any`. On a local miss the entry is downloaded
+    with GET and imported, so a module another machine already installed,
+    install scripts included, is neither fetched from the registry nor
+    built again. Entries built locally are uploaded with PUT, by a
+    background thread, so that installs never wait on the remote.
+
+    The remote is best effort: errors are logged and the module is installed
+    with npm as if there were no remote. After a network error the remote is
+    not asked again by this process.
+
+    Args:
+        config ([Config]): Runtime configuration. Uses `remote_cache`, the
+            base URL, and `http_proxy`.
+        cache ([Cache]): Local cache to import into and upload from.
+
+    """
+
+    def __init__(self, config, cache):
+        self.url = config.remote_cache.rstrip('/')
+        self.cache = cache
+        self.fetcher = Fetcher(config)
+        self.available = True
+        # modules to upload, by a thread started on first use
+        self.uploads = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+
+    def get_url(self, host, module_name, module_version):
+        # quoted from utf-8 bytes, python 2 httplib needs a byte string URL
+        name = quote(module_name.encode('utf-8'), safe='@')
+        version = quote(module_version.encode('utf-8'), safe='')
+        return str('%s/%s/%s/%s.tgz' % (self.url, host, name, version))
+
+
+    def download(self, module_name, module_version):
+        """Import a module from the remote into the local cache
+
+        A miss costs one request. Modules with native code leave an empty
+        marker at their `any` URL, pointing to the URL of this host. Only
+        the requested entry is imported from the bundle found there.
+
+        Returns:
+            bool: Whether the module is cached now.
+        """
+        if not self.available:
+            return False
+
+        url = self.get_url('any', module_name, module_version)
+        entry_version = module_version
+
+        try:
+            response = self.fetcher.request(url)
+            if response.getheader('content-length') == '0':
+                response.read()
+                url = self.get_url(Npm.get_host_fingerprint(), module_name, module_version)
+                entry_version = Npm.get_native_version(module_version)
+                response = self.fetcher.request(url)
+        except FetchError as e:
+            if e.status == 404:
+                Log.verbose('remote cache MISS for %s@%s', module_name, module_version)
+            else:
+                self.disable(e)
+            return False
+
+        Log.info('Downloading node module %s@%s from the remote cache', module_name, module_version)
+
+        try:
+            with Profiler.span('remote download', 'module', module='%s@%s' % (module_name, module_version)):
+                # anything but the requested entry fails the download
+                CacheBundle(self.cache).import_modules(response, [(module_name, entry_version)])
+                # drain the rest of the body so the connection can be reused
+                while response.read(64 * 1024):
+                    pass
+        except (RuntimeError, socket.error) as e:
+            Log.error('Cannot import %s@%s from the remote cache (%s)', module_name, module_version, e)
+            self.fetcher.close_connection(urlsplit(url))
+            return False
+
+        return self.cache.query(module_name, module_version)
+
+
+    def queue_upload(self, module_name, module_version):
+        """Upload a locally built module in the background, see `wait`"""
+        if not self.available:
+            return
+
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run_uploads, name='remote uploads')
+                self.thread.daemon = True
+                self.thread.start()
+
+        self.uploads.put((module_name, module_version))
+
+
+    def wait(self):
+        """Block until every queued upload is done"""
+        with self.lock:
+            thread = self.thread
+            self.thread = None
+
+        if thread is not None:
+            self.uploads.put(None)
+            with Profiler.span('remote uploads', 'phase'):
+                thread.join()
+
+
+    def run_uploads(self):
+        while True:
+            module = self.uploads.get()
+            if module is None:
+                return
+
+            # failures only cost the upload, never the install
+            try:
+                self.upload(*module)
+            except (RuntimeError, EnvironmentError) as e:
+                Log.error('Cannot upload %s@%s to the remote cache (%s)', module[0], module[1], e)
+
+
+    def upload(self, module_name, module_version):
+        """Store a locally built module in the remote"""
+        if not self.available:
+            return
+
+        entry_version = self.cache.get_entry_version(module_name, module_version)
+        native = entry_version != module_version
+        data = io.BytesIO()
+
+        try:
+            with Profiler.span('remote upload', 'module', module='%s@%s' % (module_name, module_version)) as span:
+                CacheBundle(self.cache).export_modules([(module_name, module_version)], data, compress=True)
+                host = Npm.get_host_fingerprint() if native else 'any'
+                self.put(self.get_url(host, module_name, module_version), data.getvalue())
+                if native:
+                    self.put(self.get_url('any', module_name, module_version), b'')
+                if span is not None:
+                    span['bytes'] = len(data.getvalue())
+            Log.verbose('uploaded %s@%s to the remote cache', module_name, module_version)
+        except FetchError as e:
+            if e.status is None:
+                self.disable(e)
+            else:
+                Log.error('Cannot upload %s@%s to the remote cache (%s)', module_name, module_version, e)
+
+
+    def put(self, url, data):
+        response = self.fetcher.request(url, 'PUT', data, {'Content-Type': 'application/gzip'})
+        response.read()
+
+
+    def disable(self, error):
+        Log.error('Remote cache %s is unavailable, not using it any more (%s)', self.url, error)
+        self.available = False
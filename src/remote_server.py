@@ -0,0 +1,156 @@
+__doc__ = '''python remote_server.py DIR [--port PORT]
+
+    Serves DIR as a remote cache for `frosty --remote-cache URL`: GET
+    returns a stored file, PUT stores one. Meant for tests and small
+    teams; any HTTP server or object store speaking GET and PUT will do.
+
+'''
+
+import argparse
+import os
+import shutil
+import socket
+import tempfile
+import threading
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+from util import make_dirs
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class RemoteCacheServer(object):
+    """HTTP server storing the files PUT to it in a directory
+
+    Args:
+        root_dir (str): Directory holding the stored files.
+        host (str): Address to listen on.
+        port (int): Port to listen on, 0 picks a free one.
+
+    """
+
+    def __init__(self, root_dir, host='127.0.0.1', port=0):
+        self.root_dir = os.path.abspath(root_dir)
+        self.server = ThreadingHTTPServer((host, port), self.handler_class())
+        self.url = 'http://%s:%s' % (host, self.server.server_address[1])
+        self.thread = None
+        # kept alive connections, closed by `stop`
+        self.connections = set()
+        self.lock = threading.Lock()
+
+
+    def get_file_path(self, url_path):
+        """Return the file a request path maps to, or None if it escapes root_dir"""
+        parts = url_path.split('?')[0].split('/')[1:]
+
+        if not parts or any(part in ('', '.', '..') for part in parts):
+            return None
+        return os.path.join(self.root_dir, *parts)
+
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+        with self.lock:
+            for connection in self.connections:
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+
+
+    def handler_class(self):
+        remote = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                BaseHTTPRequestHandler.setup(self)
+                with remote.lock:
+                    remote.connections.add(self.connection)
+
+            def finish(self):
+                with remote.lock:
+                    remote.connections.discard(self.connection)
+                BaseHTTPRequestHandler.finish(self)
+
+            def do_GET(self):
+                path = remote.get_file_path(self.path)
+
+                if path is None or not os.path.isfile(path):
+                    self.send_empty(404)
+                    return
+
+                with open(path, 'rb') as file:
+                    self.send_response(200)
+                    self.send_header('Content-Length', str(os.fstat(file.fileno()).st_size))
+                    self.send_header('Content-Type', 'application/octet-stream')
+                    self.end_headers()
+                    shutil.copyfileobj(file, self.wfile)
+
+            def do_PUT(self):
+                path = remote.get_file_path(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+
+                if path is None:
+                    self.rfile.read(length)
+                    self.send_empty(400)
+                    return
+
+                # written aside and renamed, so a GET never sees half a file
+                make_dirs(os.path.dirname(path))
+                (fd, temp_path) = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.upload-')
+
+                with os.fdopen(fd, 'wb') as file:
+                    while length > 0:
+                        chunk = self.rfile.read(min(length, 1024 * 1024))
+                        if not chunk:
+                            break
+                        file.write(chunk)
+                        length = length - len(chunk)
+
+                if length > 0:
+                    os.remove(temp_path)
+                    self.send_empty(400)
+                    return
+
+                os.rename(temp_path, path)
+                self.send_empty(201)
+
+            def send_empty(self, status):
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *nargs):
+                pass
+
+        return Handler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(usage=__doc__)
+    parser.add_argument('root_dir', help='directory holding the stored files')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8080, help='port to listen on')
+    args = parser.parse_args()
+
+    server = RemoteCacheServer(args.root_dir, args.host, args.port)
+    print('Serving %s at %s' % (server.root_dir, server.url))
+    server.server.serve_forever()
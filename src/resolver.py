@@ -0,0 +1,210 @@
+import os
+import time
+
+from collections import deque
+
+from errors import UnresolvedDependencies
+from log import Log
+from manifest import Manifest
+from semver import max_satisfying, satisfies
+from util import tree
+
+
+class Node(object):
+    """A module placed in the resolved tree"""
+
+    __slots__ = ('name', 'version', 'url', 'parent', 'children')
+
+    def __init__(self, name, version, url, parent):
+        self.name = name
+        self.version = version
+        self.url = url
+        self.parent = parent
+        self.children = {}
+
+
+class Resolver(object):
+    """Resolves the dependency ranges of a package.json against the cache
+
+    Only modules already in the cache are considered, so resolution never
+    touches the network. Versions come from the cache index (or the cache
+    directory, for entries the index does not know yet).
+
+    The tree is laid out breadth first, the way node looks modules up: a
+    dependency is only placed in a module's node_modules if no module on the
+    way up to the project provides a satisfying version. Where npm nested a
+    module when it was cached (recorded in its deps.json), that version is
+    preferred.
+
+    Args:
+        cache ([Cache]): Cache to resolve against.
+
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.versions = cache.get_versions()
+        self.packages = {}
+
+
+    def resolve(self, package):
+        """Resolve the dependencies and devDependencies of a package.json
+
+        Args:
+            package (dict): Contents of package.json.
+
+        Returns:
+            dict: Dependency tree keyed like `Manifest.deps`.
+
+        Raises:
+            UnresolvedDependencies: If a dependency has no cached version
+                satisfying its range.
+        """
+        start = time.time()
+        root = Node(None, None, None, None)
+        dependencies = dict(package.get('devDependencies') or {})
+        dependencies.update(package.get('dependencies') or {})
+
+        missing = []
+        queue = deque(self.expand(root, dependencies, {}, set(), missing))
+        count = len(queue)
+
+        while queue:
+            node = queue.popleft()
+            (dependencies, optional) = self.get_dependencies(node.name, node.version)
+            placed = self.expand(node, dependencies, self.get_pins(node.name, node.version), optional, missing)
+            count = count + len(placed)
+            queue.extend(placed)
+
+        if missing:
+            raise UnresolvedDependencies('No cached version of %s, run npm or frosty prefetch with a shrinkwrap first' %
+                                         ', '.join('%s@%s (required by %s)' % dependency for dependency in missing))
+
+        Log.info('Resolved %s modules from the cache in %.2fs', count, time.time() - start)
+        return Resolver.to_tree(root)
+
+
+    def expand(self, node, dependencies, pins, optional, missing):
+        """Place the dependencies of node which it cannot find on the way up
+
+        Returns:
+            list: Nodes placed as children of node.
+        """
+        placed = []
+
+        for name in sorted(dependencies.keys()):
+            spec = dependencies[name]
+            if Resolver.find(node, name, spec):
+                continue
+
+            (version, url) = self.pick(name, spec, pins)
+            if version is None:
+                if name not in optional:
+                    missing.append((name, spec, '%s@%s' % (node.name, node.version) if node.name else 'package.json'))
+                continue
+
+            child = Node(name, version, url, node)
+            node.children[name] = child
+            placed.append(child)
+
+        return placed
+
+
+    @staticmethod
+    def find(node, name, spec):
+        """Return whether node resolves `name` to a version satisfying spec"""
+        while node:
+            found = node.children.get(name, None)
+            if found:
+                return Resolver.matches(found.version, spec)
+
+            # a cycle, npm does not nest a module inside itself either
+            if node.name == name:
+                return True
+
+            node = node.parent
+
+        return False
+
+
+    @staticmethod
+    def matches(version, spec):
+        if '#' in spec:
+            return spec.split('#')[-1] == version
+
+        try:
+            return satisfies(version, spec)
+        except RuntimeError:
+            return False
+
+
+    def pick(self, name, spec, pins):
+        """Return the (version, url) spec resolves to in the cache, or (None, None)"""
+        versions = self.get_versions(name)
+
+        # git and tarball dependencies: a cached commit only
+        if '#' in spec:
+            version = spec.split('#')[-1]
+            return (version, spec) if version in versions else (None, None)
+
+        if name in pins and Resolver.matches(pins[name], spec) and pins[name] in versions:
+            version = pins[name]
+        else:
+            try:
+                version = max_satisfying('*' if spec == 'latest' else spec, versions)
+            except RuntimeError:
+                Log.verbose('Cannot resolve %s@%s, the range is not supported', name, spec)
+                version = None
+
+        if version is None:
+            return (None, None)
+        return (version, Manifest.calculate_resolved_url(name, version))
+
+
+    def get_versions(self, name):
+        """Return the cached versions of a module"""
+        if name not in self.versions:
+            module_dir = os.path.join(self.cache.cache_dir, name)
+            candidates = os.listdir(module_dir) if os.path.isdir(module_dir) else []
+            self.versions[name] = [version for version in candidates
+                                   if version[0] != '.' and '@' not in version and self.cache.query(name, version)]
+
+        return self.versions[name]
+
+
+    def get_dependencies(self, name, version):
+        """Return the (ranges, optional names) a cached module depends on"""
+        key = (name, version)
+
+        if key not in self.packages:
+            package = self.cache.load_module_package(name, version)
+            optional = package.get('optionalDependencies') or {}
+            dependencies = dict(optional)
+            dependencies.update(package.get('dependencies') or {})
+            self.packages[key] = (dependencies, set(optional.keys()))
+
+        return self.packages[key]
+
+
+    def get_pins(self, name, version):
+        """Return {name: version} of the modules npm nested in a cached module"""
+        pins = {}
+
+        for key in self.cache.load_module_deps_from_json(name, version).keys():
+            (pin_name, pin_version) = key.rsplit('@', 1)
+            pins[pin_name] = pin_version
+
+        return pins
+
+
+    @staticmethod
+    def to_tree(root):
+        deps = tree()
+        stack = [(root, deps)]
+
+        while stack:
+            (node, node_deps) = stack.pop()
+            for child in node.children.values():
+                stack.append((child, node_deps['%s===%s===%s' % (child.name, child.version, child.url)]))
+
+        return deps
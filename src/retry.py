@@ -0,0 +1,92 @@
+import errno
+import random
+import re
+import socket
+import subprocess
+
+from errors import FetchError
+
+
+# npm error codes and messages of failures worth another attempt
+TRANSIENT_NPM_OUTPUT = re.compile(r'\b(?:ETIMEDOUT|ESOCKETTIMEDOUT|ECONNRESET|ECONNREFUSED|EAI_AGAIN|EPIPE|'
+                                  r'ENETUNREACH|EHOSTUNREACH|E408|E429|E5\d\d)\b|socket hang up|network timeout')
+
+# HTTP statuses of requests worth another attempt
+TRANSIENT_STATUSES = (408, 429, 500, 502, 503, 504)
+
+TRANSIENT_ERRNOS = (errno.ETIMEDOUT, errno.ECONNRESET, errno.ECONNREFUSED, errno.EPIPE, errno.ENETUNREACH, errno.EHOSTUNREACH)
+
+
+class RetryPolicy(object):
+    """When to try installing a failed module again
+
+    Only transient failures are retried: network errors, HTTP 408, 429 and
+    5xx responses, and npm runs whose output reports one of those. The
+    delay doubles with every attempt, up to `max_delay`, and is jittered so
+    that modules failing together do not retry in lockstep. No retry is
+    scheduled past `max_elapsed` seconds after the first failure.
+
+    Args:
+        max_attempts (int): Attempts per module, including the first.
+        base_delay (float): Seconds before the first retry.
+        max_delay (float): Upper bound of the delay between attempts.
+        max_elapsed (float): Seconds after the first failure within which
+            retries may start.
+        jitter (bool): Randomize each delay between half and all of it.
+
+    """
+
+    def __init__(self, max_attempts=5, base_delay=1.0, max_delay=30.0, max_elapsed=120.0, jitter=True):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_elapsed = max_elapsed
+        self.jitter = jitter
+
+
+    @staticmethod
+    def from_config(config):
+        return RetryPolicy(config.retries + 1, config.retry_delay, max_elapsed=config.retry_max_time)
+
+
+    @staticmethod
+    def is_transient(error):
+        if isinstance(error, FetchError):
+            # no status: the connection failed or the body was cut short
+            return error.status is None or error.status in TRANSIENT_STATUSES
+
+        if isinstance(error, subprocess.CalledProcessError):
+            output = error.output or b''
+            if not isinstance(output, str):
+                output = output.decode('utf-8', 'replace')
+            return TRANSIENT_NPM_OUTPUT.search(output) is not None
+
+        if isinstance(error, socket.timeout):
+            return True
+
+        return isinstance(error, EnvironmentError) and error.errno in TRANSIENT_ERRNOS
+
+
+    def get_delay(self, attempt):
+        """Return the seconds to wait after failed attempt number `attempt`"""
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        if self.jitter:
+            delay = random.uniform(delay / 2, delay)
+        return delay
+
+
+    def get_retry_delay(self, error, attempt, elapsed):
+        """Return the seconds to wait before retrying, or None to give up
+
+        Args:
+            error (Exception): Why attempt number `attempt` failed.
+            attempt (int): Attempts made so far.
+            elapsed (float): Seconds since the first failure.
+        """
+        if attempt >= self.max_attempts or not RetryPolicy.is_transient(error):
+            return None
+
+        delay = self.get_delay(attempt)
+        if elapsed + delay > self.max_elapsed:
+            return None
+        return delay
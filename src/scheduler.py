@@ -0,0 +1,264 @@
+import heapq
+import os
+import threading
+import time
+
+from log import Log
+
+
+class Task(object):
+    """A single module to install at a position in the dependency tree
+
+    Args:
+        order (int): Position of the module in a pre-order walk of the tree.
+        module (str): Module name.
+        version (str): Module version.
+        url (str): Where to fetch the module from.
+        path (str): Directory whose node_modules the module is installed into.
+
+    """
+
+    __slots__ = ('order', 'module', 'version', 'url', 'path', 'children')
+
+    def __init__(self, order, module, version, url, path):
+        self.order = order
+        self.module = module
+        self.version = version
+        self.url = url
+        self.path = path
+        self.children = []
+
+
+    @property
+    def key(self):
+        """Dependency key, formatted as `name===version===url`"""
+        return '%s===%s===%s' % (self.module, self.version, self.url)
+
+
+class Scheduler(object):
+    """Installs a dependency tree on a bounded pool of worker threads
+
+    Each module is a node in a DAG whose edges point from a module to the
+    modules nested in its node_modules directory. A child only becomes ready
+    once its parent has been materialized, because materializing a module
+    replaces its directory on disk.
+
+    A module failing transiently is parked and retried once the delay of
+    the retry policy has passed, while the rest of the tree keeps
+    installing; only its own subtree waits for it.
+
+    Args:
+        jobs (int): Maximum number of modules installed at the same time.
+        force (bool): Keep installing after a module fails.
+        retry ([RetryPolicy]): When to retry failed modules, None to never.
+
+    Attributes:
+        retried (dict): Task order => (task, attempts, installed) of every
+            module retried by the last `run`.
+
+    """
+
+    def __init__(self, jobs=1, force=False, retry=None):
+        self.jobs = max(1, jobs or 1)
+        self.force = force
+        self.retry = retry
+        self.retried = {}
+
+
+    @staticmethod
+    def build_tasks(deps, path):
+        """Flatten a dependency tree into tasks, numbered in pre-order
+
+        Siblings are visited in sorted order, so the numbering (and therefore
+        the order errors are reported in) does not depend on dict ordering.
+
+        Returns:
+            list: Top level tasks. Nested tasks are reachable via `children`.
+        """
+        roots = []
+        order = 0
+        stack = [(key, deps[key], path, None) for key in sorted(deps.keys(), reverse=True)]
+
+        while stack:
+            (key, sub_deps, parent_path, parent) = stack.pop()
+            (module, version, url) = key.split('===')
+            task = Task(order, module, version, url, parent_path)
+            order = order + 1
+
+            if parent is None:
+                roots.append(task)
+            else:
+                parent.children.append(task)
+
+            child_path = os.path.join(parent_path, 'node_modules', task.module)
+            for child_key in sorted(sub_deps.keys(), reverse=True):
+                stack.append((child_key, sub_deps[child_key], child_path, task))
+
+        return roots
+
+
+    @staticmethod
+    def build_tasks_from_records(records):
+        """Turn InstallRecords (see `Manifest.iter_install_tasks`) into tasks
+
+        Records come parents first, so each task is linked to its parent as
+        soon as it is read, without building an intermediate tree.
+
+        Returns:
+            list: Top level tasks. Nested tasks are reachable via `children`.
+        """
+        roots = []
+        tasks = []
+
+        for record in records:
+            task = Task(len(tasks), record.name, record.version, record.url, record.path)
+            tasks.append(task)
+
+            if record.parent is None:
+                roots.append(task)
+            else:
+                tasks[record.parent].children.append(task)
+
+        return roots
+
+
+    @staticmethod
+    def iter_tasks(tasks):
+        """Yield every task in the tree, in pre-order"""
+        stack = list(reversed(tasks))
+
+        while stack:
+            task = stack.pop()
+            yield task
+            stack.extend(reversed(task.children))
+
+
+    def run(self, tasks, install):
+        """Run `install(task)` for every task, parents before children
+
+        Returns:
+            list: (task, exception) pairs for failed modules, in tree order.
+                  Only returned when `force` is set; otherwise the first
+                  failure in tree order is re-raised once in-flight work has
+                  drained.
+        """
+        state = _RunState(tasks)
+        workers = [threading.Thread(target=self.work, args=(state, install)) for _ in range(self.jobs - 1)]
+
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+
+        self.work(state, install)
+
+        for worker in workers:
+            while worker.is_alive():
+                worker.join(0.1)
+
+        failures = sorted(state.failures, key=lambda failure: failure[0].order)
+        failed = set(task.order for (task, _) in failures)
+        self.retried = dict((order, (task, attempts, order not in failed))
+                            for (order, (task, attempts)) in state.attempts.items())
+
+        if failures and not self.force:
+            raise failures[0][1]
+
+        return failures
+
+
+    def work(self, state, install):
+        while True:
+            with state.cond:
+                state.unpark(time.time())
+                while not state.ready and state.outstanding > 0:
+                    state.cond.wait(state.get_wait(time.time()))
+                    state.unpark(time.time())
+
+                if not state.ready:
+                    return
+
+                (_, task) = heapq.heappop(state.ready)
+
+            failure = None
+
+            if not state.aborted:
+                try:
+                    install(task)
+                except BaseException as e:
+                    if self.park(state, task, e):
+                        continue
+                    failure = (task, e)
+                    Log.error('Failed to install %s@%s from %s', task.module, task.version, task.url)
+
+            with state.cond:
+                if failure:
+                    state.failures.append(failure)
+                    if not self.force:
+                        state.aborted = True
+
+                if not state.aborted:
+                    for child in task.children:
+                        heapq.heappush(state.ready, (child.order, child))
+                    state.outstanding = state.outstanding + len(task.children)
+
+                state.outstanding = state.outstanding - 1
+                state.cond.notify_all()
+
+
+    def park(self, state, task, error):
+        """Park a failed task for a later retry, if the retry policy allows one
+
+        Returns:
+            bool: Whether the task was parked.
+        """
+        if self.retry is None:
+            return False
+
+        now = time.time()
+
+        with state.cond:
+            (_, attempts) = state.attempts.get(task.order, (task, 1))
+            first_failure = state.first_failures.setdefault(task.order, now)
+            delay = self.retry.get_retry_delay(error, attempts, now - first_failure)
+
+            if delay is None:
+                return False
+
+            Log.info('Installing %s@%s failed (%s), retrying in %.1fs (attempt %s of %s)',
+                     task.module, task.version, str(error).strip() or type(error).__name__,
+                     delay, attempts + 1, self.retry.max_attempts)
+            state.attempts[task.order] = (task, attempts + 1)
+            heapq.heappush(state.parked, (now + delay, task.order, task))
+            state.cond.notify_all()
+
+        return True
+
+
+class _RunState(object):
+
+    def __init__(self, tasks):
+        self.cond = threading.Condition()
+        self.ready = [(task.order, task) for task in tasks]
+        self.outstanding = len(tasks)
+        self.failures = []
+        self.aborted = False
+        heapq.heapify(self.ready)
+        # (time to retry at, order, task) of failed tasks waiting for a retry
+        self.parked = []
+        # order => (task, attempts made) of retried tasks
+        self.attempts = {}
+        self.first_failures = {}
+
+
+    def unpark(self, now):
+        """Make parked tasks ready once their delay has passed (at once when aborted)"""
+        while self.parked and (self.parked[0][0] <= now or self.aborted):
+            (_, order, task) = heapq.heappop(self.parked)
+            heapq.heappush(self.ready, (order, task))
+
+
+    def get_wait(self, now):
+        """Seconds to wait for other workers, or for the next parked task"""
+        if self.parked:
+            return max(0.0, min(0.1, self.parked[0][0] - now))
+        return 0.1
@@ -1,4 +1,115 @@
 import re
+import threading
+
+from collections import OrderedDict
+
+
+# [MAJOR].[MINOR].[PATCH], the rest of the release part, then whether a LABEL follows
+VERSION_PATTERN = re.compile(r'([^.+-]*)(?:\.([^.+-]*))?(?:\.([^.+-]*))?[^+-]*(?:-([^+]*))?')
+
+NON_DIGITS = re.compile(r'[^0-9]')
+
+RANGE_CHARACTERS = re.compile(r'[\^~xX]')
+
+# a version or partial version in a range, e.g. 1, 1.2.x or v1.2.3-rc.1
+PARTIAL_PATTERN = re.compile(r'^v?(\*|x|X|\d+)(?:\.(\*|x|X|\d+)(?:\.(\*|x|X|\d+)(?:-([0-9A-Za-z.-]+))?(?:\+[0-9A-Za-z.-]+)?)?)?$')
+
+HYPHEN_PATTERN = re.compile(r'^(\S+)\s+-\s+(\S+)$')
+
+COMPARATOR_PATTERN = re.compile(r'^(<=|>=|<|>|=|~>|~|\^)?(.*)$')
+
+OPERATOR_SPACE = re.compile(r'(<=|>=|<|>|=|~>|~|\^)\s+')
+
+# number of parsed versions and compiled ranges kept in memory
+CACHE_SIZE = 10000
+
+
+class LRUMemo(object):
+    """Bounded, thread safe memo of a function of one argument
+
+    Args:
+        function (callable): Function to memoize.
+        size (int): Number of results kept, least recently used go first.
+
+    """
+
+    def __init__(self, function, size=CACHE_SIZE):
+        self.function = function
+        self.size = size
+        self.results = OrderedDict()
+        self.lock = threading.Lock()
+
+
+    def __call__(self, argument):
+        with self.lock:
+            result = self.results.pop(argument, None)
+            if result is not None:
+                self.results[argument] = result
+                return result
+
+        result = self.function(argument)
+
+        with self.lock:
+            self.results[argument] = result
+            if len(self.results) > self.size:
+                self.results.popitem(last=False)
+
+        return result
+
+
+class Version(object):
+    """A parsed semantic version, see `parse_semver` for the accepted format
+
+    Versions are immutable and memoized, so that sorting or comparing a
+    version string parses it only once.
+
+    Attributes:
+        major (int): MAJOR, 0 if missing.
+        minor (int): MINOR, 0 if missing.
+        patch (int): PATCH, 0 if missing.
+        label (int): 0 for a pre-release (with a LABEL), 1 otherwise.
+        prerelease (str): Contents of the LABEL, or None.
+        key (tuple): Sort key, ordered like `semver_cmp`.
+        precedence (tuple): Key which also orders pre-releases by their
+            identifiers, as semver.org specifies. Used by ranges.
+
+    """
+
+    __slots__ = ('major', 'minor', 'patch', 'label', 'prerelease', 'key', 'precedence')
+
+    def __init__(self, semver):
+        (major, minor, patch, prerelease) = VERSION_PATTERN.match(semver).groups()
+
+        self.major = Version.to_int(major)
+        self.minor = Version.to_int(minor)
+        self.patch = Version.to_int(patch)
+        self.label = 1 if prerelease is None else 0
+        self.prerelease = prerelease
+        self.key = (self.major, self.minor, self.patch, self.label)
+        self.precedence = self.key + (Version.prerelease_key(prerelease),)
+
+
+    @staticmethod
+    def to_int(part):
+        """Digits of a version part as int, ignoring other characters"""
+        digits = NON_DIGITS.sub('', part or '')
+        return int(digits) if digits else 0
+
+
+    @staticmethod
+    def prerelease_key(prerelease):
+        """Numeric identifiers sort numerically and before alphanumeric ones"""
+        if not prerelease:
+            return ()
+        return tuple((0, int(part), '') if part.isdigit() else (1, 0, part) for part in prerelease.split('.'))
+
+
+    def __repr__(self):
+        return 'Version(%s.%s.%s%s)' % (self.major, self.minor, self.patch, '' if self.prerelease is None else '-' + self.prerelease)
+
+
+# Version.parse(semver) returns the memoized Version of a string
+Version.parse = staticmethod(LRUMemo(Version))
 
 
 def parse_semver(semver):
@@ -50,54 +161,15 @@ def parse_semver(semver):
             }
     """
 
-    parts = [
-        [], # MAJOR
-        [], # MINOR
-        [], # PATCH
-        [], # LABEL
-    ]
-
-    parts_idx = 0
-    part = parts[parts_idx]
-
-    for index, character in enumerate(semver):
-        is_last_character = index == (len(semver) - 1)
+    version = Version.parse(semver)
 
-        if re.match('[0-9]', character):
-            part.append(character)
-
-        if character in ['.', '-', '+'] or is_last_character:
-            parts_idx = parts_idx + 1
-            part = parts[parts_idx]
-
-        if character == '-':
-            parts[parts_idx].append(True)
-            break
-
-        if character == '+':
-            break
-
-    parsed_semver = {
-        'major': 0,
-        'minor': 0,
-        'patch': 0,
-        'label': 1
+    return {
+        'major': version.major,
+        'minor': version.minor,
+        'patch': version.patch,
+        'label': version.label,
     }
 
-    if len(parts[0]) > 0:
-        parsed_semver['major'] = int(''.join(parts[0]))
-
-    if len(parts[1]) > 0:
-        parsed_semver['minor'] = int(''.join(parts[1]))
-
-    if len(parts[2]) > 0:
-        parsed_semver['patch'] = int(''.join(parts[2]))
-
-    if len(parts[3]) > 0:
-        parsed_semver['label'] = 0
-
-    return parsed_semver
-
 
 def semver_cmp(a, b):
     """Compare two semantic version strings, used for sorting semver values
@@ -128,23 +200,18 @@ def semver_cmp(a, b):
     - 1.24.34-pre
     """
 
-    a_parsed = parse_semver(a)
-    b_parsed = parse_semver(b)
-
-    if a_parsed['major'] != b_parsed['major']:
-        return a_parsed['major'] - b_parsed['major']
+    a_key = Version.parse(a).key
+    b_key = Version.parse(b).key
+    return (a_key > b_key) - (a_key < b_key)
 
-    if a_parsed['minor'] != b_parsed['minor']:
-        return a_parsed['minor'] - b_parsed['minor']
 
-    if a_parsed['patch'] != b_parsed['patch']:
-        return a_parsed['patch'] - b_parsed['patch']
-
-    return a_parsed['label'] - b_parsed['label']
+def semver_key(semver):
+    """Sort key of a semantic version string, ordered like `semver_cmp`"""
+    return Version.parse(semver).key
 
 
 def sorted_semver(semvers):
-  return sorted(semvers, cmp=semver_cmp)
+    return sorted(semvers, key=semver_key)
 
 
 def is_explicit(semver):
@@ -160,7 +227,167 @@ def is_explicit(semver):
     """
     major_minor_patch = semver.split('-')[0]
 
-    if re.search('\^|~|x|X', major_minor_patch) or len(semver.split('.')) < 3:
+    if RANGE_CHARACTERS.search(major_minor_patch) or len(semver.split('.')) < 3:
         return False
     return True
 
+
+class Range(object):
+    """A compiled npm version range, e.g. `^1.2.0 || >=2.1.0 <3`
+
+    The range is reduced to comparator sets once, following npm's rules for
+    `^`, `~`, x-ranges, hyphen ranges, partial versions and `||`; testing a
+    version then only compares precedence tuples. As in npm, a pre-release
+    version only satisfies a set with a comparator on the same
+    [MAJOR].[MINOR].[PATCH] which has a pre-release too.
+
+    Args:
+        text (str): Range. Empty, `*`, `x` and `latest` match any release.
+
+    Raises:
+        RuntimeError: If the range cannot be parsed.
+
+    """
+
+    __slots__ = ('text', 'sets')
+
+    def __init__(self, text):
+        self.text = text
+        self.sets = [Range.compile_set(text, part.strip()) for part in text.split('||')]
+
+
+    @staticmethod
+    def compile_set(text, part):
+        """Return the (operator, Version) comparators of one `||` alternative"""
+        hyphen = HYPHEN_PATTERN.match(part)
+        if hyphen:
+            return Range.desugar('>=', Range.parse_partial(text, hyphen.group(1))) + \
+                Range.desugar('<=', Range.parse_partial(text, hyphen.group(2)))
+
+        comparators = []
+        for token in OPERATOR_SPACE.sub(r'\1', part).split():
+            (operator, partial) = COMPARATOR_PATTERN.match(token).groups()
+            comparators.extend(Range.desugar(operator or '=', Range.parse_partial(text, partial)))
+        return comparators
+
+
+    @staticmethod
+    def parse_partial(text, partial):
+        """Return [major, minor, patch, prerelease], None for missing or wildcard parts"""
+        if partial in ('', 'latest'):
+            return [None, None, None, None]
+
+        match = PARTIAL_PATTERN.match(partial.lstrip('='))
+        if not match:
+            raise RuntimeError('Invalid version range %s' % text)
+
+        parts = [None if part in (None, '*', 'x', 'X') else int(part) for part in match.groups()[0:3]]
+
+        # anything after a wildcard is a wildcard too
+        for index in (1, 2):
+            if parts[index - 1] is None:
+                parts[index] = None
+
+        return parts + [match.group(4)]
+
+
+    @staticmethod
+    def desugar(operator, partial):
+        (major, minor, patch, prerelease) = partial
+
+        if major is None:
+            # `>*` and `<*` match nothing, everything else anything
+            return [('<', bound(0, 0, 0))] if operator in ('<', '>') else []
+
+        if operator == '^':
+            if minor is None:
+                upper = bound(major + 1, 0, 0)
+            elif major > 0:
+                upper = bound(major + 1, 0, 0)
+            elif patch is None or minor > 0:
+                upper = bound(0, minor + 1, 0)
+            else:
+                upper = bound(0, 0, patch + 1)
+            return [('>=', bound(major, minor or 0, patch or 0, prerelease)), ('<', upper)]
+
+        if operator in ('~', '~>') or (operator == '=' and patch is None):
+            upper = bound(major + 1, 0, 0) if minor is None else bound(major, minor + 1, 0)
+            return [('>=', bound(major, minor or 0, patch or 0, prerelease)), ('<', upper)]
+
+        if patch is not None:
+            return [(operator, bound(major, minor, patch, prerelease))]
+
+        # comparators on partial versions, e.g. `>1.2` is `>=1.3.0` and `<=1` is `<2.0.0`
+        lower = bound(major, minor or 0, 0)
+        upper = bound(major + 1, 0, 0) if minor is None else bound(major, minor + 1, 0)
+        return [{
+            '>': ('>=', upper),
+            '>=': ('>=', lower),
+            '<': ('<', lower),
+            '<=': ('<', upper),
+        }[operator]]
+
+
+    def test(self, version):
+        """Return whether a Version satisfies the range"""
+        for comparators in self.sets:
+            if Range.test_set(comparators, version):
+                return True
+        return False
+
+
+    @staticmethod
+    def test_set(comparators, version):
+        for (operator, limit) in comparators:
+            if not COMPARE[operator](version.precedence, limit.precedence):
+                return False
+
+        if version.prerelease is None:
+            return True
+
+        return any(limit.prerelease is not None and limit.key[0:3] == version.key[0:3] for (_, limit) in comparators)
+
+
+    def __repr__(self):
+        return 'Range(%s)' % self.text
+
+
+# Range.compile(text) returns the memoized Range of a string
+Range.compile = staticmethod(LRUMemo(Range))
+
+
+COMPARE = {
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+    '=': lambda a, b: a == b,
+}
+
+
+def bound(major, minor, patch, prerelease=None):
+    return Version.parse('%s.%s.%s%s' % (major, minor, patch, '' if prerelease is None else '-' + prerelease))
+
+
+def satisfies(semver, range):
+    """Determine if a version string satisfies an npm range string"""
+    return Range.compile(range.strip()).test(Version.parse(semver))
+
+
+def max_satisfying(range, semvers):
+    """Return the highest version string satisfying an npm range, or None
+
+    Versions are checked in one pass; each is parsed once (memoized), and
+    only tested against the range when it would beat the best match so far.
+    """
+    compiled = Range.compile(range.strip())
+    best = None
+    best_semver = None
+
+    for semver in semvers:
+        version = Version.parse(semver)
+        if (best is None or version.precedence > best.precedence) and compiled.test(version):
+            best = version
+            best_semver = semver
+
+    return best_semver
@@ -0,0 +1,130 @@
+import json
+import os
+import shutil
+import threading
+
+from log import Log
+
+
+class InstallState(object):
+    """Record of which module is installed at each node_modules path
+
+    Stored in node_modules/.frosty-state.json as a map of module directory
+    (relative to the project root) to its `name===version===url` key. It lets
+    an incremental install work out which subtrees of node_modules are still
+    valid for a new dependency tree.
+
+    Args:
+        root_path (str): Project root (the directory holding node_modules).
+        modules (dict): Relative module path => dependency key.
+
+    """
+
+    FILENAME = '.frosty-state.json'
+
+    def __init__(self, root_path, modules=None):
+        self.root_path = root_path
+        self.modules = modules or {}
+        self.lock = threading.Lock()
+
+
+    @staticmethod
+    def get_path(root_path):
+        return os.path.join(root_path, 'node_modules', InstallState.FILENAME)
+
+
+    @staticmethod
+    def load(root_path):
+        """Read the state left by the previous install, or None"""
+        path = InstallState.get_path(root_path)
+
+        try:
+            with open(path) as file:
+                return InstallState(root_path, json.load(file).get('modules', {}))
+        except (IOError, ValueError) as e:
+            Log.verbose('No usable install state at %s (%s)', path, e)
+            return None
+
+
+    @staticmethod
+    def discard(root_path):
+        """Forget the previous state, so an interrupted install is never trusted"""
+        path = InstallState.get_path(root_path)
+        if os.path.isfile(path):
+            os.remove(path)
+
+
+    def save(self):
+        path = InstallState.get_path(self.root_path)
+        temp_path = '%s.%s' % (path, os.getpid())
+
+        with open(temp_path, 'w') as file:
+            json.dump({'modules': self.modules}, file, sort_keys=True, indent=2, separators=(',', ': '))
+        os.rename(temp_path, path)
+
+
+    def module_dir(self, task):
+        return os.path.relpath(os.path.join(task.path, 'node_modules', task.module), self.root_path)
+
+
+    def record(self, task):
+        with self.lock:
+            self.modules[self.module_dir(task)] = task.key
+
+
+    def plan(self, tasks):
+        """Compare the recorded state with a new tree of tasks
+
+        A task is unchanged when the same key is recorded at its path, the
+        directory still exists, and none of its ancestors is reinstalled
+        (materializing a module replaces its whole directory).
+
+        Returns:
+            tuple: (set of unchanged task orders, list of removed module dirs)
+        """
+        unchanged = set()
+        wanted = set()
+        stack = [(task, False) for task in tasks]
+
+        while stack:
+            (task, parent_changed) = stack.pop()
+            module_dir = self.module_dir(task)
+            wanted.add(module_dir)
+
+            changed = (parent_changed or
+                       self.modules.get(module_dir) != task.key or
+                       not os.path.isdir(os.path.join(self.root_path, module_dir)))
+
+            if not changed:
+                unchanged.add(task.order)
+
+            stack.extend([(child, changed) for child in task.children])
+
+        removed = sorted(module_dir for module_dir in self.modules if module_dir not in wanted)
+        return (unchanged, removed)
+
+
+    def remove(self, module_dirs):
+        """Delete modules which are no longer part of the tree"""
+        for module_dir in module_dirs:
+            path = os.path.join(self.root_path, module_dir)
+            Log.verbose('removing %s', path)
+
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+
+            self.modules.pop(module_dir, None)
+            prune_bin_links(os.path.dirname(path))
+
+
+def prune_bin_links(node_modules_dir):
+    """Remove .bin symlinks whose target no longer exists"""
+    bin_dir = os.path.join(node_modules_dir, '.bin')
+
+    if not os.path.isdir(bin_dir):
+        return
+
+    for name in os.listdir(bin_dir):
+        path = os.path.join(bin_dir, name)
+        if os.path.islink(path) and not os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,377 @@
+import hashlib
+import json
+import os
+import shutil
+import stat
+import tarfile
+import threading
+
+from util import make_dirs
+
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class TreeStore(object):
+    """Stores a cached module as a plain directory tree in <entry>/data
+
+    Args:
+        cache_dir (str): Root of the cache.
+        linker ([Linker]): Used to materialize files into projects.
+
+    """
+
+    name = 'tree'
+
+    def __init__(self, cache_dir, linker):
+        self.cache_dir = cache_dir
+        self.linker = linker
+
+
+    @staticmethod
+    def get_data_path(entry_dir):
+        return os.path.join(entry_dir, 'data')
+
+
+    def is_stored(self, entry_dir):
+        return os.path.isdir(TreeStore.get_data_path(entry_dir))
+
+
+    def put(self, module_dir, entry_dir):
+        """Store the files of `module_dir`, without its node_modules"""
+        shutil.copytree(module_dir, TreeStore.get_data_path(entry_dir), ignore=ignore_node_modules(module_dir))
+
+
+    def materialize(self, entry_dir, dest_dir):
+        self.linker.copy_tree(TreeStore.get_data_path(entry_dir), dest_dir)
+
+
+    def get_size(self, entry_dir):
+        return tree_size(TreeStore.get_data_path(entry_dir))
+
+
+    def read_file(self, entry_dir, path):
+        with open(os.path.join(TreeStore.get_data_path(entry_dir), path), 'rb') as file:
+            return file.read()
+
+
+class BlobStore(object):
+    """Stores cached modules in a content-addressable blob store
+
+    Each file is stored once in <cache>/.blobs, named after the sha256 of its
+    contents. A module entry only holds <entry>/files.json, which lists its
+    directories, symlinks and files (path, hash and mode). Identical files
+    are therefore shared between versions of a package and between packages.
+
+    Blobs of executable files are kept apart (suffix `-x`), so that hard
+    linked files get the right permissions.
+
+    Args:
+        cache_dir (str): Root of the cache.
+        linker ([Linker]): Used to materialize files into projects.
+
+    """
+
+    name = 'cas'
+
+    def __init__(self, cache_dir, linker):
+        self.cache_dir = cache_dir
+        self.linker = linker
+        self.blobs_dir = os.path.join(cache_dir, '.blobs')
+
+
+    @staticmethod
+    def get_files_path(entry_dir):
+        return os.path.join(entry_dir, 'files.json')
+
+
+    def get_blob_path(self, digest, mode):
+        suffix = '-x' if mode & stat.S_IXUSR else ''
+        return os.path.join(self.blobs_dir, digest[0:2], digest + suffix)
+
+
+    def is_stored(self, entry_dir):
+        return os.path.isfile(BlobStore.get_files_path(entry_dir))
+
+
+    def put(self, module_dir, entry_dir):
+        files = {'dirs': [], 'files': [], 'links': []}
+
+        for root, dirs, names in os.walk(module_dir):
+            if root == module_dir and 'node_modules' in dirs:
+                dirs.remove('node_modules')
+
+            for name in sorted(dirs + names):
+                path = os.path.join(root, name)
+                rel_path = os.path.relpath(path, module_dir)
+                mode = stat.S_IMODE(os.lstat(path).st_mode)
+
+                if os.path.islink(path):
+                    files['links'].append([rel_path, os.readlink(path)])
+                elif name in dirs:
+                    files['dirs'].append([rel_path, mode])
+                else:
+                    files['files'].append([rel_path, self.add_blob(path, mode), mode])
+
+        make_dirs(entry_dir)
+        with open(BlobStore.get_files_path(entry_dir), 'w') as file:
+            json.dump(files, file, sort_keys=True, separators=(',', ':'))
+
+
+    def add_blob(self, path, mode):
+        """Copy a file into the blob store, unless identical content is there
+
+        Returns:
+            str: sha256 hex digest of the file contents
+        """
+        digest = hash_file(path)
+        blob_path = self.get_blob_path(digest, mode)
+
+        if not os.path.isfile(blob_path):
+            make_dirs(os.path.dirname(blob_path))
+            temp_path = '%s.%s-%s.tmp' % (blob_path, os.getpid(), threading.current_thread().ident)
+            shutil.copyfile(path, temp_path)
+            os.chmod(temp_path, 0o755 if mode & stat.S_IXUSR else 0o644)
+            os.rename(temp_path, blob_path)
+
+        return digest
+
+
+    def load_files(self, entry_dir):
+        with open(BlobStore.get_files_path(entry_dir)) as file:
+            return json.load(file)
+
+
+    def materialize(self, entry_dir, dest_dir):
+        files = self.load_files(entry_dir)
+
+        make_dirs(dest_dir)
+        for (path, mode) in files['dirs']:
+            make_dirs(os.path.join(dest_dir, path))
+
+        for (path, target) in files['links']:
+            os.symlink(target, os.path.join(dest_dir, path))
+
+        pairs = [(self.get_blob_path(digest, mode), os.path.join(dest_dir, path)) for (path, digest, mode) in files['files']]
+        self.linker.link_files(pairs)
+
+        # blobs only carry 0644 or 0755, restore other modes on private copies
+        for (path, digest, mode) in files['files']:
+            if mode not in (0o644, 0o755):
+                restore_mode(os.path.join(dest_dir, path), mode)
+
+        for (path, mode) in files['dirs']:
+            os.chmod(os.path.join(dest_dir, path), mode)
+
+
+    def get_size(self, entry_dir):
+        """Bytes of all files of the module, counting shared blobs in full"""
+        files = self.load_files(entry_dir)['files']
+        return sum(os.path.getsize(self.get_blob_path(digest, mode)) for (_, digest, mode) in files)
+
+
+    def read_file(self, entry_dir, path):
+        for (file_path, digest, mode) in self.load_files(entry_dir)['files']:
+            if file_path == path:
+                with open(self.get_blob_path(digest, mode), 'rb') as file:
+                    return file.read()
+
+        raise IOError('File %s not found in %s' % (path, entry_dir))
+
+
+class ArchiveStore(object):
+    """Stores a cached module as a single tar archive in <entry>/data.tar
+
+    Trades CPU at install time for inodes: an entry is two files however
+    large the module is, which keeps walking, backing up or syncing the
+    cache cheap. Modules are always copied into projects, by extracting
+    the archive in one sequential read; link modes do not apply.
+
+    <entry>/archive.json lists the files of the archive with their size and,
+    for uncompressed archives, the offset of their data, so single files
+    are read without scanning the archive.
+
+    Args:
+        cache_dir (str): Root of the cache.
+        linker ([Linker]): Unused, stores share one constructor.
+
+    """
+
+    name = None
+    compression = None
+
+    def __init__(self, cache_dir, linker):
+        self.cache_dir = cache_dir
+        self.linker = linker
+
+
+    def get_archive_path(self, entry_dir):
+        return os.path.join(entry_dir, 'data.tar.gz' if self.compression == 'gz' else 'data.tar')
+
+
+    @staticmethod
+    def get_index_path(entry_dir):
+        return os.path.join(entry_dir, 'archive.json')
+
+
+    def is_stored(self, entry_dir):
+        return os.path.isfile(self.get_archive_path(entry_dir))
+
+
+    def put(self, module_dir, entry_dir):
+        """Archive the files of `module_dir`, without its node_modules"""
+        archive_path = self.get_archive_path(entry_dir)
+        make_dirs(entry_dir)
+
+        with tarfile.open(archive_path, 'w:' + self.compression) as archive:
+            for root, dirs, names in os.walk(module_dir):
+                if root == module_dir and 'node_modules' in dirs:
+                    dirs.remove('node_modules')
+                dirs.sort()
+
+                for name in sorted(dirs + names):
+                    path = os.path.join(root, name)
+                    info = archive.gettarinfo(path, os.path.relpath(path, module_dir))
+                    info.uid = info.gid = 0
+                    info.uname = info.gname = ''
+
+                    # files with several links (e.g. after a hardlink install) are stored
+                    # whole, gettarinfo would make all but the first a data-less link member
+                    if info.islnk():
+                        info.type = tarfile.REGTYPE
+                        info.linkname = ''
+                        info.size = os.path.getsize(path)
+
+                    if info.isreg():
+                        with open(path, 'rb') as file:
+                            archive.addfile(info, file)
+                    else:
+                        archive.addfile(info)
+
+        # read back the headers for the file index, data offsets are only meaningful uncompressed
+        files = []
+        with tarfile.open(archive_path, 'r:' + self.compression) as archive:
+            for member in archive.getmembers():
+                if member.isreg():
+                    offset = member.offset_data if not self.compression else None
+                    files.append([member.name, offset, member.size])
+
+        with open(ArchiveStore.get_index_path(entry_dir), 'w') as file:
+            json.dump({'files': files}, file, sort_keys=True, separators=(',', ':'))
+
+
+    def materialize(self, entry_dir, dest_dir):
+        dirs = []
+        make_dirs(dest_dir)
+
+        with tarfile.open(self.get_archive_path(entry_dir), 'r|' + self.compression, bufsize=CHUNK_SIZE) as archive:
+            for member in archive:
+                if member.name.startswith('/') or '..' in member.name.split('/'):
+                    raise RuntimeError('Invalid path %s in %s' % (member.name, entry_dir))
+
+                target = os.path.join(dest_dir, member.name)
+
+                if member.isdir():
+                    make_dirs(target)
+                    dirs.append((target, member.mode))
+                elif member.issym():
+                    os.symlink(member.linkname, target)
+                elif member.isreg():
+                    with open(target, 'wb') as file:
+                        shutil.copyfileobj(archive.extractfile(member), file, CHUNK_SIZE)
+                    os.chmod(target, member.mode)
+                elif member.islnk():
+                    # written by older versions of `put`, points at a file extracted before
+                    if member.linkname.startswith('/') or '..' in member.linkname.split('/'):
+                        raise RuntimeError('Invalid link %s in %s' % (member.linkname, entry_dir))
+                    shutil.copyfile(os.path.join(dest_dir, member.linkname), target)
+                    os.chmod(target, member.mode)
+
+        # directories last, a read-only one would not have taken its files
+        for (path, mode) in dirs:
+            os.chmod(path, mode)
+
+
+    def get_size(self, entry_dir):
+        """Bytes the archive takes on disk"""
+        return os.path.getsize(self.get_archive_path(entry_dir))
+
+
+    def read_file(self, entry_dir, path):
+        with open(ArchiveStore.get_index_path(entry_dir)) as file:
+            files = json.load(file)['files']
+
+        for (file_path, offset, size) in files:
+            if file_path != path:
+                continue
+
+            if offset is not None:
+                with open(self.get_archive_path(entry_dir), 'rb') as file:
+                    file.seek(offset)
+                    return file.read(size)
+
+            with tarfile.open(self.get_archive_path(entry_dir), 'r|' + self.compression) as archive:
+                for member in archive:
+                    if member.name == path:
+                        return archive.extractfile(member).read()
+
+        raise IOError('File %s not found in %s' % (path, entry_dir))
+
+
+class TarStore(ArchiveStore):
+    """Uncompressed archive entries: fewest inodes, cheapest extraction"""
+
+    name = 'tar'
+    compression = ''
+
+
+class TgzStore(ArchiveStore):
+    """Gzipped archive entries: smallest cache, most CPU per install"""
+
+    name = 'tgz'
+    compression = 'gz'
+
+
+STORES = [TreeStore, BlobStore, TarStore, TgzStore]
+
+STORE_FORMATS = [store.name for store in STORES]
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+
+    with open(path, 'rb') as file:
+        chunk = file.read(CHUNK_SIZE)
+        while chunk:
+            digest.update(chunk)
+            chunk = file.read(CHUNK_SIZE)
+
+    return digest.hexdigest()
+
+
+def tree_size(path):
+    size = 0
+
+    for root, _, files in os.walk(path):
+        for name in files:
+            size = size + os.lstat(os.path.join(root, name)).st_size
+
+    return size
+
+
+def restore_mode(path, mode):
+    info = os.lstat(path)
+
+    # never chmod a file shared with the blob store
+    if stat.S_ISREG(info.st_mode) and info.st_nlink == 1:
+        os.chmod(path, mode)
+
+
+def ignore_node_modules(module_dir):
+    """shutil.copytree ignore callback skipping the module's own node_modules"""
+    def ignore(path, names):
+        if path == module_dir and 'node_modules' in names:
+            return ['node_modules']
+        return []
+
+    return ignore
@@ -0,0 +1,121 @@
+import io
+import json
+import os
+import tarfile
+import unittest
+
+from bundle import BUNDLE_VERSION, HEADER_NAME, CacheBundle, add_json
+from testutil import CacheTestCase
+
+
+class TestCacheBundle(CacheTestCase):
+
+    def add_module(self, cache, name, version):
+        CacheTestCase.add_module(self, cache, name, version, {'bin': {'cli': 'bin/cli'}},
+                                 {'bin/cli': '#!/usr/bin/env node\n'})
+
+
+    def export(self, cache, modules):
+        data = io.BytesIO()
+        CacheBundle(cache).export_modules(modules, data)
+        return data.getvalue()
+
+
+    def test_round_trip(self):
+        source = self.new_cache('source', 'cas')
+        self.add_module(source, 'foo', '1.0.0')
+        self.add_module(source, '@scope/bar', '2.0.0')
+        data = self.export(source, [('foo', '1.0.0'), ('@scope/bar', '2.0.0')])
+
+        target = self.new_cache('target', 'tree')
+        self.assertEqual(CacheBundle(target).import_modules(io.BytesIO(data)), (2, 0))
+        self.assertEqual(CacheBundle(target).import_modules(io.BytesIO(data)), (0, 2))
+
+        project_dir = os.path.join(self.temp_dir, 'project')
+        target.materialize_module('@scope/bar', '2.0.0', project_dir)
+        cli = os.path.join(project_dir, 'node_modules', '@scope', 'bar', 'bin', 'cli')
+
+        self.assertEqual(target.index.get('foo', '1.0.0')['format'], 'cas')
+        self.assertTrue(os.access(cli, os.X_OK))
+
+
+    def test_truncated_bundle(self):
+        source = self.new_cache('source', 'tree')
+        self.add_module(source, 'foo', '1.0.0')
+        self.add_module(source, 'bar', '1.0.0')
+        data = self.export(source, [('foo', '1.0.0'), ('bar', '1.0.0')])
+
+        # cut inside the second entry
+        end = data.index(b'entries/bar/1.0.0/') + 1024
+        target = self.new_cache('target', 'tree')
+        self.assertRaises(RuntimeError, CacheBundle(target).import_modules, io.BytesIO(data[0:end]))
+
+        self.assertEqual(sorted(target.index.names().keys()), ['foo'])
+        self.assertEqual(os.listdir(target.temp_dir), [])
+
+
+    def test_hardlinked_files(self):
+        source = self.new_cache('source', 'tree')
+        self.add_module(source, 'foo', '1.0.0')
+        entry_dir = source.get_module_path('foo', '1.0.0')
+        data_dir = [root for (root, _, names) in os.walk(entry_dir) if 'package.json' in names][0]
+        os.link(os.path.join(data_dir, 'package.json'), os.path.join(data_dir, 'package.json.orig'))
+        data = self.export(source, [('foo', '1.0.0')])
+
+        target = self.new_cache('target', 'tree')
+        self.assertEqual(CacheBundle(target).import_modules(io.BytesIO(data)), (1, 0))
+
+        project_dir = os.path.join(self.temp_dir, 'project')
+        target.materialize_module('foo', '1.0.0', project_dir)
+        with open(os.path.join(project_dir, 'node_modules', 'foo', 'package.json.orig')) as file:
+            self.assertEqual(json.load(file)['name'], 'foo')
+
+
+    def test_malicious_bundle(self):
+        outside_dir = os.path.join(self.temp_dir, 'outside')
+        os.makedirs(outside_dir)
+        target = self.new_cache('target', 'tree')
+
+        members = [
+            # a symlink, then a file below it
+            [symlink_member('entries/foo/1.0.0/data', outside_dir), file_member('entries/foo/1.0.0/data/x')],
+            [symlink_member('entries/foo/1.0.0/data', '/etc')],
+            [symlink_member('entries/foo/1.0.0/data', '../../..')],
+            [file_member('entries/foo/1.0.0/a'), link_member('entries/foo/1.0.0/b', 'entries/foo/1.0.0/a')],
+        ]
+
+        for bundle_members in members:
+            data = io.BytesIO()
+            with tarfile.open(fileobj=data, mode='w') as archive:
+                add_json(archive, HEADER_NAME, {'version': BUNDLE_VERSION})
+                for (info, content) in bundle_members:
+                    archive.addfile(info, content)
+
+            self.assertRaises(RuntimeError, CacheBundle(target).import_modules, io.BytesIO(data.getvalue()))
+
+        self.assertEqual(os.listdir(outside_dir), [])
+        self.assertEqual(os.listdir(target.temp_dir), [])
+
+
+def file_member(name):
+    info = tarfile.TarInfo(name)
+    info.size = 4
+    return (info, io.BytesIO(b'evil'))
+
+
+def symlink_member(name, linkname):
+    info = tarfile.TarInfo(name)
+    info.type = tarfile.SYMTYPE
+    info.linkname = linkname
+    return (info, None)
+
+
+def link_member(name, linkname):
+    info = tarfile.TarInfo(name)
+    info.type = tarfile.LNKTYPE
+    info.linkname = linkname
+    return (info, None)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
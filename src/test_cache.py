@@ -0,0 +1,118 @@
+import json
+import os
+import threading
+import unittest
+
+from cache import partition_modules
+from npm import Npm
+from testutil import CacheTestCase
+
+
+class TestCache(unittest.TestCase):
+
+    def test_partition_modules(self):
+        modules = [
+            ('a', '1.0.0', 'http://a/1'),
+            ('a', '2.0.0', 'http://a/2'),
+            ('b', '1.0.0', 'http://b/1'),
+            ('c', '1.0.0', 'http://c/1'),
+            ('b', '1.0.0', 'http://b/1'),
+        ]
+
+        batches = partition_modules(modules, 100)
+
+        self.assertEqual(batches, [
+            [('a', '1.0.0', 'http://a/1'), ('b', '1.0.0', 'http://b/1'), ('c', '1.0.0', 'http://c/1')],
+            [('a', '2.0.0', 'http://a/2')],
+        ])
+
+
+    def test_partition_modules_size(self):
+        modules = [(str(i), '1.0.0', 'http://%s' % i) for i in range(5)]
+        self.assertEqual([len(batch) for batch in partition_modules(modules, 2)], [2, 2, 1])
+
+
+class TestCachePublish(CacheTestCase):
+
+    def setUp(self):
+        CacheTestCase.setUp(self)
+        self.module_dir = self.write_module('foo', '1.0.0', files={'lib/index.js': 'module.exports = 42;\n'})
+
+
+    def test_concurrent_copy(self):
+        # two caches stand in for two processes, each with several threads
+        caches = [self.new_cache(), self.new_cache(cache_format='cas')]
+        threads = [threading.Thread(target=cache.copy_module_to_cache, args=(self.module_dir,))
+                   for cache in caches for _ in range(4)]
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        with open(caches[0].index.path) as file:
+            self.assertEqual(len(file.readlines()), 1)
+
+        for cache in caches:
+            self.assertTrue(cache.query('foo', '1.0.0'))
+        self.assertEqual(os.listdir(caches[0].temp_dir), [])
+
+
+    def test_replaces_incomplete_entry(self):
+        cache = self.new_cache()
+        entry_dir = cache.get_module_path('foo', '1.0.0')
+        os.makedirs(os.path.join(entry_dir, 'data'))
+
+        self.assertFalse(cache.query('foo', '1.0.0'))
+        cache.copy_module_to_cache(self.module_dir)
+
+        self.assertTrue(cache.query('foo', '1.0.0'))
+        self.assertEqual(sorted(os.listdir(entry_dir)), ['bin.json', 'data', 'deps.json'])
+        self.assertTrue(os.path.isfile(os.path.join(entry_dir, 'data', 'lib', 'index.js')))
+
+
+    def test_scoped_module_bin_links(self):
+        # npm links executables of scoped modules into node_modules/.bin, not node_modules/@scope/.bin
+        with open(os.path.join(self.module_dir, 'package.json'), 'w') as file:
+            json.dump({'name': '@scope/foo', 'version': '1.0.0', 'bin': {'foo': 'lib/index.js'}}, file)
+
+        cache = self.new_cache()
+        cache.copy_module_to_cache(self.module_dir)
+        project_dir = os.path.join(self.temp_dir, 'project')
+        cache.materialize_module('@scope/foo', '1.0.0', project_dir)
+
+        bin_link = os.path.join(project_dir, 'node_modules', '.bin', 'foo')
+        self.assertEqual(os.readlink(bin_link), os.path.join('..', '@scope', 'foo', 'lib', 'index.js'))
+        self.assertFalse(os.path.exists(os.path.join(project_dir, 'node_modules', '@scope', '.bin')))
+
+
+    def test_native_entry_per_host(self):
+        addon_dir = os.path.join(self.module_dir, 'build', 'Release')
+        os.makedirs(addon_dir)
+        with open(os.path.join(addon_dir, 'foo.node'), 'wb') as file:
+            file.write(b'\x7fELF')
+
+        cache = self.new_cache()
+        cache.copy_module_to_cache(self.module_dir)
+        native_version = Npm.get_native_version('1.0.0')
+        project_dir = os.path.join(self.temp_dir, 'project')
+
+        self.assertEqual(cache.get_entry_version('foo', '1.0.0'), native_version)
+        self.assertFalse(os.path.exists(cache.get_module_path('foo', '1.0.0')))
+        self.assertEqual(cache.get_versions(), {'foo': ['1.0.0']})
+
+        cache.materialize_module('foo', '1.0.0', project_dir)
+        self.assertTrue(os.path.isfile(os.path.join(project_dir, 'node_modules', 'foo', 'build', 'Release', 'foo.node')))
+
+        # a host with another node ABI builds its own copy
+        fingerprint = Npm.host_fingerprint
+        Npm.host_fingerprint = 'linux-x86_64-node1'
+        try:
+            self.assertFalse(cache.query('foo', '1.0.0'))
+            self.assertEqual(cache.get_versions(), {})
+        finally:
+            Npm.host_fingerprint = fingerprint
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,127 @@
+import os
+import unittest
+
+from dedupe import HoistNode, HoistPlanner
+from manifest import InstallRecord
+from testutil import CacheTestCase
+
+
+class TestHoistPlanner(CacheTestCase):
+
+    def setUp(self):
+        CacheTestCase.setUp(self)
+        self.root_path = os.path.join(self.temp_dir, 'project')
+        self.cache = self.new_cache()
+
+
+    def add_module(self, name, version, dependencies=None):
+        CacheTestCase.add_module(self, self.cache, name, version, {'dependencies': dependencies or {}})
+
+
+    def build_records(self, rows):
+        """Records from (name, version, parent, requires) rows"""
+        records = []
+        module_dirs = []
+
+        for (name, version, parent, requires) in rows:
+            path = self.root_path if parent is None else module_dirs[parent]
+            records.append(InstallRecord(path, name, version, 'url/%s-%s' % (name, version), parent, requires))
+            module_dirs.append(os.path.join(path, 'node_modules', name))
+
+        return records
+
+
+    @staticmethod
+    def get_paths(records):
+        return [(os.path.join(record.path, 'node_modules', record.name), record.version) for record in records]
+
+
+    def test_plan_hoists_and_dedupes(self):
+        records = self.build_records([
+            ('a', '1.0.0', None, ('b',)),
+            ('b', '1.0.0', 0, ('d',)),
+            ('d', '1.0.0', 1, ()),
+            ('c', '1.0.0', None, ('b',)),
+            ('b', '1.0.0', 3, ('d',)),
+            ('d', '1.0.0', 4, ()),
+        ])
+
+        deduped = HoistPlanner(self.cache).plan(records, self.root_path)
+        modules = os.path.join(self.root_path, 'node_modules')
+
+        self.assertEqual(self.get_paths(deduped), [
+            (os.path.join(modules, 'a'), '1.0.0'),
+            (os.path.join(modules, 'b'), '1.0.0'),
+            (os.path.join(modules, 'c'), '1.0.0'),
+            (os.path.join(modules, 'd'), '1.0.0'),
+        ])
+        self.assertEqual([record.parent for record in deduped], [None, None, None, None])
+
+
+    def test_plan_keeps_conflicting_versions_nested(self):
+        records = self.build_records([
+            ('a', '1.0.0', None, ('b',)),
+            ('b', '1.0.0', 0, ()),
+            ('b', '2.0.0', None, ()),
+            ('c', '1.0.0', None, ('e',)),
+            ('e', '1.0.0', 3, ('b',)),
+            ('b', '1.0.0', 4, ()),
+        ])
+
+        deduped = HoistPlanner(self.cache).plan(records, self.root_path)
+        modules = os.path.join(self.root_path, 'node_modules')
+
+        # e moves up, its b@1.0.0 cannot, b@2.0.0 is taken at the top
+        self.assertEqual(self.get_paths(deduped), [
+            (os.path.join(modules, 'a'), '1.0.0'),
+            (os.path.join(modules, 'a', 'node_modules', 'b'), '1.0.0'),
+            (os.path.join(modules, 'b'), '2.0.0'),
+            (os.path.join(modules, 'c'), '1.0.0'),
+            (os.path.join(modules, 'e'), '1.0.0'),
+            (os.path.join(modules, 'e', 'node_modules', 'b'), '1.0.0'),
+        ])
+
+
+    def test_plan_reads_requires_from_cache(self):
+        self.add_module('a', '1.0.0', {'b': '^1.0.0'})
+        self.add_module('b', '1.0.0')
+        self.add_module('c', '1.0.0', {'b': '1.0.0'})
+        records = self.build_records([
+            ('a', '1.0.0', None, None),
+            ('b', '1.0.0', 0, None),
+            ('c', '1.0.0', None, None),
+            ('b', '1.0.0', 2, None),
+        ])
+
+        deduped = HoistPlanner(self.cache).plan(records, self.root_path)
+        self.assertEqual([(record.name, record.parent) for record in deduped], [('a', None), ('b', None), ('c', None)])
+
+
+    def test_plan_without_requires(self):
+        records = self.build_records([
+            ('a', '1.0.0', None, None),
+            ('b', '1.0.0', 0, None),
+        ])
+
+        self.assertEqual(HoistPlanner(self.cache).plan(records, self.root_path), records)
+
+
+
+    def test_is_equivalent_deep_tree(self):
+        copies = []
+
+        for _ in range(2):
+            node = top = HoistNode('m0', '1.0.0', None, ('m1',), None)
+            for depth in range(1, 5000):
+                node.children['m%s' % depth] = HoistNode('m%s' % depth, '1.0.0', None, ('m%s' % (depth + 1),), node)
+                node = node.children['m%s' % depth]
+            copies.append((top, node))
+
+        self.assertTrue(HoistPlanner.is_equivalent(copies[0][0], copies[1][0]))
+
+        copies[1][1].version = '2.0.0'
+        self.assertFalse(HoistPlanner.is_equivalent(copies[0][0], copies[1][0]))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
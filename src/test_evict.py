@@ -0,0 +1,54 @@
+import os
+import time
+import unittest
+
+from evict import CacheCollector
+from testutil import CacheTestCase
+
+
+class TestCacheCollector(CacheTestCase):
+
+    def setUp(self):
+        CacheTestCase.setUp(self)
+        self.cache = self.new_cache(cache_format='cas')
+
+        for (name, age) in [('old', 100), ('older', 200), ('used', 300), ('new', 0)]:
+            self.add_module(name, '1.0.0', age)
+
+
+    def test_collect_stale(self):
+        self.cache.record_manifest('/project', [('used', '1.0.0')])
+        CacheCollector(self.cache, max_age=150 * 24 * 60 * 60).collect()
+
+        self.assertEqual(self.cached_names(), ['new', 'old', 'used'])
+        self.assertEqual(self.cache.index.get('older', '1.0.0'), None)
+
+
+    def test_collect_to_size(self):
+        self.cache.record_manifest('/project', [('used', '1.0.0')])
+        size = self.cache.index.get('new', '1.0.0')['size'] + self.cache.index.get('used', '1.0.0')['size']
+        CacheCollector(self.cache, max_size=size).collect()
+
+        self.assertEqual(self.cached_names(), ['new', 'used'])
+
+
+    def test_collect_sweeps_blobs(self):
+        blobs_dir = self.cache.stores['cas'].blobs_dir
+        CacheCollector(self.cache, max_size=0).collect()
+
+        self.assertEqual(self.cached_names(), [])
+        self.assertEqual([files for (_, _, files) in os.walk(blobs_dir) if files], [])
+
+
+    def add_module(self, name, version, age_days):
+        CacheTestCase.add_module(self, self.cache, name, version)
+        last_used = time.time() - age_days * 24 * 60 * 60
+        os.utime(self.cache.get_module_path(name, version), (last_used, last_used))
+
+
+    def cached_names(self):
+        return sorted(name for (name, _) in self.cache.list_modules())
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
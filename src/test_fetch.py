@@ -0,0 +1,233 @@
+import io
+import json
+import os
+import socket
+import tarfile
+import threading
+import time
+import unittest
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+from errors import FetchError
+from fetch import Fetcher
+from npm import Npm
+from testutil import CacheTestCase
+from util import Struct
+
+
+class TestFetcher(CacheTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.registry = LocalRegistry()
+        cls.registry.add_package('foo', '1.0.0', {'bin': {'foo': 'cli.js'}})
+        cls.registry.add_package('bar', '1.0.0', {'scripts': {'install': 'node-gyp rebuild'}})
+        for index in range(4):
+            cls.registry.add_package('baz%d' % index, '1.0.0', {})
+        cls.registry.start()
+
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.registry.stop()
+
+
+    def setUp(self):
+        CacheTestCase.setUp(self)
+        self.registry.reset()
+
+
+    def test_resolve_url(self):
+        fetcher = Fetcher(self.config())
+        self.assertEqual(fetcher.resolve_url('https://registry.npmjs.org/foo/-/foo-1.0.0.tgz'), self.registry.url + '/foo/-/foo-1.0.0.tgz')
+        self.assertEqual(fetcher.resolve_url('http://example.com/foo.tgz'), 'http://example.com/foo.tgz')
+
+
+    def test_is_fetchable(self):
+        fetcher = Fetcher(self.config())
+        self.assertTrue(fetcher.is_fetchable('https://registry.npmjs.org/foo/-/foo-1.0.0.tgz'))
+        self.assertFalse(fetcher.is_fetchable('git+https://github.com/foo/foo.git#abc123'))
+
+
+    def test_fetch_reuses_connection(self):
+        fetcher = Fetcher(self.config())
+
+        for index in range(3):
+            dest_dir = os.path.join(self.temp_dir, str(index))
+            fetcher.fetch('https://registry.npmjs.org/foo/-/foo-1.0.0.tgz', dest_dir)
+            with open(os.path.join(dest_dir, 'package.json')) as file:
+                self.assertEqual(json.load(file)['name'], 'foo')
+
+        self.assertEqual(self.registry.connections, 1)
+
+
+    def test_fetch_sends_token(self):
+        os.environ['NPM_TOKEN'] = 'abc123'
+
+        try:
+            Fetcher(self.config()).fetch(self.registry.url + '/foo/-/foo-1.0.0.tgz', self.temp_dir)
+        finally:
+            del os.environ['NPM_TOKEN']
+
+        self.assertEqual(self.registry.authorization, 'Bearer abc123')
+
+
+    def test_fetch_follows_redirect(self):
+        Fetcher(self.config()).fetch(self.registry.url + '/redirect/foo/-/foo-1.0.0.tgz', self.temp_dir)
+        self.assertTrue(os.path.isfile(os.path.join(self.temp_dir, 'cli.js')))
+
+
+    def test_fetch_missing(self):
+        with self.assertRaises(FetchError) as context:
+            Fetcher(self.config()).fetch(self.registry.url + '/nope/-/nope-1.0.0.tgz', self.temp_dir)
+        self.assertEqual(context.exception.status, 404)
+
+
+    def test_npm_fetch(self):
+        npm = Npm(self.config())
+        module_dir = npm.fetch('foo', '1.0.0', 'https://registry.npmjs.org/foo/-/foo-1.0.0.tgz', self.temp_dir)
+
+        self.assertEqual(module_dir, os.path.join(self.temp_dir, 'node_modules', 'foo'))
+        self.assertTrue(os.access(os.path.join(module_dir, 'cli.js'), os.X_OK))
+
+
+    def test_npm_fetch_install_scripts(self):
+        npm = Npm(self.config())
+        module_dir = npm.fetch('bar', '1.0.0', 'https://registry.npmjs.org/bar/-/bar-1.0.0.tgz', self.temp_dir)
+
+        self.assertEqual(module_dir, None)
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir, 'node_modules', 'bar')))
+
+
+    def test_cache_fetches_in_parallel(self):
+        cache = self.new_cache(npm=Npm, jobs=4, **self.config().__dict__)
+        modules = [('baz%d' % index, '1.0.0', 'https://registry.npmjs.org/baz%d/-/baz%d-1.0.0.tgz' % (index, index))
+                   for index in range(4)]
+        self.registry.delay = 0.2
+        cache.add_many(modules)
+
+        self.assertTrue(all(cache.query(name, version) for (name, version, _) in modules))
+        self.assertTrue(self.registry.max_in_flight > 1)
+
+
+    def config(self):
+        return Struct(registry=self.registry.url, http_proxy=None, native_fetch=True, verbose=False)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class LocalRegistry(object):
+    """Stand-in for the npm registry, serving tarballs over HTTP/1.1"""
+
+    def __init__(self):
+        self.tarballs = {}
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler_class())
+        self.url = 'http://127.0.0.1:%s' % self.server.server_address[1]
+        # kept alive connections, closed by `stop`
+        self.open_connections = set()
+        self.lock = threading.Lock()
+        self.reset()
+
+
+    def reset(self):
+        self.connections = 0
+        self.authorization = None
+        self.requests = []
+        # seconds every tarball takes, and most requests served at once
+        self.delay = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+
+    def add_package(self, name, version, package):
+        package = dict(package, name=name, version=version)
+        files = {'package.json': json.dumps(package).encode('utf-8')}
+        for path in package.get('bin', {}).values():
+            files[path] = b'#!/usr/bin/env node\n'
+
+        data = io.BytesIO()
+        with tarfile.open(fileobj=data, mode='w:gz') as archive:
+            for (path, contents) in files.items():
+                info = tarfile.TarInfo('package/' + path)
+                info.size = len(contents)
+                archive.addfile(info, io.BytesIO(contents))
+
+        self.tarballs['/%s/-/%s-%s.tgz' % (name, name, version)] = data.getvalue()
+
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+        with self.lock:
+            for connection in self.open_connections:
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+
+
+    def handler_class(self):
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                BaseHTTPRequestHandler.setup(self)
+                with registry.lock:
+                    registry.connections = registry.connections + 1
+                    registry.open_connections.add(self.connection)
+
+            def finish(self):
+                with registry.lock:
+                    registry.open_connections.discard(self.connection)
+                BaseHTTPRequestHandler.finish(self)
+
+            def do_GET(self):
+                registry.authorization = self.headers.get('Authorization')
+                registry.requests.append(self.path)
+
+                if self.path.startswith('/redirect/'):
+                    self.send_response(302)
+                    self.send_header('Location', self.path[len('/redirect'):])
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                with registry.lock:
+                    registry.in_flight = registry.in_flight + 1
+                    registry.max_in_flight = max(registry.max_in_flight, registry.in_flight)
+
+                time.sleep(registry.delay)
+                with registry.lock:
+                    registry.in_flight = registry.in_flight - 1
+
+                body = registry.tarballs.get(self.path, None)
+                self.send_response(200 if body else 404)
+                self.send_header('Content-Length', str(len(body or b'')))
+                self.end_headers()
+                self.wfile.write(body or b'')
+
+            def log_message(self, *nargs):
+                pass
+
+        return Handler
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
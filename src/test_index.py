@@ -0,0 +1,80 @@
+import shutil
+import tempfile
+import unittest
+
+from index import CacheIndex
+
+
+class TestCacheIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+
+    def test_add_and_reload(self):
+        index = CacheIndex(self.cache_dir)
+        index.load()
+        index.add(record('foo', '1.0.0'))
+        index.add(record('bar', '2.0.0'))
+        index.remove('foo', '1.0.0')
+
+        reloaded = CacheIndex(self.cache_dir)
+        reloaded.load()
+
+        self.assertEqual(reloaded.get('foo', '1.0.0'), None)
+        self.assertEqual(reloaded.get('bar', '2.0.0')['bin'], {'bar': 'cli.js'})
+        self.assertEqual(reloaded.names(), {'bar': ['2.0.0']})
+
+
+    def test_refresh(self):
+        index = CacheIndex(self.cache_dir)
+        index.load()
+        other = CacheIndex(self.cache_dir)
+        other.load()
+
+        other.add(record('foo', '1.0.0'))
+        index.refresh()
+        self.assertEqual(index.names(), {'foo': ['1.0.0']})
+
+        other.compact()
+        other.remove('foo', '1.0.0')
+        index.refresh()
+        self.assertEqual(index.names(), {})
+
+
+    def test_ignores_torn_records(self):
+        index = CacheIndex(self.cache_dir)
+        index.add(record('foo', '1.0.0'))
+
+        with open(index.path, 'a') as file:
+            file.write('{"name": "bar", "vers')
+
+        index.add(record('baz', '1.0.0'))
+
+        reloaded = CacheIndex(self.cache_dir)
+        reloaded.load()
+        self.assertEqual(sorted(reloaded.names().keys()), ['baz', 'foo'])
+
+
+    def test_compact(self):
+        index = CacheIndex(self.cache_dir)
+
+        for _ in range(3):
+            index.add(record('foo', '1.0.0'))
+        index.compact()
+
+        with open(index.path) as file:
+            self.assertEqual(len(file.readlines()), 1)
+        self.assertEqual(index.get('foo', '1.0.0')['size'], 10)
+
+
+def record(name, version):
+    return {'name': name, 'version': version, 'format': 'tree', 'deps': {}, 'bin': {name: 'cli.js'}, 'size': 10}
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from link import Linker, replace_symlink
+
+
+class TestLinker(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.src = os.path.join(self.temp_dir, 'cache', 'data')
+        self.dst = os.path.join(self.temp_dir, 'project', 'node_modules', 'foo')
+
+        os.makedirs(os.path.join(self.src, 'lib'))
+        write_file(os.path.join(self.src, 'package.json'), '{"name": "foo"}')
+        write_file(os.path.join(self.src, 'lib', 'index.js'), 'module.exports = 1;')
+        os.chmod(os.path.join(self.src, 'lib', 'index.js'), 0o755)
+        os.symlink('index.js', os.path.join(self.src, 'lib', 'main.js'))
+
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+
+    def test_copy(self):
+        Linker('copy').copy_tree(self.src, self.dst)
+        self.assertTreeMatches()
+        self.assertFalse(same_file(self.src, self.dst, 'package.json'))
+
+
+    def test_hardlink(self):
+        Linker('hardlink').copy_tree(self.src, self.dst)
+        self.assertTreeMatches()
+        self.assertTrue(same_file(self.src, self.dst, 'package.json'))
+
+
+    def test_symlink(self):
+        Linker('symlink').copy_tree(self.src, self.dst)
+        self.assertTreeMatches()
+        self.assertTrue(os.path.islink(os.path.join(self.dst, 'package.json')))
+
+
+    def test_auto(self):
+        Linker('auto').copy_tree(self.src, self.dst)
+        self.assertTreeMatches()
+
+
+    def test_invalid_mode(self):
+        with self.assertRaises(RuntimeError):
+            Linker('teleport')
+
+
+    def test_replace_symlink(self):
+        link_path = os.path.join(self.temp_dir, 'foo')
+        replace_symlink('one', link_path)
+        replace_symlink('two', link_path)
+
+        self.assertEqual(os.readlink(link_path), 'two')
+        self.assertEqual(sorted(os.listdir(self.temp_dir)), ['cache', 'foo'])
+
+
+    def assertTreeMatches(self):
+        index_js = os.path.join(self.dst, 'lib', 'index.js')
+
+        with open(index_js) as file:
+            self.assertEqual(file.read(), 'module.exports = 1;')
+
+        self.assertTrue(os.access(index_js, os.X_OK))
+        self.assertEqual(os.readlink(os.path.join(self.dst, 'lib', 'main.js')), 'index.js')
+
+
+def same_file(src, dst, name):
+    return os.stat(os.path.join(src, name)).st_ino == os.stat(os.path.join(dst, name)).st_ino
+
+
+def write_file(path, data):
+    with open(path, 'w') as file:
+        file.write(data)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -1,8 +1,11 @@
+import json
 import os
+import shutil
+import tempfile
 import unittest
 
 from errors import MissingNpmShrinkwrap
-from manifest import Manifest
+from manifest import Manifest, ShrinkwrapEntry
 from util import tree
 
 
@@ -10,9 +13,13 @@ class TestManifest(unittest.TestCase):
 
     def test_locate_package_json(self):
         cwd = relative_path('package_json')
+        actual = Manifest.locate_file(cwd)
+        self.assertEqual('/test_data/manifest/package_json/package.json' in actual, True)
+
 
-        with self.assertRaises(MissingNpmShrinkwrap):
-            actual = Manifest.locate_file(cwd)
+    def test_parse_package_json(self):
+        mani = Manifest(relative_path('package_json', 'package.json'))
+        self.assertEqual(mani.deps, None)
 
 
     def test_locate_shrinkwrap_json(self):
@@ -118,6 +125,61 @@ class TestManifest(unittest.TestCase):
         self.assertEqual(mani.deps, expected)
 
 
+    def test_iter_install_tasks(self):
+        mani = Manifest(relative_path('shrinkwrap_json', 'npm-shrinkwrap.json'))
+        records = list(mani.iter_install_tasks())
+        buffer_path = os.path.join(mani.root_path, 'node_modules', 'buffer')
+
+        self.assertEqual([record.name for record in records], ['buffer', 'base64-js', 'ieee754', 'isarray'])
+        self.assertEqual([record.parent for record in records], [None, 0, 0, 0])
+        self.assertEqual([record.path for record in records], [mani.root_path] + [buffer_path] * 3)
+        self.assertEqual(records[1].url, 'https://registry.npmjs.org/base64-js/-/base64-js-1.0.2.tgz')
+        self.assertTrue(isinstance(mani.json['dependencies']['buffer'], ShrinkwrapEntry))
+
+
+    def test_read_shrinkwrap_by_position(self):
+        temp_dir = tempfile.mkdtemp()
+        path = os.path.join(temp_dir, 'npm-shrinkwrap.json')
+
+        # a root without a name, modules named version and dependencies, and a requires map naming one
+        with open(path, 'w') as file:
+            json.dump({
+                'version': '1.0.0',
+                'dependencies': {
+                    'a': {'version': '1.0.0', 'requires': {'version': '2.0.0'}, 'dependencies': {
+                        'dependencies': {'version': '4.0.0', 'dependencies': {'c': {'version': '5.0.0'}}},
+                    }},
+                    'version': {'version': '2.0.0', 'dev': True},
+                },
+                'devDependencies': {'b': {'version': '3.0.0'}},
+            }, file)
+
+        try:
+            records = list(Manifest(path).iter_install_tasks())
+        finally:
+            shutil.rmtree(temp_dir)
+
+        self.assertEqual([(record.name, record.version) for record in records],
+                         [('a', '1.0.0'), ('dependencies', '4.0.0'), ('c', '5.0.0'), ('b', '3.0.0'),
+                          ('version', '2.0.0')])
+        self.assertEqual(records[0].requires, ('version',))
+
+
+    def test_iter_install_tasks_deep_tree(self):
+        root = {}
+        dependencies = root
+
+        for depth in range(5000):
+            dependencies['m%s' % depth] = ShrinkwrapEntry('1.0.0', None, {}, None)
+            dependencies = dependencies['m%s' % depth].dependencies
+
+        records = list(Manifest.iter_shrinkwrap_records(root, '/project'))
+
+        self.assertEqual(len(records), 5000)
+        self.assertEqual(records[-1].parent, 4998)
+        self.assertEqual(records[2].path, '/project/node_modules/m0/node_modules/m1')
+
+
 def relative_path(*nargs):
     return os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'test_data', 'manifest', *nargs))
 
@@ -1,7 +1,12 @@
 import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
 
-from npm import Npm
+import npm
+from npm import ModuleScanner, Npm
 
 
 class TestNpm(unittest.TestCase):
@@ -30,6 +35,72 @@ class TestNpm(unittest.TestCase):
         self.assertEqual(set(deps['1b@1.0.0']['1b-a@1.0.0'].keys()), set([]))
 
 
+    def test_has_native_code(self):
+        temp_dir = tempfile.mkdtemp()
+
+        try:
+            os.makedirs(os.path.join(temp_dir, 'node_modules', 'dep', 'build'))
+            open(os.path.join(temp_dir, 'node_modules', 'dep', 'build', 'dep.node'), 'w').close()
+            self.assertFalse(Npm.has_native_code(temp_dir))
+
+            os.makedirs(os.path.join(temp_dir, 'build', 'Release'))
+            open(os.path.join(temp_dir, 'build', 'Release', 'addon.node'), 'w').close()
+            self.assertTrue(Npm.has_native_code(temp_dir))
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+    def test_host_fingerprint(self):
+        fingerprint = Npm.get_host_fingerprint()
+
+        self.assertTrue(fingerprint is Npm.get_host_fingerprint())
+        self.assertEqual(Npm.get_native_version('1.0.0'), '1.0.0@' + fingerprint)
+        self.assertFalse('/' in fingerprint or '@' in fingerprint)
+
+
+    def test_host_probed_once_by_concurrent_workers(self):
+        calls = []
+
+        def check_output(cmd):
+            calls.append(cmd)
+            time.sleep(0.05)
+            return b'57\n'
+
+        (fingerprint, check_output_before) = (Npm.host_fingerprint, npm.subprocess.check_output)
+        Npm.host_fingerprint = None
+        npm.subprocess.check_output = check_output
+
+        try:
+            threads = [threading.Thread(target=Npm.get_host_fingerprint) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual(len(calls), 1)
+            self.assertTrue(Npm.host_fingerprint.endswith('-node57'))
+        finally:
+            Npm.host_fingerprint = fingerprint
+            npm.subprocess.check_output = check_output_before
+
+
+    def test_scanner_prunes_module_files(self):
+        test_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'test_data', 'npm'))
+        modules = ModuleScanner().scan(test_path)
+
+        self.assertEqual([stat for (_, stat, _) in modules], [('1a', '0.0.1'), ('1b', '1.0.0'), ('1b-a', '1.0.0')])
+
+
+    def test_scanner_dependency_trees(self):
+        test_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'test_data', 'npm'))
+        module_path = os.path.join(test_path, 'node_modules', '1b')
+        scanner = ModuleScanner()
+        scanner.scan(test_path)
+
+        self.assertEqual(scanner.deps[module_path], Npm.build_dependency_tree(module_path))
+        self.assertEqual(set(scanner.deps[module_path].keys()), set(['1b-a@1.0.0']))
+        self.assertEqual(scanner.deps[test_path]['1b@1.0.0'], scanner.deps[module_path])
+
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)
@@ -0,0 +1,58 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from manifest import Manifest
+from plan import PlanCache
+
+
+class TestPlanCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.plans = PlanCache(os.path.join(self.temp_dir, 'cache'))
+
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+
+    def test_round_trip(self):
+        manifest = Manifest(relative_path('shrinkwrap_json', 'npm-shrinkwrap.json'))
+        key = PlanCache.get_key(manifest.path)
+        records = list(manifest.iter_install_tasks())
+
+        self.assertEqual(self.plans.load(key, manifest.root_path), None)
+        self.plans.save(key, records)
+
+        # plans do not depend on where the project lives
+        loaded = self.plans.load(key, '/elsewhere')
+
+        self.assertEqual([(r.name, r.version, r.url, r.parent) for r in loaded],
+                         [(r.name, r.version, r.url, r.parent) for r in records])
+        self.assertEqual(loaded[0].path, '/elsewhere')
+        self.assertEqual(loaded[1].path, '/elsewhere/node_modules/buffer')
+
+
+    def test_key_follows_content(self):
+        path = os.path.join(self.temp_dir, 'npm-shrinkwrap.json')
+
+        with open(path, 'w') as file:
+            file.write('{"name": "foo", "version": "1.0.0"}')
+        key = PlanCache.get_key(path)
+
+        self.assertEqual(PlanCache.get_key(path), key)
+
+        with open(path, 'w') as file:
+            file.write('{"name": "foo", "version": "1.0.1"}')
+
+        self.assertNotEqual(PlanCache.get_key(path), key)
+
+
+def relative_path(*nargs):
+    return os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'test_data', 'manifest', *nargs))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,109 @@
+import json
+import os
+import unittest
+
+from frosty import Frosty
+from test_fetch import LocalRegistry
+from testutil import CacheTestCase
+from util import Struct
+
+
+class TestPrefetch(CacheTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.registry = LocalRegistry()
+        for name in ('foo', 'bar', 'baz', 'qux'):
+            cls.registry.add_package(name, '1.0.0', {})
+        cls.registry.start()
+
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.registry.stop()
+
+
+    def setUp(self):
+        CacheTestCase.setUp(self)
+        self.registry.reset()
+
+        # foo is used by both projects, qux is cached already
+        self.write_shrinkwrap('a', {'foo': {}, 'bar': {'dependencies': {'baz': {}}}})
+        self.write_shrinkwrap('b', {'foo': {}, 'qux': {}})
+
+        config = Struct(cwd=self.temp_dir, cache_dir=os.path.join(self.temp_dir, 'cache'), link_mode='copy',
+                        cache_format='tree', remote_cache=None, registry=self.registry.url, http_proxy=None,
+                        native_fetch=True, batch=True, offline=False, verbose=False, profile=None, command='prefetch',
+                        jobs=2, force=False, retries=0, retry_delay=1.0, retry_max_time=120.0)
+        self.frosty = Frosty(config)
+        self.caches.append(self.frosty.cache)
+        self.add_module(self.frosty.cache, 'qux', '1.0.0')
+
+
+    def write_shrinkwrap(self, project, dependencies):
+        def entries(dependencies):
+            return dict((name, dict(version='1.0.0', dependencies=entries(value.get('dependencies', {}))))
+                        for (name, value) in dependencies.items())
+
+        os.makedirs(os.path.join(self.temp_dir, project))
+        with open(os.path.join(self.temp_dir, project, 'npm-shrinkwrap.json'), 'w') as file:
+            json.dump({'name': project, 'version': '1.0.0', 'dependencies': entries(dependencies)}, file)
+
+
+    def test_collect_tasks(self):
+        tasks = self.frosty.collect_tasks(['a', 'b/npm-shrinkwrap.json'])
+        self.assertEqual(sorted(task.module for task in tasks), ['bar', 'baz', 'foo', 'qux'])
+
+
+    def test_prefetch(self):
+        self.frosty.prefetch(['a', 'b/npm-shrinkwrap.json'])
+
+        # shared modules are downloaded once, cached ones not at all
+        self.assertEqual(sorted(self.registry.requests), ['/bar/-/bar-1.0.0.tgz', '/baz/-/baz-1.0.0.tgz', '/foo/-/foo-1.0.0.tgz'])
+        for name in ('foo', 'bar', 'baz', 'qux'):
+            self.assertTrue(self.frosty.cache.query(name, '1.0.0'))
+
+        for project in ('a', 'b'):
+            self.assertEqual(os.listdir(os.path.join(self.temp_dir, project)), ['npm-shrinkwrap.json'])
+
+
+    def test_prefetch_without_batch(self):
+        self.frosty.config.batch = False
+        self.frosty.prefetch(['a', 'b'])
+
+        self.assertEqual(len(self.registry.requests), 3)
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir, 'a', 'node_modules')))
+
+
+
+    def test_prefetch_relative_cwd(self):
+        cwd = os.getcwd()
+        os.chdir(self.temp_dir)
+
+        try:
+            (self.frosty.config.cwd, self.frosty.config.paths, self.frosty.config.cache_max_size) = ('a', [], None)
+            self.frosty.run_command()
+        finally:
+            os.chdir(cwd)
+
+        self.assertEqual(sorted(self.registry.requests), ['/bar/-/bar-1.0.0.tgz', '/baz/-/baz-1.0.0.tgz', '/foo/-/foo-1.0.0.tgz'])
+
+
+
+    def test_bundle_export_relative_cwd(self):
+        cwd = os.getcwd()
+        os.chdir(self.temp_dir)
+
+        try:
+            self.frosty.prefetch(['b'])
+            (self.frosty.config.cwd, self.frosty.config.command) = ('b', 'bundle')
+            (self.frosty.config.paths, self.frosty.config.cache_max_size) = (['export', 'b.tar'], None)
+            self.frosty.run_command()
+        finally:
+            os.chdir(cwd)
+
+        self.assertTrue(os.path.isfile(os.path.join(self.temp_dir, 'b.tar')))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,98 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from log import Log
+from profiler import Profiler, count_tree
+
+
+class TestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.lines = []
+        self.write = Log.write
+        Log.write = staticmethod(self.lines.append)
+
+
+    def tearDown(self):
+        Log.write = self.write
+        Profiler.enabled = False
+        shutil.rmtree(self.temp_dir)
+
+
+    def test_disabled(self):
+        with Profiler.span('query', 'module', module='foo@1.0.0') as span:
+            self.assertEqual(span, None)
+
+
+    def test_write_chrome_trace(self):
+        Profiler.enable()
+
+        def install(name):
+            with Profiler.span('materialize', 'module', module=name) as span:
+                span['files'] = 3
+
+        with Profiler.span('install modules', 'phase'):
+            threads = [threading.Thread(target=install, args=('m%s@1.0.0' % index,)) for index in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        path = os.path.join(self.temp_dir, 'profile.json')
+        Profiler.write(path)
+
+        with open(path) as file:
+            events = json.load(file)['traceEvents']
+
+        spans = [event for event in events if event['ph'] == 'X']
+        modules = sorted(event['args']['module'] for event in spans if event['cat'] == 'module')
+        thread_names = set(event['tid'] for event in events if event['ph'] == 'M')
+
+        self.assertEqual(modules, ['m0@1.0.0', 'm1@1.0.0', 'm2@1.0.0', 'm3@1.0.0'])
+        self.assertEqual(spans[-1]['name'], 'install modules')
+        self.assertEqual(spans[0]['args']['files'], 3)
+        self.assertTrue(set(event['tid'] for event in spans) <= thread_names)
+
+
+    def test_counts_after_span(self):
+        Profiler.enable()
+
+        with Profiler.span('materialize', 'module', module='foo@1.0.0') as span:
+            pass
+        span['files'] = 3
+
+        self.assertEqual(Profiler.events[-1]['args']['files'], 3)
+
+
+    def test_summarize(self):
+        Profiler.enable()
+
+        for name in ['a@1.0.0', 'b@1.0.0', 'a@1.0.0']:
+            with Profiler.span('query', 'module', module=name):
+                pass
+
+        Profiler.summarize(size=1)
+
+        self.assertTrue(self.lines[0].startswith('Phases:'))
+        self.assertEqual(self.lines[1], 'Slowest modules:')
+        self.assertEqual(len(self.lines), 3)
+
+
+    def test_count_tree(self):
+        os.makedirs(os.path.join(self.temp_dir, 'lib'))
+        os.makedirs(os.path.join(self.temp_dir, 'node_modules', 'dep'))
+        for path in ['index.js', 'lib/a.js', 'node_modules/dep/index.js']:
+            with open(os.path.join(self.temp_dir, path), 'w') as file:
+                file.write('12345')
+
+        self.assertEqual(count_tree(self.temp_dir), {'files': 3, 'bytes': 15})
+        self.assertEqual(count_tree(self.temp_dir, skip_node_modules=True), {'files': 2, 'bytes': 10})
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
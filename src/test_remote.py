@@ -0,0 +1,155 @@
+import os
+import time
+import unittest
+
+from bundle import CacheBundle
+from frosty import Frosty
+from npm import Npm
+from remote_server import RemoteCacheServer
+from testutil import CacheTestCase
+from util import Struct
+
+
+class TestRemoteCache(CacheTestCase):
+
+    def setUp(self):
+        CacheTestCase.setUp(self)
+        self.server = RemoteCacheServer(os.path.join(self.temp_dir, 'remote'))
+        self.server.start()
+
+
+    def tearDown(self):
+        self.server.stop()
+        CacheTestCase.tearDown(self)
+
+
+    def new_cache(self, name, cache_format='tree'):
+        return CacheTestCase.new_cache(self, name, cache_format, Npm, remote_cache=self.server.url, registry=None,
+                                       http_proxy=None, jobs=4)
+
+
+    def add_module(self, cache, name, version, native=False):
+        files = {'cli.js': '#!/usr/bin/env node\n'}
+        if native:
+            files['addon.node'] = b'\x7fELF'
+
+        CacheTestCase.add_module(self, cache, name, version, {'bin': {'cli': 'cli.js'}}, files)
+        cache.remote.wait()
+
+
+    def count_requests(self, cache):
+        requests = []
+        request = cache.remote.fetcher.request
+
+        def counting_request(url, *nargs):
+            requests.append(url)
+            return request(url, *nargs)
+
+        cache.remote.fetcher.request = counting_request
+        return requests
+
+
+    def test_upload_and_download(self):
+        source = self.new_cache('source', 'cas')
+        self.add_module(source, 'foo', '1.0.0')
+        self.add_module(source, '@scope/bar', '2.0.0')
+
+        # no npm: both modules have to come from the remote
+        target = self.new_cache('target')
+        target.add('foo', '1.0.0', 'https://registry.npmjs.org/foo/-/foo-1.0.0.tgz')
+        target.add_many([('@scope/bar', '2.0.0', 'https://registry.npmjs.org/@scope/bar/-/bar-2.0.0.tgz')])
+
+        project_dir = os.path.join(self.temp_dir, 'project')
+        target.materialize_module('@scope/bar', '2.0.0', project_dir)
+
+        self.assertEqual(target.index.get('foo', '1.0.0')['format'], 'cas')
+        self.assertTrue(os.path.isfile(os.path.join(project_dir, 'node_modules', '@scope', 'bar', 'cli.js')))
+        self.assertTrue(os.path.islink(os.path.join(project_dir, 'node_modules', '.bin', 'cli')))
+
+
+    def test_add_many_downloads_in_fetch_workers(self):
+        source = self.new_cache('source')
+        modules = [('m%s' % index, '1.0.0', 'https://registry.npmjs.org/m%s/-/m%s-1.0.0.tgz' % (index, index))
+                   for index in range(4)]
+        for (name, version, _) in modules:
+            self.add_module(source, name, version)
+
+        target = self.new_cache('target')
+        held = []
+        download = target.remote.download
+
+        def locked_download(module_name, module_version):
+            held.append(target.lock('add', module_name, module_version).locked())
+            return download(module_name, module_version)
+
+        target.remote.download = locked_download
+        target.add_many(modules)
+
+        self.assertEqual(held, [True] * 4)
+        self.assertTrue(all(target.query(name, version) for (name, version, _) in modules))
+
+
+    def test_gc_waits_for_uploads(self):
+        config = Struct(cache_dir=os.path.join(self.temp_dir, 'cache'), link_mode='copy', cache_format='tree',
+                        remote_cache=self.server.url, registry=None, http_proxy=None, verbose=False, offline=False,
+                        profile=None, command='gc', paths=[], cache_max_size=0, gc_max_age=30)
+        frosty = Frosty(config)
+        upload = frosty.cache.remote.upload
+
+        def slow_upload(module_name, module_version):
+            time.sleep(0.2)
+            upload(module_name, module_version)
+
+        frosty.cache.remote.upload = slow_upload
+        CacheTestCase.add_module(self, frosty.cache, 'foo', '1.0.0')
+        frosty.run()
+
+        self.assertFalse(frosty.cache.query('foo', '1.0.0'))
+        self.assertTrue(os.path.isfile(os.path.join(self.temp_dir, 'remote', 'any', 'foo', '1.0.0.tgz')))
+
+
+    def test_native_module(self):
+        source = self.new_cache('source')
+        self.add_module(source, 'foo', '1.0.0', native=True)
+
+        target = self.new_cache('target')
+        requests = self.count_requests(target)
+        self.assertTrue(target.remote.download('foo', '1.0.0'))
+
+        self.assertEqual(target.get_entry_version('foo', '1.0.0'), Npm.get_native_version('1.0.0'))
+        self.assertEqual([url.split('/')[3] for url in requests], ['any', Npm.get_host_fingerprint()])
+
+
+    def test_download_other_module(self):
+        source = self.new_cache('source')
+        self.add_module(source, 'foo', '1.0.0')
+        self.add_module(source, 'bar', '1.0.0')
+
+        # the bundle of bar stored where foo's belongs
+        with open(os.path.join(self.temp_dir, 'remote', 'any', 'foo', '1.0.0.tgz'), 'wb') as file:
+            CacheBundle(source).export_modules([('foo', '1.0.0'), ('bar', '1.0.0')], file, compress=True)
+
+        target = self.new_cache('target')
+        self.assertFalse(target.remote.download('foo', '1.0.0'))
+        self.assertFalse(target.query('bar', '1.0.0'))
+
+
+    def test_download_miss(self):
+        cache = self.new_cache('cache')
+        requests = self.count_requests(cache)
+
+        self.assertFalse(cache.remote.download('foo', '1.0.0'))
+        self.assertTrue(cache.remote.available)
+        self.assertEqual(len(requests), 1)
+
+
+    def test_unavailable_remote(self):
+        self.server.stop()
+        cache = self.new_cache('cache')
+
+        self.assertFalse(cache.remote.download('foo', '1.0.0'))
+        self.assertFalse(cache.remote.available)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,61 @@
+import unittest
+
+from errors import UnresolvedDependencies
+from resolver import Resolver
+from testutil import CacheTestCase
+from util import tree
+
+
+class TestResolver(CacheTestCase):
+
+    def setUp(self):
+        CacheTestCase.setUp(self)
+        self.cache = self.new_cache()
+
+        self.add_module('a', '1.0.0')
+        self.add_module('a', '1.2.0', {'b': '^1.0.0'}, pins={'b@1.0.0': {}})
+        self.add_module('b', '1.0.0')
+        self.add_module('b', '1.5.0')
+        self.add_module('b', '2.0.0', {'c': '~2.0.0'})
+        self.add_module('c', '2.0.3', {'b': '^2.0.0'})
+        self.add_module('c', '2.1.0')
+        self.add_module('d', '1.0.0', optional={'e': '^1.0.0'})
+
+
+    def add_module(self, name, version, dependencies=None, optional=None, pins=None):
+        package = {'dependencies': dependencies or {}, 'optionalDependencies': optional or {}}
+        CacheTestCase.add_module(self, self.cache, name, version, package, deps=pins or {})
+
+
+    def test_resolve(self):
+        deps = Resolver(self.cache).resolve({'dependencies': {'a': '^1.0.0', 'c': '~2.0.0'}, 'devDependencies': {'d': '1.x'}})
+        expected = tree()
+
+        a = 'a===1.2.0===https://registry.npmjs.org/a/-/a-1.2.0.tgz'
+        c = 'c===2.0.3===https://registry.npmjs.org/c/-/c-2.0.3.tgz'
+        expected[a]['b===1.0.0===https://registry.npmjs.org/b/-/b-1.0.0.tgz'] = tree()
+        expected[c]['b===2.0.0===https://registry.npmjs.org/b/-/b-2.0.0.tgz'] = tree()
+        expected['d===1.0.0===https://registry.npmjs.org/d/-/d-1.0.0.tgz'] = tree()
+
+        self.assertEqual(deps, expected)
+
+
+    def test_resolve_skips_satisfied_dependencies(self):
+        deps = Resolver(self.cache).resolve({'dependencies': {'a': '1.2.0', 'b': '1.x'}})
+
+        self.assertEqual(sorted(deps.keys()), [
+            'a===1.2.0===https://registry.npmjs.org/a/-/a-1.2.0.tgz',
+            'b===1.5.0===https://registry.npmjs.org/b/-/b-1.5.0.tgz',
+        ])
+        self.assertEqual(deps['a===1.2.0===https://registry.npmjs.org/a/-/a-1.2.0.tgz'], {})
+
+
+    def test_resolve_missing(self):
+        with self.assertRaises(UnresolvedDependencies) as context:
+            Resolver(self.cache).resolve({'dependencies': {'a': '^2.0.0', 'z': '*'}})
+
+        self.assertTrue('z@* (required by package.json)' in str(context.exception))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
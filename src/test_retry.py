@@ -0,0 +1,48 @@
+import errno
+import socket
+import subprocess
+import unittest
+
+from errors import FetchError
+from retry import RetryPolicy
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def test_is_transient(self):
+        self.assertTrue(RetryPolicy.is_transient(FetchError('GET http://a failed (timed out)')))
+        self.assertTrue(RetryPolicy.is_transient(FetchError('GET http://a returned HTTP 503', 503)))
+        self.assertFalse(RetryPolicy.is_transient(FetchError('GET http://a returned HTTP 404', 404)))
+        self.assertTrue(RetryPolicy.is_transient(socket.error(errno.ECONNRESET, 'Connection reset by peer')))
+        self.assertFalse(RetryPolicy.is_transient(IOError(errno.ENOSPC, 'No space left on device')))
+        self.assertFalse(RetryPolicy.is_transient(RuntimeError('Cannot install a on platform Linux')))
+
+
+    def test_is_transient_npm_output(self):
+        reset = subprocess.CalledProcessError(1, ['npm', 'install'], b'npm ERR! code ECONNRESET\nnpm ERR! network aborted\n')
+        missing = subprocess.CalledProcessError(1, ['npm', 'install'], b'npm ERR! code E404\nnpm ERR! 404 Not Found\n')
+
+        self.assertTrue(RetryPolicy.is_transient(reset))
+        self.assertFalse(RetryPolicy.is_transient(missing))
+
+
+    def test_get_delay(self):
+        policy = RetryPolicy(base_delay=1.0, max_delay=5.0, jitter=False)
+        self.assertEqual([policy.get_delay(attempt) for attempt in range(1, 6)], [1.0, 2.0, 4.0, 5.0, 5.0])
+
+        policy = RetryPolicy(base_delay=4.0)
+        for _ in range(100):
+            self.assertTrue(2.0 <= policy.get_delay(1) <= 4.0)
+
+
+    def test_get_retry_delay(self):
+        policy = RetryPolicy(max_attempts=3, base_delay=1.0, max_elapsed=10.0, jitter=False)
+        error = FetchError('GET http://a returned HTTP 502', 502)
+
+        self.assertEqual(policy.get_retry_delay(error, 1, 0.0), 1.0)
+        self.assertEqual(policy.get_retry_delay(error, 3, 0.0), None)
+        self.assertEqual(policy.get_retry_delay(error, 2, 9.0), None)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,147 @@
+import threading
+import unittest
+
+from errors import FetchError
+from manifest import InstallRecord
+from retry import RetryPolicy
+from scheduler import Scheduler
+from util import tree
+
+
+class TestScheduler(unittest.TestCase):
+
+    def test_build_tasks(self):
+        tasks = Scheduler.build_tasks(sample_deps(), '/project')
+
+        self.assertEqual([task.module for task in tasks], ['a', 'd'])
+        self.assertEqual([task.order for task in tasks], [0, 3])
+        self.assertEqual([task.module for task in tasks[0].children], ['b', 'c'])
+        self.assertEqual(tasks[0].children[0].path, '/project/node_modules/a')
+        self.assertEqual(tasks[0].children[0].url, 'http://b')
+
+
+    def test_build_tasks_from_records(self):
+        records = [
+            InstallRecord('/project', 'a', '1.0.0', 'http://a', None),
+            InstallRecord('/project/node_modules/a', 'b', '1.0.0', 'http://b', 0),
+            InstallRecord('/project', 'c', '1.0.0', 'http://c', None),
+        ]
+        tasks = Scheduler.build_tasks_from_records(records)
+
+        self.assertEqual([task.module for task in tasks], ['a', 'c'])
+        self.assertEqual([task.order for task in tasks], [0, 2])
+        self.assertEqual(tasks[0].children[0].key, 'b===1.0.0===http://b')
+        self.assertEqual(tasks[0].children[0].path, '/project/node_modules/a')
+
+
+    def test_run_sequential_is_pre_order(self):
+        installed = []
+        tasks = Scheduler.build_tasks(sample_deps(), '/project')
+        Scheduler(jobs=1).run(tasks, lambda task: installed.append(task.module))
+        self.assertEqual(installed, ['a', 'b', 'c', 'd'])
+
+
+    def test_run_parallel_installs_parents_first(self):
+        installed = []
+        lock = threading.Lock()
+
+        def install(task):
+            with lock:
+                installed.append(task.module)
+
+        tasks = Scheduler.build_tasks(sample_deps(), '/project')
+        Scheduler(jobs=4).run(tasks, install)
+
+        self.assertEqual(set(installed), set(['a', 'b', 'c', 'd']))
+        self.assertTrue(installed.index('a') < installed.index('b'))
+        self.assertTrue(installed.index('a') < installed.index('c'))
+
+
+    def test_run_raises_first_failure_in_tree_order(self):
+        def install(task):
+            if task.module in ['c', 'd']:
+                raise RuntimeError(task.module)
+
+        tasks = Scheduler.build_tasks(sample_deps(), '/project')
+
+        with self.assertRaises(RuntimeError) as context:
+            Scheduler(jobs=4).run(tasks, install)
+
+        self.assertEqual(str(context.exception), 'c')
+
+
+    def test_run_force_continues_after_failure(self):
+        installed = []
+
+        def install(task):
+            if task.module == 'a':
+                raise RuntimeError(task.module)
+            installed.append(task.module)
+
+        tasks = Scheduler.build_tasks(sample_deps(), '/project')
+        failures = Scheduler(jobs=1, force=True).run(tasks, install)
+
+        self.assertEqual(installed, ['b', 'c', 'd'])
+        self.assertEqual([task.module for (task, _) in failures], ['a'])
+
+
+    def test_run_retries_transient_failure_later(self):
+        installed = []
+        failed = []
+
+        def install(task):
+            if task.module == 'a' and not failed:
+                failed.append(task.module)
+                raise FetchError('GET http://a returned HTTP 503', 503)
+            installed.append(task.module)
+
+        tasks = Scheduler.build_tasks(sample_deps(), '/project')
+        scheduler = Scheduler(jobs=1, retry=RetryPolicy(base_delay=0.05, jitter=False))
+        scheduler.run(tasks, install)
+
+        # d does not wait for a, a's children do
+        self.assertEqual(installed, ['d', 'a', 'b', 'c'])
+        self.assertEqual([(task.module, attempts, ok) for (task, attempts, ok) in scheduler.retried.values()], [('a', 2, True)])
+
+
+    def test_run_gives_up_after_max_attempts(self):
+        attempts = []
+
+        def install(task):
+            if task.module == 'd':
+                attempts.append(task.module)
+                raise FetchError('GET http://d failed (timed out)')
+
+        tasks = Scheduler.build_tasks(sample_deps(), '/project')
+        scheduler = Scheduler(jobs=2, force=True, retry=RetryPolicy(max_attempts=3, base_delay=0.01, jitter=False))
+        failures = scheduler.run(tasks, install)
+
+        self.assertEqual(len(attempts), 3)
+        self.assertEqual([task.module for (task, _) in failures], ['d'])
+        self.assertEqual([(attempts, ok) for (_, attempts, ok) in scheduler.retried.values()], [(3, False)])
+
+
+    def test_run_does_not_retry_permanent_failure(self):
+        attempts = []
+
+        def install(task):
+            attempts.append(task.module)
+            raise FetchError('GET http://a returned HTTP 404', 404)
+
+        tasks = Scheduler.build_tasks(sample_deps(), '/project')
+
+        with self.assertRaises(FetchError):
+            Scheduler(jobs=1, retry=RetryPolicy(base_delay=0.01)).run(tasks, install)
+        self.assertEqual(attempts, ['a'])
+
+
+def sample_deps():
+    deps = tree()
+    deps['a===1.0.0===http://a']['b===1.0.0===http://b'] = tree()
+    deps['a===1.0.0===http://a']['c===1.0.0===http://c'] = tree()
+    deps['d===1.0.0===http://d'] = tree()
+    return deps
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
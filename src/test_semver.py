@@ -1,6 +1,6 @@
 import unittest
 
-from semver import parse_semver, sorted_semver, is_explicit
+from semver import Version, is_explicit, max_satisfying, parse_semver, satisfies, semver_cmp, sorted_semver
 
 
 class TestSemver(unittest.TestCase):
@@ -53,6 +53,20 @@ class TestSemver(unittest.TestCase):
             )
 
 
+    def test_semver_cmp(self):
+        self.assertEqual(semver_cmp('1.0.0', '1.0.0+meta'), 0)
+        self.assertEqual(semver_cmp('1.0.0-rc.1', '1.0.0'), -1)
+        self.assertEqual(semver_cmp('1.10.0', '1.9.0'), 1)
+
+
+    def test_version_is_memoized(self):
+        version = Version.parse('2.3.4-rc.1+build')
+
+        self.assertTrue(Version.parse('2.3.4-rc.1+build') is version)
+        self.assertEqual(version.key, (2, 3, 4, 0))
+        self.assertEqual(version.prerelease, 'rc.1')
+
+
     def test_is_explicit(self):
         expectations = [
             ['0.1.0', True],
@@ -79,5 +93,56 @@ class TestSemver(unittest.TestCase):
             )
 
 
+    def test_satisfies(self):
+        expectations = [
+            ['1.2.3', '^1.2.0', True],
+            ['2.0.0', '^1.2.0', False],
+            ['0.2.9', '^0.2.3', True],
+            ['0.3.0', '^0.2.3', False],
+            ['0.0.4', '^0.0.3', False],
+            ['0.9.0', '^0.x', True],
+            ['1.2.9', '~1.2.3', True],
+            ['1.3.0', '~1.2.3', False],
+            ['1.9.0', '~1', True],
+            ['1.2.7', '1.2.x', True],
+            ['1.3.0', '1.2', False],
+            ['5.0.0', '*', True],
+            ['5.0.0', '', True],
+            ['1.5.0', '1.2.3 - 2.3', True],
+            ['2.4.0', '1.2.3 - 2.3', False],
+            ['1.2.2', '1.2.3 - 2.3', False],
+            ['1.3.0', '>1.2', True],
+            ['1.2.9', '>1.2', False],
+            ['1.9.9', '<=1', True],
+            ['2.0.0', '<=1', False],
+            ['2.5.0', '>= 2.1.0 < 3', True],
+            ['3.0.0', '>=2.1.0 <3', False],
+            ['0.5.0', '^1.0.0 || ^0.5.0', True],
+            ['1.2.3', '=v1.2.3', True],
+            ['1.2.3+build', '1.2.3', True],
+            ['1.2.3-beta.2', '^1.2.3-beta.1', True],
+            ['1.2.4-beta.2', '^1.2.3-beta.1', False],
+            ['1.2.3-beta.10', '>1.2.3-beta.9', True],
+            ['1.2.3-beta', '^1.2.0', False],
+        ]
+
+        for (version, range, expected) in expectations:
+            self.assertEqual(satisfies(version, range), expected, 'satisfies(%s, %s) should be %s' % (version, range, expected))
+
+
+    def test_invalid_range(self):
+        self.assertRaises(RuntimeError, satisfies, '1.0.0', '^1.foo')
+
+
+    def test_max_satisfying(self):
+        versions = ['1.0.0', '1.2.0', '1.10.1', '2.0.0-rc.1', '2.0.0', '2.1.0', '3.0.0']
+
+        self.assertEqual(max_satisfying('^1.0.0', versions), '1.10.1')
+        self.assertEqual(max_satisfying('~2.0.0', versions), '2.0.0')
+        self.assertEqual(max_satisfying('>=2.0.0-rc.0 <2.0.0', versions), '2.0.0-rc.1')
+        self.assertEqual(max_satisfying('^4.0.0', versions), None)
+        self.assertEqual(max_satisfying('*', versions), '3.0.0')
+
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)
@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from scheduler import Scheduler
+from state import InstallState
+from util import tree
+
+
+class TestInstallState(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+
+    def test_save_and_load(self):
+        state = InstallState(self.root)
+        os.mkdir(os.path.join(self.root, 'node_modules'))
+
+        for task in Scheduler.iter_tasks(self.build_tasks(old_deps())):
+            state.record(task)
+        state.save()
+
+        loaded = InstallState.load(self.root)
+        self.assertEqual(loaded.modules, state.modules)
+        self.assertEqual(loaded.modules['node_modules/a/node_modules/b'], 'b===1.0.0===u')
+
+
+    def test_load_missing(self):
+        self.assertEqual(InstallState.load(self.root), None)
+
+
+    def test_plan(self):
+        previous = InstallState(self.root)
+        for task in Scheduler.iter_tasks(self.build_tasks(old_deps())):
+            previous.record(task)
+            os.makedirs(os.path.join(self.root, previous.module_dir(task)))
+
+        new_deps = tree()
+        new_deps['a===1.0.0===u']['b===1.0.0===u'] = tree()
+        new_deps['c===2.0.0===u']['e===1.0.0===u'] = tree()
+
+        tasks = self.build_tasks(new_deps)
+        (unchanged, removed) = previous.plan(tasks)
+        unchanged_dirs = set(previous.module_dir(task) for task in Scheduler.iter_tasks(tasks) if task.order in unchanged)
+
+        self.assertEqual(unchanged_dirs, set(['node_modules/a', 'node_modules/a/node_modules/b']))
+        self.assertEqual(removed, ['node_modules/c/node_modules/d'])
+
+        previous.remove(removed)
+        self.assertFalse(os.path.isdir(os.path.join(self.root, 'node_modules/c/node_modules/d')))
+
+
+    def test_plan_missing_directory_is_changed(self):
+        previous = InstallState(self.root)
+        tasks = self.build_tasks(old_deps())
+        for task in Scheduler.iter_tasks(tasks):
+            previous.record(task)
+
+        (unchanged, removed) = previous.plan(tasks)
+        self.assertEqual(unchanged, set())
+        self.assertEqual(removed, [])
+
+
+    def build_tasks(self, deps):
+        return Scheduler.build_tasks(deps, self.root)
+
+
+def old_deps():
+    deps = tree()
+    deps['a===1.0.0===u']['b===1.0.0===u'] = tree()
+    deps['c===1.0.0===u']['d===1.0.0===u'] = tree()
+    return deps
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
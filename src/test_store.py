@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from link import Linker
+from store import BlobStore, TarStore, TgzStore, TreeStore
+
+
+class TestStore(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.temp_dir, 'cache')
+        self.module_dir = os.path.join(self.temp_dir, 'module')
+
+        os.makedirs(os.path.join(self.module_dir, 'node_modules', 'dep'))
+        os.makedirs(os.path.join(self.module_dir, 'bin'))
+        write_file(os.path.join(self.module_dir, 'package.json'), '{"name": "foo", "version": "1.0.0"}')
+        write_file(os.path.join(self.module_dir, 'bin', 'foo'), '#!/usr/bin/env node')
+        write_file(os.path.join(self.module_dir, 'node_modules', 'dep', 'index.js'), '')
+        os.chmod(os.path.join(self.module_dir, 'bin', 'foo'), 0o755)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+
+    def test_tree_store(self):
+        self.assertRoundTrip(TreeStore(self.cache_dir, Linker('copy')))
+
+
+    def test_blob_store(self):
+        self.assertRoundTrip(BlobStore(self.cache_dir, Linker('copy')))
+
+
+    def test_blob_store_hardlink(self):
+        self.assertRoundTrip(BlobStore(self.cache_dir, Linker('hardlink')))
+
+
+    def test_tar_store(self):
+        self.assertRoundTrip(TarStore(self.cache_dir, Linker('copy')))
+
+
+    def test_tgz_store(self):
+        self.assertRoundTrip(TgzStore(self.cache_dir, Linker('copy')))
+
+
+    def test_archive_store_hardlinked_file(self):
+        os.link(os.path.join(self.module_dir, 'package.json'), os.path.join(self.module_dir, 'package.json.orig'))
+
+        for store in [TarStore(self.cache_dir, Linker('copy')), TgzStore(self.cache_dir, Linker('copy'))]:
+            entry_dir = os.path.join(self.cache_dir, store.name)
+            dest_dir = os.path.join(self.temp_dir, 'project', store.name)
+            store.put(self.module_dir, entry_dir)
+            store.materialize(entry_dir, dest_dir)
+
+            for name in ('package.json', 'package.json.orig'):
+                with open(os.path.join(dest_dir, name)) as file:
+                    self.assertEqual(file.read(), '{"name": "foo", "version": "1.0.0"}')
+            self.assertEqual(store.read_file(entry_dir, 'package.json.orig'), b'{"name": "foo", "version": "1.0.0"}')
+
+
+    def test_blob_store_deduplicates(self):
+        store = BlobStore(self.cache_dir, Linker('copy'))
+        store.put(self.module_dir, os.path.join(self.cache_dir, 'foo', '1.0.0'))
+        write_file(os.path.join(self.module_dir, 'CHANGELOG'), 'new in 1.0.1')
+        store.put(self.module_dir, os.path.join(self.cache_dir, 'foo', '1.0.1'))
+
+        blobs = []
+        for root, _, files in os.walk(store.blobs_dir):
+            blobs.extend(files)
+
+        self.assertEqual(len(blobs), 3)
+
+
+    def test_read_file(self):
+        for store in [TreeStore(self.cache_dir, Linker('copy')), BlobStore(self.cache_dir, Linker('copy')),
+                      TarStore(self.cache_dir, Linker('copy')), TgzStore(self.cache_dir, Linker('copy'))]:
+            entry_dir = os.path.join(self.cache_dir, store.name)
+            store.put(self.module_dir, entry_dir)
+            self.assertEqual(store.read_file(entry_dir, 'package.json'), b'{"name": "foo", "version": "1.0.0"}')
+
+
+    def assertRoundTrip(self, store):
+        entry_dir = os.path.join(self.cache_dir, 'foo', '1.0.0')
+        dest_dir = os.path.join(self.temp_dir, 'project', 'node_modules', 'foo')
+
+        store.put(self.module_dir, entry_dir)
+        self.assertTrue(store.is_stored(entry_dir))
+
+        store.materialize(entry_dir, dest_dir)
+        self.assertTrue(os.path.isfile(os.path.join(dest_dir, 'package.json')))
+        self.assertTrue(os.access(os.path.join(dest_dir, 'bin', 'foo'), os.X_OK))
+        self.assertFalse(os.path.exists(os.path.join(dest_dir, 'node_modules')))
+
+
+def write_file(path, data):
+    with open(path, 'w') as file:
+        file.write(data)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
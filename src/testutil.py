@@ -0,0 +1,78 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from cache import Cache
+from util import Struct
+
+
+class CacheTestCase(unittest.TestCase):
+    """Base of tests needing caches and modules in a temporary directory
+
+    Caches made by `new_cache` release their gc lock on tearDown.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.caches = []
+
+
+    def tearDown(self):
+        for cache in self.caches:
+            cache.gc_lock.release()
+        shutil.rmtree(self.temp_dir)
+
+
+    def new_cache(self, name='cache', cache_format='tree', npm=None, **options):
+        """Open a cache in temp_dir/name
+
+        Args:
+            npm (type): Npm class to give the cache, None for no npm.
+            options: More configuration, e.g. remote_cache.
+        """
+        config = Struct(cache_dir=os.path.join(self.temp_dir, name), link_mode='copy', cache_format=cache_format,
+                        **options)
+        cache = Cache(config, npm(config) if npm else None)
+        self.caches.append(cache)
+        return cache
+
+
+    def write_module(self, name, version, package=None, files=None):
+        """Write a module to temp_dir/modules/name/version
+
+        Args:
+            package (dict): More package.json fields. Its `bin` files are
+                made executable.
+            files (dict): Path => contents of more files.
+
+        Returns:
+            str: The module directory.
+        """
+        module_dir = os.path.join(self.temp_dir, 'modules', name, version)
+        os.makedirs(module_dir)
+        package = dict(package or {}, name=name, version=version)
+
+        with open(os.path.join(module_dir, 'package.json'), 'w') as file:
+            json.dump(package, file)
+
+        for (path, contents) in (files or {}).items():
+            file_path = os.path.join(module_dir, path)
+            if not os.path.isdir(os.path.dirname(file_path)):
+                os.makedirs(os.path.dirname(file_path))
+            with open(file_path, 'wb') as file:
+                file.write(contents if isinstance(contents, bytes) else contents.encode('utf-8'))
+
+        for path in (package.get('bin') or {}).values():
+            if os.path.isfile(os.path.join(module_dir, path)):
+                os.chmod(os.path.join(module_dir, path), 0o755)
+
+        return module_dir
+
+
+    def add_module(self, cache, name, version, package=None, files=None, deps=None):
+        """Write a module and copy it to a cache, see `write_module`"""
+        module_dir = self.write_module(name, version, package, files)
+        cache.copy_module_to_cache(module_dir, deps=deps)
+        return module_dir
@@ -1,5 +1,8 @@
+import errno
+import os
 from collections import defaultdict
 
+
 class Struct(object):
     def __init__(self, **kwargs):
         self.__dict__.update(kwargs)
@@ -7,3 +10,22 @@ class Struct(object):
 
 def tree():
     return defaultdict(tree)
+
+
+def make_dirs(path):
+    """Create a directory and its parents, tolerating concurrent creation"""
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def parse_size(value):
+    """Parse a size such as 500M or 20G to a number of bytes"""
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    value = value.strip().upper().rstrip('B')
+
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)